@@ -0,0 +1,75 @@
+'''
+Micro-benchmark of task line parsing, comparing the per-line regex parsing
+used before todomd.tokenizer with the whole-buffer tokenizer.
+
+    python -m benchmarks.bench_tokenizer [--lines N] [--task-ratio R]
+'''
+import argparse
+import re
+import time
+from typing import Callable, List
+
+from todomd import tokenizer
+
+from .generators import generate_lines
+
+
+def _legacy_source(text: str) -> List[tuple]:
+    # What markdown_file._parse_task_line did for every line
+    result = []
+    for line in text.splitlines(keepends=True):
+        match = re.match(r"^\*\s+\[([ xX])\]\s+(.+?)(?:\s+@tid:([a-zA-Z0-9]+))?$", line.strip())
+        if match:
+            checkbox, name, task_id = match.groups()
+            result.append((name, checkbox.lower() == "x", task_id))
+    return result
+
+
+def _legacy_todo(text: str) -> List[tuple]:
+    # What todo_file.read_tasks did for every line
+    result = []
+    for line in text.splitlines(keepends=True):
+        match = re.match(r"^\*\s+\[([ xX])\]\s+(.+?)\s+@([a-zA-Z0-9_-]+):(.*):(.+)$", line.strip())
+        if match:
+            checkbox, name, datasource, path, task_id = match.groups()
+            result.append((name, checkbox.lower() == "x", datasource, path or None, task_id))
+    return result
+
+
+def _tokenizer_source(data: bytes) -> List[tuple]:
+    return [token[1:] for token in tokenizer.iter_source_tokens(data)]
+
+
+def _tokenizer_todo(data: bytes) -> List[tuple]:
+    return [token[1:] for token in tokenizer.iter_todo_tokens(data)]
+
+
+def _rate(fn: Callable[[], List[tuple]], lines: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return lines / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark task line parsing')
+    parser.add_argument('--lines', type=int, default=200_000, help='Lines per generated file')
+    parser.add_argument('--task-ratio', type=float, default=0.1, help='Share of lines that are tasks')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement, the best is kept')
+    args = parser.parse_args()
+
+    for todo, legacy, new in ((False, _legacy_source, _tokenizer_source), (True, _legacy_todo, _tokenizer_todo)):
+        text = generate_lines(args.lines, args.task_ratio, todo)
+        data = text.encode()
+        assert legacy(text) == new(data), "tokenizer and legacy parser disagree"
+
+        before = _rate(lambda: legacy(text), args.lines, args.repeat)
+        after = _rate(lambda: new(data), args.lines, args.repeat)
+        kind = "todo" if todo else "source"
+        print(f"{kind:6}  before: {before:12,.0f} lines/s  after: {after:12,.0f} lines/s  speedup: {after / before:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
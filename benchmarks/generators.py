@@ -0,0 +1,124 @@
+'''
+Generators of synthetic todomd inputs: markdown text, todo files, markdown
+directory trees and Airtable-shaped record sets. Every generator takes a seed
+so that runs on different commits see the same data.
+'''
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from todomd.datasources import markdown_file
+from todomd.model import Task
+
+_PROSE = [
+    "",
+    "## A heading",
+    "Some prose about item {i}, with a [link](https://example.com/{i}).",
+    "- a bullet that is not a task",
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor.",
+]
+
+
+def generate_lines(count: int, task_ratio: float, todo: bool, seed: int = 0) -> str:
+    '''
+    Generate markdown with the given share of task lines, the rest being prose
+    '''
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        if rng.random() < task_ratio:
+            checkbox = rng.choice(" xX")
+            if todo:
+                lines.append(f"* [{checkbox}] Task number {i} @source_{i % 7}:notes/file{i % 50}.md:{i:05x}")
+            else:
+                lines.append(f"* [{checkbox}] Task number {i} @tid:{i:05x}" if i % 2 else f"* [{checkbox}] Task number {i}")
+        else:
+            lines.append(rng.choice(_PROSE).format(i=i))
+    return "\n".join(lines) + "\n"
+
+
+def generate_tasks(count: int, datasource: str, paths: int = 0, seed: int = 0) -> List[Task]:
+    '''
+    Generate tasks for a datasource, spread over the given number of paths
+    (no path when 0). About a quarter of them are completed.
+    '''
+    rng = random.Random(seed)
+    return [
+        Task(
+            id=f"{i:06x}",
+            path=f"notes/file{i % paths}.md" if paths else None,
+            datasource=datasource,
+            name=f"Task number {i} for {datasource}",
+            completed=rng.random() < 0.25
+        )
+        for i in range(count)
+    ]
+
+
+def write_todo_file(file_path: str, tasks: List[Task], prose_ratio: float = 0.1, seed: int = 0) -> None:
+    '''
+    Write a todo file with a line for each task, mixed with some prose lines
+    '''
+    rng = random.Random(seed)
+    lines = ["# Tasks", ""]
+    for i, task in enumerate(tasks):
+        if rng.random() < prose_ratio:
+            lines.append(rng.choice(_PROSE).format(i=i))
+        checkbox = "x" if task.completed else " "
+        lines.append(f"* [{checkbox}] {task.name} @{task.datasource}:{task.path or ''}:{task.id}")
+    with open(file_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def generate_markdown_tree(root: str, files: int, tasks_per_file: int, datasource: str,
+                           files_per_dir: int = 500, seed: int = 0) -> List[Task]:
+    '''
+    Write a tree of markdown files under root, files_per_dir files to a
+    directory, with tasks_per_file tasks each between lines of prose.
+    Every task starts incomplete; half of them have an explicit @tid:.
+    Returns the tasks the markdown_dir datasource reads from the tree.
+    '''
+    rng = random.Random(seed)
+    tasks = []
+    for i in range(files):
+        rel_dir = f"dir{i // files_per_dir:03d}"
+        rel_path = os.path.join(rel_dir, f"note{i:05d}.md")
+        os.makedirs(os.path.join(root, rel_dir), exist_ok=True)
+
+        lines = [f"# Note {i}", ""]
+        for j in range(tasks_per_file):
+            lines.append(rng.choice(_PROSE).format(i=i))
+            name = f"Task {j} of note {i}"
+            if j % 2:
+                task_id = f"{i:05x}{j:02x}"
+                lines.append(f"* [ ] {name} @tid:{task_id}")
+            else:
+                task_id = markdown_file.generate_task_id(name)
+                lines.append(f"* [ ] {name}")
+            tasks.append(Task(id=task_id, path=rel_path, datasource=datasource, name=name, completed=False))
+        with open(os.path.join(root, rel_path), "w") as f:
+            f.write("\n".join(lines) + "\n")
+    return tasks
+
+
+def generate_airtable_records(count: int, name_field: str = "Name", status_field: str = "Status",
+                              statuses: tuple = ("Todo", "Done"), seed: int = 0) -> List[dict]:
+    '''
+    Generate records shaped like the ones the Airtable API returns, with only
+    the name and status fields projected. Some records have no status, since
+    Airtable leaves out empty fields.
+    '''
+    rng = random.Random(seed)
+    created = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    records = []
+    for i in range(count):
+        fields = {name_field: f"Record {i}: {rng.choice(_PROSE[2:]).format(i=i)}"}
+        if rng.random() < 0.95:
+            fields[status_field] = rng.choice(statuses)
+        records.append({
+            "id": f"rec{rng.getrandbits(64):014x}"[:17],
+            "createdTime": (created + timedelta(minutes=i)).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "fields": fields,
+        })
+    return records
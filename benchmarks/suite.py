@@ -0,0 +1,301 @@
+'''
+Benchmark suite timing todomd on synthetic data: todo file reads and writes,
+markdown_dir reads and updates, the datasource diff, Airtable record
+conversion, the whole update run of the command line tool and its start up
+time.
+
+    python -m benchmarks.suite [--output FILE] [--quick] [--only NAME ...] [--compare FILE]
+
+Results are written as JSON together with the commit they were measured on,
+so that runs on different commits can be compared with --compare.
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import yaml
+
+from todomd import datasource, main as todomd_main, task, todo_file
+from todomd.datasources import markdown_dir
+from todomd.model import Task
+
+from . import generators
+
+# Input sizes of a full run; --quick divides the counts by 10
+SIZES = {
+    "todo_tasks": 100_000,
+    "todo_paths": 1_000,
+    "markdown_files": 10_000,
+    "tasks_per_file": 5,
+    "airtable_records": 100_000,
+    "changed_ratio": 0.01,  # Share of the tasks changed by the update benchmarks
+}
+
+
+@dataclass
+class Case:
+    name: str
+    run: Callable[[], Any]
+    setup: Optional[Callable[[], None]] = None  # Called before every run, not timed
+    params: Dict[str, Any] = field(default_factory=dict)
+
+
+def _changed(tasks: List[Task], ratio: float, completed: Optional[bool] = None) -> List[Task]:
+    '''
+    Copies of an evenly spread share of the tasks, with their completion
+    flipped, or set to the given value
+    '''
+    step = max(1, round(1 / ratio))
+    return [replace(t, completed=not t.completed if completed is None else completed) for t in tasks[::step]]
+
+
+def todo_file_cases(work_dir: str, sizes: Dict[str, Any]) -> List[Case]:
+    todo_path = os.path.join(work_dir, "todo.md")
+    tasks = generators.generate_tasks(sizes["todo_tasks"], "source", paths=sizes["todo_paths"])
+    changed = _changed(tasks, sizes["changed_ratio"])
+    new_tasks = generators.generate_tasks(len(changed), "other_source", paths=sizes["todo_paths"], seed=1)
+    params = {"tasks": len(tasks)}
+
+    def write():
+        generators.write_todo_file(todo_path, tasks)
+
+    write()
+    return [
+        Case("todo_file.read_tasks", lambda: todo_file.read_tasks(todo_path), params=params),
+        Case("todo_file.update_tasks", lambda: todo_file.update_tasks(todo_path, changed),
+             setup=write, params={**params, "changed": len(changed)}),
+        # Half of the tasks added are already in the file
+        Case("todo_file.add_tasks", lambda: todo_file.add_tasks(todo_path, new_tasks + changed),
+             setup=write, params={**params, "added": len(new_tasks) + len(changed)}),
+    ]
+
+
+def diff_cases(sizes: Dict[str, Any]) -> List[Case]:
+    tasks = generators.generate_tasks(sizes["todo_tasks"], "source", paths=sizes["todo_paths"])
+    changed = {t.id for t in _changed(tasks, sizes["changed_ratio"])}
+    ds_tasks = [replace(t, completed=not t.completed if t.id in changed else t.completed) for t in tasks]
+    todo_index = task.TaskIndex(tasks)
+    ds_index = task.TaskIndex(ds_tasks)
+    return [
+        Case("task.TaskIndex", lambda: task.TaskIndex(tasks), params={"tasks": len(tasks)}),
+        Case("datasource._calculate_diff", lambda: datasource._calculate_diff(todo_index, ds_index, "source"),
+             params={"tasks": len(tasks), "changed": len(changed)}),
+    ]
+
+
+def markdown_dir_cases(work_dir: str, sizes: Dict[str, Any]) -> List[Case]:
+    tree = os.path.join(work_dir, "notes")
+    tasks = generators.generate_markdown_tree(tree, sizes["markdown_files"], sizes["tasks_per_file"], "notes")
+    params = {"files": sizes["markdown_files"], "tasks": len(tasks)}
+    cold = markdown_dir.MarkdownDir(tree, recursive=True, datasource="notes", use_cache=False)
+    parallel = replace(cold, workers=os.cpu_count() or 1)
+    warm = replace(cold, use_cache=True)
+    markdown_dir.get_tasks(warm)
+
+    # Every other run completes the changed tasks, the runs in between undo it
+    runs = {"count": 0}
+    changed: List[Task] = []
+
+    def choose_changes():
+        changed[:] = _changed(tasks, sizes["changed_ratio"], completed=runs["count"] % 2 == 0)
+        runs["count"] += 1
+
+    cases = [
+        Case("markdown_dir.get_tasks", lambda: markdown_dir.get_tasks(cold), params=params),
+        Case("markdown_dir.get_tasks[cached]", lambda: markdown_dir.get_tasks(warm), params=params),
+        Case("markdown_dir.update_tasks", lambda: markdown_dir.update_tasks(warm, changed),
+             setup=choose_changes, params={**params, "changed": len(_changed(tasks, sizes["changed_ratio"]))}),
+    ]
+    if parallel.workers > 1:
+        cases.insert(1, Case("markdown_dir.get_tasks[workers]", lambda: markdown_dir.get_tasks(parallel),
+                             params={**params, "workers": parallel.workers}))
+    return cases
+
+
+def airtable_cases(sizes: Dict[str, Any]) -> List[Case]:
+    try:
+        from todomd.datasources import airtable
+    except ImportError:
+        # pyairtable isn't installed
+        return []
+
+    conn = airtable.AirtableConnection(
+        base="appBenchmark", table="Tasks", view="", token="", name_field="Name", status_field="Status",
+        completed_value="Done", incompleted_value="Todo", datasource="airtable"
+    )
+    records = generators.generate_airtable_records(sizes["airtable_records"])
+    synced_at = airtable._format_time(datetime.now(timezone.utc))
+
+    def convert():
+        return [airtable._entry_to_task(conn, record["id"], airtable._cache_entry(conn, record, synced_at))
+                for record in records]
+
+    return [Case("airtable.records_to_tasks", convert, params={"records": len(records)})]
+
+
+def main_cases(work_dir: str, sizes: Dict[str, Any]) -> List[Case]:
+    '''
+    The command line tool in update mode, pushing completed tasks from the todo
+    file to a markdown_dir datasource
+    '''
+    root = os.path.join(work_dir, "main")
+    tree = os.path.join(root, "notes")
+    tasks = generators.generate_markdown_tree(tree, sizes["markdown_files"], sizes["tasks_per_file"], "notes", seed=2)
+    changed = _changed(tasks, sizes["changed_ratio"], completed=True)
+    changed_ids = {t.id for t in changed}
+    todo_path = os.path.join(root, "todo.md")
+    generators.write_todo_file(todo_path, [t if t.id not in changed_ids else replace(t, completed=True) for t in tasks], prose_ratio=0)
+
+    config_path = os.path.join(root, "todomd.yml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump({"datasources": {"notes": {"type": "markdown_dir", "dir": tree, "recursive": True}}}, f)
+
+    conn = markdown_dir.MarkdownDir(tree, recursive=True, datasource="notes")
+
+    def reset():
+        markdown_dir.update_tasks(conn, [replace(t, completed=False) for t in changed])
+
+    def run():
+        argv = sys.argv
+        sys.argv = ["todomd", "--config", config_path, "--update-datasources", todo_path]
+        try:
+            todomd_main.main()
+        finally:
+            sys.argv = argv
+
+    return [Case("main --update-datasources", run, setup=reset,
+                 params={"files": sizes["markdown_files"], "tasks": len(tasks), "changed": len(changed)})]
+
+
+def startup_cases(work_dir: str) -> List[Case]:
+    '''
+    Start up of the command line tool in a fresh interpreter, as run from an
+    editor hook, with a markdown only config
+    '''
+    root = os.path.join(work_dir, "startup")
+    os.makedirs(root, exist_ok=True)
+    notes_path = os.path.join(root, "notes.md")
+    with open(notes_path, "w") as f:
+        f.write("* [ ] A task\n")
+    todo_path = os.path.join(root, "todo.md")
+    with open(todo_path, "w") as f:
+        f.write("# Tasks\n")
+    config_path = os.path.join(root, "todomd.yml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump({"datasources": {"notes": {"type": "markdown_file", "file": notes_path}}}, f)
+
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, "-m", "todomd.main", "--config", config_path, "--update-datasources", todo_path]
+
+    def run(args):
+        subprocess.run(args, cwd=repo, check=True)
+
+    run(command)
+    return [
+        Case("startup import", lambda: run([sys.executable, "-c", "import todomd.main"])),
+        Case("startup --update-datasources", lambda: run(command)),
+    ]
+
+
+def measure(case: Case, repeat: int) -> Dict[str, Any]:
+    runs = []
+    for _ in range(repeat):
+        if case.setup:
+            case.setup()
+        start = time.perf_counter()
+        case.run()
+        runs.append(time.perf_counter() - start)
+    return {
+        "name": case.name,
+        "params": case.params,
+        "best": min(runs),
+        "mean": sum(runs) / len(runs),
+        "runs": runs,
+    }
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_results(results: List[Dict[str, Any]], baseline: Dict[str, Dict[str, Any]]) -> None:
+    for result in results:
+        line = f"{result['name']:36} {result['best'] * 1000:10.1f} ms"
+        before = baseline.get(result["name"])
+        if before:
+            line += f"  {result['best'] / before['best']:6.2f}x of {before['best'] * 1000:.1f} ms"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark todomd on synthetic data')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file the results are written to')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark')
+    parser.add_argument('--quick', action='store_true', help='Use inputs a tenth of the full size')
+    parser.add_argument('--files', type=int, help=f'Markdown files in the generated tree (default: {SIZES["markdown_files"]})')
+    parser.add_argument('--only', nargs='+', metavar='NAME', help='Only run benchmarks whose name starts with NAME')
+    parser.add_argument('--compare', metavar='FILE', help='Results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    sizes = dict(SIZES)
+    if args.quick:
+        sizes = {key: value // 10 if isinstance(value, int) and value > 100 else value for key, value in sizes.items()}
+    if args.files:
+        sizes["markdown_files"] = args.files
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {result["name"]: result for result in json.load(f)["results"]}
+
+    with tempfile.TemporaryDirectory(prefix="todomd-bench-") as work_dir:
+        # Keep the caches of the benchmarks away from the user's
+        os.environ["TODOMD_CACHE_DIR"] = os.path.join(work_dir, "cache")
+
+        builders = [
+            ("todo_file", lambda: todo_file_cases(work_dir, sizes)),
+            ("datasource", lambda: diff_cases(sizes)),
+            ("markdown_dir", lambda: markdown_dir_cases(work_dir, sizes)),
+            ("airtable", lambda: airtable_cases(sizes)),
+            ("main", lambda: main_cases(work_dir, sizes)),
+            ("startup", lambda: startup_cases(work_dir)),
+        ]
+        results = []
+        for prefix, build in builders:
+            if args.only and not any(prefix.startswith(name) or name.startswith(prefix) for name in args.only):
+                continue
+            for case in build():
+                if args.only and not any(case.name.startswith(name) for name in args.only):
+                    continue
+                results.append(measure(case, args.repeat))
+                _print_results(results[-1:], baseline)
+
+    report = {
+        "commit": _commit(),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "sizes": sizes,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import json
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+
+# What a handler returns: (status code, JSON body) or (status code, JSON body, headers)
+Reply = Tuple
+
+
+class FakeAirtable(BaseAdapter):
+    '''
+    Transport adapter standing in for the Airtable API. Every request is
+    recorded and answered by the handler, or with an empty page of records.
+    '''
+
+    def __init__(self, handler: Optional[Callable[[requests.PreparedRequest], Reply]] = None):
+        super().__init__()
+        self.handler = handler or (lambda request: (200, {"records": []}))
+        self.requests: List[requests.PreparedRequest] = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        status, body, *rest = self.handler(request)
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(body).encode()
+        response.headers["Content-Type"] = "application/json"
+        response.headers.update(rest[0] if rest else {})
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def body(request: requests.PreparedRequest) -> dict:
+    return json.loads(request.body) if request.body else {}
+
+
+def query(request: requests.PreparedRequest) -> dict:
+    return parse_qs(urlsplit(request.url).query)
@@ -0,0 +1,57 @@
+import unittest
+from unittest.mock import patch
+
+from todomd.datasources import airtable
+from todomd.model import Task
+
+from .fake_airtable import FakeAirtable
+
+
+def _conn(base, datasource, token="key"):
+    return airtable.AirtableConnection(base=base, table="Tasks", view="", token=token, name_field="Name",
+                                       status_field="Status", completed_value="Done", incompleted_value="Todo",
+                                       datasource=datasource, incremental=False)
+
+
+class TestAirtableClient(unittest.TestCase):
+    def setUp(self):
+        airtable._clients.clear()
+
+    def tearDown(self):
+        airtable._clients.clear()
+
+    def test_datasources_on_same_base_share_client(self):
+        first, second = _conn("appA", "work"), _conn("appA", "home")
+        self.assertIs(airtable.client(first), airtable.client(second))
+        self.assertIsNot(airtable.client(first), airtable.client(_conn("appB", "other")))
+        self.assertIsNot(airtable.client(first), airtable.client(_conn("appA", "other", token="other")))
+
+    def test_requests_are_counted(self):
+        conn = _conn("appA", "work")
+        adapter = FakeAirtable()
+        airtable.client(conn).api.session.mount("https://", adapter)
+
+        self.assertEqual(airtable.get_tasks(conn), [])
+        self.assertEqual(airtable.get_tasks(_conn("appA", "home")), [])
+
+        stats = airtable.client(conn).stats
+        self.assertEqual(len(adapter.requests), 2)
+        self.assertEqual((stats.requests, stats.errors), (2, 0))
+        self.assertGreater(stats.seconds, 0)
+
+    def test_every_rate_limited_attempt_is_counted(self):
+        conn = _conn("appA", "work")
+        adapter = FakeAirtable(lambda request: (429, {}))
+        airtable.client(conn).api.session.mount("https://", adapter)
+
+        with patch("time.sleep"):
+            result = airtable.update_tasks(conn, [Task(id="rec1", path=None, datasource="work", name="A", completed=True)])
+
+        self.assertEqual(list(result.failed), [(None, "rec1")])
+        stats = airtable.client(conn).stats
+        self.assertEqual(len(adapter.requests), airtable.MAX_RETRIES + 1)
+        self.assertEqual((stats.requests, stats.errors), (airtable.MAX_RETRIES + 1, airtable.MAX_RETRIES + 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from todomd.datasources import airtable
+
+from .fake_airtable import FakeAirtable, query
+
+
+def _conn(**kwargs):
+    fields = dict(base="appA", table="Tasks", view="", token="key", name_field="Name", status_field="Status",
+                  completed_value="Done", incompleted_value="Todo", datasource="air")
+    return airtable.AirtableConnection(**{**fields, **kwargs})
+
+
+def _record(record_id, name, status):
+    return {"id": record_id, "createdTime": "2024-01-01T00:00:00.000Z", "fields": {"Name": name, "Status": status}}
+
+
+class TestAirtableFetch(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.env = patch.dict(os.environ, {"TODOMD_CACHE_DIR": self.dir.name})
+        self.env.start()
+        airtable._clients.clear()
+        self.records = []
+        self.adapter = FakeAirtable(lambda request: (200, {"records": self.records}))
+        airtable.client(_conn()).api.session.mount("https://", self.adapter)
+
+    def tearDown(self):
+        airtable._clients.clear()
+        self.env.stop()
+        self.dir.cleanup()
+
+    def fetch(self, conn=None):
+        tasks = airtable.get_tasks(conn or _conn())
+        return {t.id: (t.name, t.completed) for t in tasks}
+
+    def formula(self):
+        return query(self.adapter.requests[-1])["filterByFormula"][0]
+
+    def test_full_fetch_then_incremental_merge(self):
+        self.records = [_record("rec1", "One", "Todo"), _record("rec2", "Two", "Done"), _record("rec3", "Three", "Todo")]
+        self.assertEqual(self.fetch(), {"rec1": ("One", False), "rec2": ("Two", True), "rec3": ("Three", False)})
+        self.assertEqual(self.formula(), "OR({Status} = 'Todo', {Status} = 'Done')")
+        self.assertEqual(set(query(self.adapter.requests[-1])["fields[]"]), {"Name", "Status"})
+
+        # Only the records modified since the last sync come back: one renamed and
+        # completed, one moved to a status that isn't synced, one new
+        self.records = [_record("rec1", "One v2", "Done"), _record("rec3", "Three", "Archived"), _record("rec4", "Four", "Todo")]
+        self.assertEqual(self.fetch(), {"rec1": ("One v2", True), "rec2": ("Two", True), "rec4": ("Four", False)})
+        self.assertTrue(self.formula().startswith("IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('"))
+
+    def test_pages_are_retried_when_rate_limited(self):
+        replies = [(429, {}), (200, {"records": [_record("rec1", "One", "Todo")], "offset": "page2"}),
+                   (503, {}), (200, {"records": [_record("rec2", "Two", "Done")]})]
+        self.adapter.handler = lambda request: replies.pop(0)
+
+        with patch("time.sleep") as sleep:
+            self.assertEqual(self.fetch(_conn(incremental=False)), {"rec1": ("One", False), "rec2": ("Two", True)})
+
+        self.assertEqual(len(self.adapter.requests), 4)
+        self.assertEqual(query(self.adapter.requests[-1])["offset"], ["page2"])
+        # Waits left by the rate limiter are short, the 429 is waited out in full
+        delays = [c.args[0] for c in sleep.call_args_list if c.args[0] >= 1]
+        self.assertGreaterEqual(delays[0], airtable.RATE_LIMIT_DELAY)
+
+    def test_full_fetch_after_interval_drops_deleted_records(self):
+        self.records = [_record("rec1", "One", "Todo"), _record("rec2", "Two", "Todo")]
+        self.fetch()
+
+        self.records = [_record("rec1", "One", "Todo")]
+        self.assertEqual(self.fetch(_conn(full_sync_interval=0)), {"rec1": ("One", False)})
+        self.assertEqual(self.formula(), "OR({Status} = 'Todo', {Status} = 'Done')")
+
+    def test_records_are_fetched_again_without_incremental(self):
+        self.records = [_record("rec1", "One", "Todo")]
+        self.fetch(_conn(incremental=False))
+        self.fetch(_conn(incremental=False))
+        self.assertEqual(self.formula(), "OR({Status} = 'Todo', {Status} = 'Done')")
+        self.assertEqual(os.listdir(self.dir.name), [])
+
+    def test_formulas(self):
+        self.assertEqual(airtable._quote("it's a \\ test"), "'it\\'s a \\\\ test'")
+        since = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+        self.assertEqual(airtable._modified_formula(_conn(last_modified_field="Updated"), since),
+                         "IS_AFTER({Updated}, DATETIME_PARSE('2024-05-01T12:30:00.000Z'))")
+        self.assertEqual(airtable._status_formula(_conn(completed_value="It's done")),
+                         "OR({Status} = 'Todo', {Status} = 'It\\'s done')")
+
+
+if __name__ == '__main__':
+    unittest.main()
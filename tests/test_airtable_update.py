@@ -0,0 +1,106 @@
+import unittest
+from unittest.mock import patch
+
+from todomd.datasources import airtable
+from todomd.model import Task
+
+from .fake_airtable import FakeAirtable, body
+
+
+def _conn():
+    return airtable.AirtableConnection(base="appA", table="Tasks", view="", token="key", name_field="Name",
+                                       status_field="Status", completed_value="Done", incompleted_value="Todo",
+                                       datasource="air", incremental=False)
+
+
+def _task(record_id, completed=True):
+    return Task(id=record_id, path=None, datasource="air", name=record_id, completed=completed)
+
+
+def _echo(request):
+    return 200, {"records": [dict(record, createdTime="2024-01-01T00:00:00.000Z") for record in body(request)["records"]]}
+
+
+class TestAirtableUpdate(unittest.TestCase):
+    def setUp(self):
+        airtable._clients.clear()
+        airtable._rate_limiters.clear()
+        self.patches = [patch.object(airtable, "REQUESTS_PER_SECOND", 1000), patch("time.sleep")]
+        self.sleep = [p.start() for p in self.patches][1]
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        airtable._clients.clear()
+        airtable._rate_limiters.clear()
+
+    def fake(self, handler):
+        adapter = FakeAirtable(handler)
+        airtable.client(_conn()).api.session.mount("https://", adapter)
+        return adapter
+
+    def test_only_update_tasks_retries(self):
+        # Retries in the HTTP adapter would multiply the ones done here, hidden from them
+        for adapter in airtable.client(_conn()).api.session.adapters.values():
+            self.assertEqual(adapter.max_retries.total, 0)
+
+    def test_records_are_sent_in_batches(self):
+        adapter = self.fake(_echo)
+        tasks = [_task(f"rec{i}", completed=i % 2 == 0) for i in range(25)] + [_task("rec0", completed=False)]
+
+        result = airtable.update_tasks(_conn(), tasks)
+
+        self.assertEqual([len(body(r)["records"]) for r in adapter.requests], [10, 10, 5])
+        self.assertEqual(sorted(result.updated), sorted((None, f"rec{i}") for i in range(25)))
+        # The last entry for a record wins
+        self.assertEqual(body(adapter.requests[0])["records"][0], {"id": "rec0", "fields": {"Status": "Todo"}})
+
+    def test_rate_limited_and_server_errors_are_retried(self):
+        replies = [(429, {}, {"Retry-After": "2"}), (503, {})]
+        adapter = self.fake(lambda request: replies.pop(0) if replies else _echo(request))
+
+        result = airtable.update_tasks(_conn(), [_task("rec1")])
+
+        self.assertEqual(result.updated, [(None, "rec1")])
+        self.assertEqual(len(adapter.requests), 3)
+        self.assertEqual(self.sleep.call_args_list[0].args, (2.0,))
+
+    def test_persistent_rate_limit_gives_up(self):
+        adapter = self.fake(lambda request: (429, {}))
+
+        result = airtable.update_tasks(_conn(), [_task(f"rec{i}") for i in range(15)])
+
+        # The first batch isn't split up, and the second isn't sent
+        self.assertEqual(sorted(result.failed), sorted((None, f"rec{i}") for i in range(15)))
+        self.assertEqual(len(adapter.requests), airtable.MAX_RETRIES + 1)
+        # Each retry waits out the lockout Airtable imposes after a 429
+        delays = [c.args[0] for c in self.sleep.call_args_list]
+        self.assertEqual(len(delays), airtable.MAX_RETRIES)
+        self.assertTrue(all(delay >= airtable.RATE_LIMIT_DELAY for delay in delays))
+
+    def test_server_error_is_not_retried_one_record_at_a_time(self):
+        adapter = self.fake(lambda request: (503, {}))
+
+        result = airtable.update_tasks(_conn(), [_task("rec1"), _task("rec2")])
+
+        self.assertEqual(sorted(result.failed), [(None, "rec1"), (None, "rec2")])
+        self.assertEqual(len(adapter.requests), airtable.MAX_RETRIES + 1)
+
+    def test_failed_batch_is_retried_one_record_at_a_time(self):
+        def handler(request):
+            ids = [record["id"] for record in body(request)["records"]]
+            if "bad" in ids:
+                return 422, {"error": {"type": "INVALID_VALUE_FOR_COLUMN"}}
+            return _echo(request)
+        adapter = self.fake(handler)
+
+        result = airtable.update_tasks(_conn(), [_task("rec1"), _task("bad"), _task("rec2")])
+
+        self.assertEqual(result.updated, [(None, "rec1"), (None, "rec2")])
+        self.assertEqual(list(result.failed), [(None, "bad")])
+        # One batch, then each record on its own, with no retries of the client error
+        self.assertEqual(len(adapter.requests), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
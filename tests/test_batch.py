@@ -0,0 +1,50 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from todomd import batch, datasource, query, task, todo_file
+from todomd.model import Datasource, Task
+
+
+def _task(task_id, name, completed=False):
+    return Task(id=task_id, path=None, datasource="notes", name=name, completed=completed)
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.env = patch.dict(os.environ, {"TODOMD_CACHE_DIR": os.path.join(self.dir.name, "cache")})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.dir.cleanup()
+
+    def test_selected_tasks_are_added_and_reported(self):
+        todo_path = os.path.join(self.dir.name, "todo.md")
+        with open(todo_path, "w") as f:
+            f.write("* [ ] Old @notes::a\n")
+
+        ds_tasks = [_task("a", "Old", completed=True), _task("b", "Review"), _task("c", "Other")]
+        stream = datasource.stream_tasks({"notes": Datasource(get_tasks=lambda: ds_tasks, update_tasks=None)})
+        doc = todo_file.TodoDocument.load(todo_path)
+        out = io.StringIO()
+        events = batch.JsonLines(out)
+
+        candidates = batch.select_tasks(stream, task.TaskIndex(doc.tasks), query.parse("name~Rev"), events)
+        batch.sync_todo_file(doc, task.TaskIndex(stream.wait()), candidates, events)
+        events.summary()
+
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([(e["event"], e.get("task", {}).get("id")) for e in lines],
+                         [("candidate", "b"), ("updated", "a"), ("added", "b"), ("summary", None)])
+        self.assertEqual(lines[-1], {"event": "summary", "candidate": 1, "updated": 1, "added": 1})
+        with open(todo_path) as f:
+            self.assertEqual(f.read(), "* [x] Old @notes::a\n* [ ] Review @notes::b\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
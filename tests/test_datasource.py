@@ -0,0 +1,58 @@
+import threading
+import time
+import unittest
+
+from todomd import datasource
+from todomd.model import Datasource, Task
+
+
+def _task(task_id, ds_name):
+    return Task(id=task_id, path=None, datasource=ds_name, name=task_id, completed=False)
+
+
+class TestTaskStream(unittest.TestCase):
+    def test_streamed_tasks_arrive_before_slow_datasource_finishes(self):
+        release = threading.Event()
+
+        def slow():
+            yield _task("s1", "slow")
+            release.wait(5)
+            yield _task("s2", "slow")
+
+        datasources = {
+            "slow": Datasource(get_tasks=lambda: list(slow()), update_tasks=lambda tasks: None, iter_tasks=slow),
+            "list": Datasource(get_tasks=lambda: [_task("l1", "list"), _task("l2", "list")], update_tasks=lambda tasks: None),
+        }
+        stream = datasource.stream_tasks(datasources, workers=2)
+
+        received = []
+        deadline = time.monotonic() + 5
+        while len(received) < 3 and time.monotonic() < deadline:
+            received.extend(t.id for t in stream.poll(0.1))
+        self.assertEqual(sorted(received), ["l1", "l2", "s1"])
+        self.assertTrue(stream.status["list"].done)
+        self.assertFalse(stream.finished)
+
+        release.set()
+        self.assertEqual(sorted(t.id for t in stream.wait()), ["l1", "l2", "s1", "s2"])
+        self.assertEqual(stream.status["slow"].tasks, 2)
+
+    def test_tasks_after_timeout_are_dropped(self):
+        def stalled():
+            yield _task("a", "stalled")
+            time.sleep(0.5)
+            yield _task("b", "stalled")
+
+        datasources = {
+            "stalled": Datasource(get_tasks=lambda: list(stalled()), update_tasks=lambda tasks: None,
+                                  timeout=0.1, iter_tasks=stalled),
+        }
+        stream = datasource.stream_tasks(datasources)
+        self.assertEqual([t.id for t in stream.wait()], ["a"])
+        self.assertTrue(stream.status["stalled"].timed_out)
+        time.sleep(0.6)
+        self.assertEqual(stream.poll(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
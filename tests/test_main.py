@@ -0,0 +1,84 @@
+import datetime
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from todomd import main, sync, todo_file
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestMain(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.env = patch.dict(os.environ, {"TODOMD_CACHE_DIR": os.path.join(self.dir.name, "cache")})
+        self.env.start()
+        self.addCleanup(self.env.stop)
+        self.config_path = os.path.join(self.dir.name, "todomd.yml")
+
+    def _write_config(self, text):
+        with open(self.config_path, "w") as f:
+            f.write(text)
+
+    def test_config_is_read_without_copying_it(self):
+        self._write_config("workers: 2\ndatasources:\n  air:\n    type: airtable\n    api_key: secret\n")
+        self.assertEqual(main.read_config(self.config_path)["workers"], 2)
+        # Tokens in the config are not copied anywhere else
+        self.assertFalse(os.path.exists(os.path.join(self.dir.name, "cache")))
+
+        self._write_config("workers: 3\ndatasources: {}\n")
+        self.assertEqual(main.read_config(self.config_path)["workers"], 3)
+
+    def test_profile_flag_leaves_file_argument_alone(self):
+        args = main.build_parser().parse_args(["--profile", "my_tasks.md"])
+        self.assertEqual((args.profile, args.profile_output, args.file), (True, None, "my_tasks.md"))
+
+        args = main.build_parser().parse_args(["--profile-output", "profile.json", "--batch", "my_tasks.md"])
+        self.assertEqual((args.profile_output, args.file), ("profile.json", "my_tasks.md"))
+
+    def test_archive_only_moves_lines_still_removed(self):
+        todo_path = os.path.join(self.dir.name, "todo.md")
+        with open(todo_path, "w") as f:
+            f.write("* [x] One @air::rec1\n* [x] Two @air::rec2\n* [ ] Three @air::rec3\n")
+        doc = todo_file.TodoDocument.load(todo_path)
+        state = sync.SyncState.load(todo_path)
+        state.record(doc.tasks)
+
+        # Another run reopens a task after this one read the file
+        with open(todo_path, "w") as f:
+            f.write("* [x] One @air::rec1\n* [ ] Two @air::rec2\n* [ ] Three @air::rec3\n")
+        os.utime(todo_path, ns=(1, 1))
+        main.archive_tasks(doc, state)
+
+        with open(todo_path) as f:
+            self.assertEqual(f.read(), "* [ ] Two @air::rec2\n* [ ] Three @air::rec3\n")
+        with open(todo_file.archive_path(todo_path, datetime.date.today())) as f:
+            self.assertEqual(f.read().splitlines()[2:], ["* [x] One @air::rec1"])
+
+    def test_update_mode_skips_ui_and_unused_datasources(self):
+        notes_path = os.path.join(self.dir.name, "notes.md")
+        todo_path = os.path.join(self.dir.name, "todo.md")
+        with open(notes_path, "w") as f:
+            f.write("* [ ] A task\n")
+        with open(todo_path, "w") as f:
+            f.write("# Tasks\n")
+        self._write_config(f"datasources:\n  notes:\n    type: markdown_file\n    file: {notes_path}\n")
+
+        script = (
+            "import sys\n"
+            f"sys.argv = ['todomd', '--config', {self.config_path!r}, '--update-datasources', {todo_path!r}]\n"
+            "from todomd import main\n"
+            "main.main()\n"
+            "print(sorted(m for m in ('curses', 'todomd.ui', 'pyairtable', 'todomd.datasources.airtable') if m in sys.modules))\n"
+        )
+        output = subprocess.run([sys.executable, "-c", script], cwd=REPO, env=dict(os.environ),
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), "[]")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from todomd.datasources import markdown_dir
+
+
+class TestMarkdownDir(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.env = patch.dict(os.environ, {"TODOMD_CACHE_DIR": os.path.join(self.dir.name, "cache")})
+        self.env.start()
+        self.root = os.path.join(self.dir.name, "notes")
+        self.files = []
+        for rel_path in ("b.md", "a.md", "skip.txt", "x/c.md", "x/y/d.md", "z/e.md"):
+            self.write_tasks(rel_path)
+
+    def tearDown(self):
+        self.env.stop()
+        self.dir.cleanup()
+
+    def write(self, rel_path, text):
+        path = os.path.join(self.root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(text)
+
+    def write_tasks(self, rel_path):
+        self.write(rel_path, "".join(f"* [ ] {rel_path} {i}\n* [x] Done {i}\n" for i in range(3)))
+
+    def conn(self, **kwargs):
+        return markdown_dir.MarkdownDir(self.root, recursive=True, datasource="dir", **kwargs)
+
+    def test_scan_order_matches_glob(self):
+        for recursive, pattern in ((True, "**/*.md"), (False, "*.md")):
+            expected = [str(path.relative_to(self.root)) for path in Path(self.root).glob(pattern)]
+            scanned = [rel_path for _, rel_path, _ in markdown_dir._scan(self.root, recursive)]
+            self.assertEqual(scanned, expected)
+
+    def test_parallel_parse_matches_serial(self):
+        serial = list(markdown_dir.get_tasks(self.conn(use_cache=False)))
+        self.assertEqual(len(serial), 15)
+        self.assertTrue(all(not t.completed for t in serial))
+
+        # Chunks smaller than the number of files, with part of them already in the cache
+        markdown_dir.get_tasks(markdown_dir.MarkdownDir(os.path.join(self.root, "x"), recursive=False, datasource="dir"))
+        with patch.object(markdown_dir, "PARSE_CHUNK_SIZE", 2):
+            parallel = list(markdown_dir.get_tasks(self.conn(workers=2)))
+        self.assertEqual(parallel, serial)
+
+    def test_write_back_reports_each_file_in_order(self):
+        real_update = markdown_dir.markdown_file.update_tasks
+
+        def update(conn, file_tasks, **kwargs):
+            if conn.file.endswith("e.md"):
+                raise OSError("disk full")
+            return real_update(conn, file_tasks, **kwargs)
+
+        for write_workers in (1, 4):
+            with self.subTest(write_workers=write_workers):
+                self.write_tasks("a.md")
+                self.write_tasks("x/c.md")
+                tasks = {t.name: t for t in markdown_dir.get_tasks(self.conn(use_cache=False))}
+                sent = [tasks["x/c.md 1"], tasks["a.md 0"], tasks["x/c.md 2"], tasks["z/e.md 0"]]
+                for t in sent[:2] + sent[3:]:
+                    t.completed = True
+
+                with patch.object(markdown_dir.markdown_file, "update_tasks", update):
+                    results = markdown_dir.write_back(self.conn(write_workers=write_workers), sent)
+
+                # In the order the files first appear in the tasks, however many are written at once
+                self.assertEqual([(r.path, r.updated, r.skipped, r.error) for r in results], [
+                    ("x/c.md", [("x/c.md", sent[0].id)], [("x/c.md", sent[2].id)], None),
+                    ("a.md", [("a.md", sent[1].id)], [], None),
+                    ("z/e.md", [], [("z/e.md", sent[3].id)], "disk full"),
+                ])
+
+    def test_same_task_in_two_files_is_reported_per_file(self):
+        self.write("a.md", "* [ ] Write summary\n")
+        self.write("b.md", "* [ ] Write summary\n")
+        tasks = [t for t in markdown_dir.get_tasks(self.conn(use_cache=False)) if t.name == "Write summary"]
+        self.assertEqual(len({t.id for t in tasks}), 1)
+        for t in tasks:
+            t.completed = True
+
+        real_update = markdown_dir.markdown_file.update_tasks
+
+        def update(conn, file_tasks, **kwargs):
+            if conn.file.endswith("b.md"):
+                raise OSError("disk full")
+            return real_update(conn, file_tasks, **kwargs)
+
+        with patch.object(markdown_dir.markdown_file, "update_tasks", update):
+            result = markdown_dir.update_tasks(self.conn(), tasks)
+
+        task_id = tasks[0].id
+        self.assertEqual(result.updated, [("a.md", task_id)])
+        self.assertEqual(result.failed, {("b.md", task_id): "b.md: disk full"})
+
+    def test_missing_directory_has_no_tasks(self):
+        conn = markdown_dir.MarkdownDir(os.path.join(self.root, "missing"), recursive=True, datasource="dir", workers=2)
+        self.assertEqual(list(markdown_dir.get_tasks(conn)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from todomd import parse_cache
+from todomd.datasources import markdown_file
+from todomd.model import Task
+
+
+class TestMarkdownFileUpdate(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "tasks.md")
+        with open(self.path, "wb") as f:
+            f.write(b"# Project\n  * [ ] Alpha\r\n* [ ] Beta @tid:b1\nNotes\n")
+        self.conn = markdown_file.MarkdownFile(self.path, "md", use_cache=False)
+        self.env = patch.dict(os.environ, {"TODOMD_CACHE_DIR": os.path.join(self.dir.name, "cache")})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.dir.cleanup()
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def test_checkbox_change_is_patched_in_place(self):
+        inode = os.stat(self.path).st_ino
+        alpha = markdown_file.generate_task_id("Alpha")
+
+        result = markdown_file.update_tasks(self.conn, [
+            Task(id=alpha, path=None, datasource="md", name="Alpha", completed=True),
+            Task(id="b1", path=None, datasource="md", name="Beta", completed=False),
+        ])
+
+        self.assertEqual(result.updated, [(None, alpha)])
+        self.assertEqual(result.skipped, [(None, "b1")])
+        self.assertEqual(self.read(), b"# Project\n  * [x] Alpha\r\n* [ ] Beta @tid:b1\nNotes\n")
+        # Patched in place rather than replaced
+        self.assertEqual(os.stat(self.path).st_ino, inode)
+
+    def test_patched_file_is_saved_to_parse_cache(self):
+        conn = markdown_file.MarkdownFile(self.path, "md")
+        # The process wide cache, under this test's cache directory
+        self.enterContext(patch.object(parse_cache, "_cache", None))
+        markdown_file.get_tasks(conn)
+        opened = []
+        real_open = os.open
+        with patch("os.open", side_effect=lambda path, flags, *args: opened.append((path, flags)) or real_open(path, flags, *args)):
+            markdown_file.update_tasks(conn, [Task(id="b1", path=None, datasource="md", name="Beta", completed=False)])
+        self.assertNotIn((self.path, os.O_RDWR), opened)
+
+        markdown_file.update_tasks(conn, [Task(id="b1", path=None, datasource="md", name="Beta", completed=True)])
+
+        # Read back by a later run, without parsing the file again
+        cache = parse_cache.ParseCache(parse_cache.get_cache().path)
+        self.assertEqual([completed for _, _, completed, _ in cache.get(self.path, os.stat(self.path))], [False, True])
+
+    def test_rename_rewrites_line_and_keeps_id(self):
+        alpha = markdown_file.generate_task_id("Alpha")
+
+        result = markdown_file.update_tasks(self.conn, [
+            Task(id=alpha, path=None, datasource="md", name="Alpha v2", completed=True),
+        ])
+
+        self.assertEqual(result.updated, [(None, alpha)])
+        self.assertEqual(self.read(), f"# Project\n  * [x] Alpha v2 @tid:{alpha}\r\n* [ ] Beta @tid:b1\nNotes\n".encode())
+        self.assertEqual([t.id for t in markdown_file.get_tasks(self.conn)], ["b1"])
+
+    def test_backfill_gives_each_line_its_own_id(self):
+        with open(self.path, "ab") as f:
+            f.write(b"* [x] Alpha\n")
+
+        mapping = markdown_file.backfill_ids(self.conn)
+
+        tasks = markdown_file.parse_file(self.path)
+        ids = [task_id for task_id, _, _, _ in tasks]
+        self.assertEqual(ids[1], "b1")
+        self.assertEqual(len(set(ids)), 3)
+        self.assertTrue(all(len(task_id) == markdown_file.BACKFILL_ID_LENGTH for task_id in ids[::2]))
+        # The generated id pointed at the last Alpha line, so that is where it now goes
+        self.assertEqual(mapping, {(None, markdown_file.generate_task_id("Alpha")): ids[2]})
+        self.assertEqual(self.read(), f"# Project\n  * [ ] Alpha @tid:{ids[0]}\r\n* [ ] Beta @tid:b1\nNotes\n"
+                                      f"* [x] Alpha @tid:{ids[2]}\n".encode())
+        self.assertEqual(markdown_file.backfill_ids(self.conn), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
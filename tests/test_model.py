@@ -0,0 +1,18 @@
+import pickle
+import unittest
+
+from todomd.model import Task
+
+
+class TestTask(unittest.TestCase):
+    def test_strings_are_shared(self):
+        first = Task(id="a", path="".join(["notes/", "a.md"]), datasource="".join(["dir", "1"]), name="A", completed=False)
+        second = Task(id="b", path="".join(["notes/", "a.md"]), datasource="".join(["dir", "1"]), name="B", completed=True)
+        self.assertIs(first.path, second.path)
+        self.assertIs(first.datasource, second.datasource)
+        self.assertFalse(hasattr(first, "__dict__"))
+        self.assertEqual(pickle.loads(pickle.dumps(first)), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from todomd import parse_cache
+from todomd.parse_cache import ParseCache
+
+
+class TestParseCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "cache.pickle")
+        self.file = os.path.join(self.dir.name, "a.md")
+        self.write(self.file, "* [ ] A\n")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, path, text, mtime=None):
+        with open(path, "w") as f:
+            f.write(text)
+        if mtime is not None:
+            os.utime(path, ns=(mtime, mtime))
+
+    def test_entry_is_dropped_when_file_changes(self):
+        cache = ParseCache(self.path)
+        cache.put(self.file, os.stat(self.file), ["A"])
+        cache.save()
+
+        cache = ParseCache(self.path)
+        self.assertEqual(cache.get(self.file, os.stat(self.file)), ["A"])
+        self.write(self.file, "* [x] A\n", mtime=1)
+        self.assertIsNone(cache.get(self.file, os.stat(self.file)))
+
+    def test_prune(self):
+        st = os.stat(self.file)
+        cache = ParseCache(self.path)
+        for name in ("a.md", "b.md", os.path.join("sub", "c.md"), os.path.join("sub", "d.md")):
+            cache.put(os.path.join(self.dir.name, name), st, name)
+
+        cache.prune(self.dir.name, [os.path.join(self.dir.name, "a.md")], recursive=False)
+        self.assertEqual(sorted(cache._entries), [os.path.join(self.dir.name, name)
+                                                  for name in ("a.md", "sub/c.md", "sub/d.md")])
+
+        cache.prune(self.dir.name, [os.path.join(self.dir.name, "a.md"), os.path.join(self.dir.name, "sub", "c.md")])
+        self.assertEqual(sorted(cache._entries), [os.path.join(self.dir.name, name) for name in ("a.md", "sub/c.md")])
+
+    def test_least_recently_used_entries_are_evicted(self):
+        st = os.stat(self.file)
+        cache = ParseCache(self.path, max_entries=2)
+        with patch("time.time", side_effect=[1.0, 2.0, 3.0]):
+            for name in ("a", "b", "c"):
+                cache.put(name, st, name)
+        cache.save()
+        cache = ParseCache(self.path, max_entries=2)
+        self.assertEqual(sorted(cache._entries), ["b", "c"])
+
+        # A hit long enough after the last use is kept as a use, so "b" outlives "c"
+        with patch("time.time", return_value=2.0 + parse_cache.TOUCH_INTERVAL):
+            self.assertEqual(cache.get("b", st), "b")
+        cache.save()
+        cache = ParseCache(self.path, max_entries=2)
+        with patch("time.time", return_value=3.0 + parse_cache.TOUCH_INTERVAL):
+            cache.put("d", st, "d")
+        cache.save()
+        self.assertEqual(sorted(ParseCache(self.path)._entries), ["b", "d"])
+
+    def test_corrupt_cache_is_rebuilt(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not a pickle")
+
+        cache = ParseCache(self.path)
+        self.assertIsNone(cache.get(self.file, os.stat(self.file)))
+        cache.put(self.file, os.stat(self.file), ["A"])
+        cache.save()
+        self.assertEqual(ParseCache(self.path).get(self.file, os.stat(self.file)), ["A"])
+
+
+if __name__ == '__main__':
+    unittest.main()
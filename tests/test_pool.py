@@ -0,0 +1,36 @@
+import time
+import unittest
+
+from todomd import pool
+
+
+class TestPool(unittest.TestCase):
+    def test_results_keep_job_order(self):
+        jobs = {
+            "slow": lambda: time.sleep(0.2) or "slow",
+            "fast": lambda: "fast",
+        }
+        results = pool.run_bounded(jobs, workers=2, timeouts={})
+        self.assertEqual([r.name for r in results], ["slow", "fast"])
+        self.assertEqual([r.value for r in results], ["slow", "fast"])
+
+    def test_timeout_frees_slot(self):
+        jobs = {
+            "stuck": lambda: time.sleep(5),
+            "next": lambda: "done",
+        }
+        start = time.monotonic()
+        stuck, after = pool.run_bounded(jobs, workers=1, timeouts={"stuck": 0.1})
+        self.assertTrue(stuck.timed_out)
+        self.assertEqual(after.value, "done")
+        self.assertLess(time.monotonic() - start, 2)
+
+    def test_errors_are_captured(self):
+        def fail():
+            raise ValueError("boom")
+        [result] = pool.run_bounded({"bad": fail}, workers=1, timeouts={})
+        self.assertIsInstance(result.error, ValueError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+from todomd import query
+from todomd.model import Task
+
+
+def _task(name, path=None, datasource="work", completed=False):
+    return Task(id="t", path=path, datasource=datasource, name=name, completed=completed)
+
+
+class TestQuery(unittest.TestCase):
+    def test_conditions_must_all_hold(self):
+        matches = query.parse('datasource=work* path=projects/*.md name~"(?i)weekly review"')
+        self.assertTrue(matches(_task("Weekly review", "projects/a.md", "work_notes")))
+        self.assertFalse(matches(_task("Weekly review", "inbox.md", "work_notes")))
+        self.assertFalse(matches(_task("Weekly review", "projects/a.md", "home")))
+        self.assertFalse(matches(_task("Monthly review", "projects/a.md", "work")))
+
+    def test_status_defaults_to_open(self):
+        self.assertFalse(query.parse("")(_task("Done", completed=True)))
+        self.assertTrue(query.parse("status=done")(_task("Done", completed=True)))
+        self.assertTrue(query.parse("status=any name!=Skip*")(_task("Done", completed=True)))
+        self.assertFalse(query.parse("name!~^Skip")(_task("Skip me")))
+
+    def test_invalid_expressions(self):
+        for expression in ("owner=me", "status~open", "status=later", "name~(", 'name="unclosed'):
+            with self.assertRaises(ValueError):
+                query.parse(expression)
+
+
+if __name__ == '__main__':
+    unittest.main()
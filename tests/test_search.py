@@ -0,0 +1,30 @@
+import unittest
+
+from todomd.search import TrigramIndex
+
+
+class TestTrigramIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = TrigramIndex()
+        for text in ["Write the report", "Review PR for report", "Buy milk", "Fix CI", "rewrite parser"]:
+            self.index.add(text)
+
+    def test_words_match_anywhere_ignoring_case(self):
+        self.assertEqual(self.index.search("REPORT"), [0, 1])
+        self.assertEqual(self.index.search("rite"), [0, 4])
+        self.assertEqual(self.index.search("ci"), [3])
+        self.assertEqual(self.index.search("report rev"), [1])
+        self.assertEqual(self.index.search("  "), [0, 1, 2, 3, 4])
+        self.assertEqual(self.index.search("nothing"), [])
+
+    def test_typing_refines_and_new_texts_are_found(self):
+        self.assertEqual(self.index.search("r"), [0, 1, 4])
+        self.assertEqual(self.index.search("re"), [0, 1, 4])
+        self.assertEqual(self.index.search("rew"), [4])
+        self.assertEqual(self.index.search("re"), [0, 1, 4])
+        self.index.add("Reread notes")
+        self.assertEqual(self.index.search("rer"), [5])
+
+
+if __name__ == '__main__':
+    unittest.main()
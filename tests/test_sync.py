@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from todomd import datasource, sync, task
+from todomd.model import Datasource, Task, UpdateResult
+
+
+def _task(task_id, name, completed=False):
+    return Task(id=task_id, path=None, datasource="notes", name=name, completed=completed)
+
+
+class TestSync(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.env = patch.dict(os.environ, {"TODOMD_CACHE_DIR": self.dir.name})
+        self.env.start()
+        self.todo_path = os.path.join(self.dir.name, "todo.md")
+
+        # As of the last sync, every task was open with its original name
+        state = sync.SyncState.load(self.todo_path)
+        state.record([_task("a", "A"), _task("b", "B"), _task("c", "C"), _task("d", "D")])
+        state.save()
+
+    def tearDown(self):
+        self.env.stop()
+        self.dir.cleanup()
+
+    def test_three_way_diff(self):
+        todo = task.TaskIndex([_task("a", "A"), _task("b", "B", completed=True), _task("c", "C", completed=True),
+                               _task("d", "D"), _task("e", "E")])
+        source = task.TaskIndex([_task("a", "A", completed=True), _task("b", "B"), _task("c", "C renamed"),
+                                 _task("d", "D"), _task("e", "E", completed=True)])
+
+        changes = sync.diff(todo, source, sync.SyncState.load(self.todo_path))
+
+        self.assertEqual([t.id for t in changes.to_todo], ["a", "e"])
+        self.assertEqual([t.id for t in changes.to_datasource], ["b"])
+        self.assertEqual([(t.id, d.name) for t, d in changes.conflicts], [("c", "C renamed")])
+        self.assertEqual([t.id for t in changes.in_sync], ["d"])
+
+        # Without a recorded state, the todo side wins when preferred
+        changes = sync.diff(todo, source, sync.SyncState.load(self.todo_path), prefer="todo")
+        self.assertEqual([t.id for t in changes.to_datasource], ["b", "e"])
+
+    def test_update_sends_only_todo_changes_and_records_them(self):
+        sent = []
+        datasources = {"notes": Datasource(get_tasks=list, update_tasks=lambda tasks: sent.extend(tasks))}
+        todo = [_task("a", "A", completed=True), _task("b", "B", completed=True)]
+        source = [_task("a", "A"), _task("b", "B renamed")]
+        conflicts = []
+
+        state = sync.SyncState.load(self.todo_path)
+        datasource.update_tasks(datasources, todo, source, state=state,
+                                on_conflict=lambda todo_task, ds_task: conflicts.append(todo_task.id))
+        state.prune(todo)
+        state.save()
+
+        self.assertEqual([t.id for t in sent], ["a"])
+        self.assertEqual(conflicts, ["b"])
+        state = sync.SyncState.load(self.todo_path)
+        self.assertEqual(len(state), 2)
+        self.assertEqual(state.get(task.task_key(todo[0])), sync.task_hash(todo[0]))
+        self.assertEqual(state.get(task.task_key(todo[1])), sync.task_hash(_task("b", "B")))
+
+    def test_failed_task_is_not_recorded_as_pushed(self):
+        # Same-named tasks in two files of a directory share their generated id
+        todo = [Task(id="c24cf", path=path, datasource="notes", name="Write summary", completed=True)
+                for path in ("a.md", "b.md")]
+        source = [Task(id="c24cf", path=path, datasource="notes", name="Write summary", completed=False)
+                  for path in ("a.md", "b.md")]
+        result = UpdateResult(updated=[("a.md", "c24cf"), ("b.md", "c24cf")], failed={("b.md", "c24cf"): "b.md: disk full"})
+        datasources = {"notes": Datasource(get_tasks=list, update_tasks=lambda tasks: result)}
+
+        state = sync.SyncState.load(self.todo_path)
+        state.record(source)
+        datasource.update_tasks(datasources, todo, source, state=state)
+
+        self.assertEqual(state.get(task.task_key(todo[0])), sync.task_hash(todo[0]))
+        self.assertEqual(state.get(task.task_key(todo[1])), sync.task_hash(source[1]))
+        # The next run doesn't undo the check-off that failed to be written
+        changes = sync.diff(task.TaskIndex(todo), task.TaskIndex([todo[0], source[1]]), state)
+        self.assertEqual(changes.to_todo, [])
+
+    def test_only_completion_is_sent_to_datasources(self):
+        sent = []
+        datasources = {"notes": Datasource(get_tasks=list, update_tasks=lambda tasks: sent.extend(tasks))}
+        # Renamed in the todo file, in the datasource or on neither side, and new since the last sync
+        todo = [_task("a", "A renamed", completed=True), _task("b", "B", completed=True), _task("c", "C renamed"),
+                _task("e", "E stale")]
+        source = [_task("a", "A"), _task("b", "B renamed"), _task("c", "C"), _task("e", "E")]
+
+        state = sync.SyncState.load(self.todo_path)
+        datasource.update_tasks(datasources, todo, source, state=state)
+
+        # Names are never sent, nor is a task without a recorded state that only differs in name
+        self.assertEqual(sent, [_task("a", "A", completed=True)])
+        self.assertEqual(state.get(task.task_key(todo[0])), sync.task_hash(sent[0]))
+
+        # The next sync leaves the names changed in the todo file alone
+        changes = sync.diff(task.TaskIndex(todo), task.TaskIndex([sent[0]] + source[1:]), state)
+        self.assertNotIn("a", [t.id for t in changes.to_todo])
+        self.assertNotIn("c", [t.id for t in changes.to_todo])
+
+
+if __name__ == '__main__':
+    unittest.main()
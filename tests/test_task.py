@@ -0,0 +1,32 @@
+import unittest
+
+from todomd import datasource
+from todomd.model import Task
+from todomd.task import TaskIndex
+
+
+def _task(task_id, path, completed=False, datasource="dir", name="Task"):
+    return Task(id=task_id, path=path, datasource=datasource, name=name, completed=completed)
+
+
+class TestTaskIndex(unittest.TestCase):
+    def test_lookup_and_groups(self):
+        tasks = [_task("a", "x.md"), _task("b", "y.md"), _task("a", None, datasource="air"), _task("c", "x.md")]
+        index = TaskIndex(tasks)
+
+        self.assertIs(index.get(("dir", "x.md", "a")), tasks[0])
+        self.assertIs(index.find(_task("a", None, datasource="air")), tasks[2])
+        self.assertNotIn(("dir", "y.md", "a"), index)
+        self.assertEqual(index.datasources(), ["dir", "air"])
+        self.assertEqual(index.by_path("dir"), {"x.md": [tasks[0], tasks[3]], "y.md": [tasks[1]]})
+        self.assertEqual(index.by_path("missing"), {})
+        self.assertIs(TaskIndex.of(index), index)
+
+    def test_diff_runs_on_indexes(self):
+        todo = TaskIndex([_task("a", "x.md", completed=True), _task("b", "x.md"), _task("c", "y.md", completed=True)])
+        ds = TaskIndex([_task("a", "x.md"), _task("b", "x.md"), _task("c", "z.md")])
+        self.assertEqual([t.id for t in datasource._calculate_diff(todo, ds, "dir")], ["a"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import datetime
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from todomd import fsutil, todo_file
+from todomd.model import Task
+
+
+class TestTodoDocument(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "todo.md")
+        self.env = patch.dict(os.environ, {"TODOMD_CACHE_DIR": os.path.join(self.dir.name, "cache")})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.dir.cleanup()
+
+    def write(self, text):
+        with open(self.path, "w") as f:
+            f.write(text)
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def test_update_and_add_in_one_write(self):
+        self.write("# Tasks\n\nSome notes\n* [ ] Old name @air::rec1\n* [ ] Other @dir:a.md:abc12")
+        doc = todo_file.TodoDocument.load(self.path)
+        self.assertEqual([t.id for t in doc.tasks], ["rec1", "abc12"])
+
+        updated = doc.update_tasks([
+            Task(id="rec1", path=None, datasource="air", name="New name", completed=True),
+            Task(id="abc12", path="a.md", datasource="dir", name="Other", completed=False),
+        ])
+        self.assertEqual([t.id for t in updated], ["rec1"])
+
+        added = doc.add_tasks([
+            Task(id="abc12", path="a.md", datasource="dir", name="Other", completed=False),
+            Task(id="rec2", path=None, datasource="air", name="Fresh", completed=False),
+        ])
+        self.assertEqual([t.id for t in added], ["rec2"])
+        self.assertTrue(doc.commit())
+
+        self.assertEqual(self.read(), (
+            "# Tasks\n\nSome notes\n"
+            "* [x] New name @air::rec1\n"
+            "* [ ] Other @dir:a.md:abc12\n"
+            "* [ ] Fresh @air::rec2\n"
+        ))
+
+    def test_new_file_gets_header(self):
+        doc = todo_file.TodoDocument.load(self.path)
+        doc.add_tasks([Task(id="rec1", path=None, datasource="air", name="First", completed=False)])
+        doc.commit()
+        self.assertEqual(self.read(), "# Tasks\n\n* [ ] First @air::rec1\n")
+
+    def test_unchanged_document_is_not_written(self):
+        self.write("* [ ] Task @air::rec1\n")
+        doc = todo_file.TodoDocument.load(self.path)
+        doc.update_tasks([Task(id="rec1", path=None, datasource="air", name="Task", completed=False)])
+        self.assertFalse(doc.commit())
+
+    def test_remap_ids(self):
+        self.write("* [ ] One @dir:a.md:abc12\n* [ ] Two @dir:b.md:abc12\n* [ ] Three @md::abc12\n")
+        doc = todo_file.TodoDocument.load(self.path)
+        remapped = doc.remap_ids("dir", {("a.md", "abc12"): "0123456789ab"})
+        self.assertEqual([t.name for t in remapped], ["One"])
+        self.assertTrue(doc.commit())
+        self.assertEqual(self.read(), "* [ ] One @dir:a.md:0123456789ab\n* [ ] Two @dir:b.md:abc12\n* [ ] Three @md::abc12\n")
+        self.assertEqual([t.id for t in todo_file.TodoDocument.load(self.path).tasks], ["0123456789ab", "abc12", "abc12"])
+
+    def test_archive_completed_lines(self):
+        self.write("# Tasks\n* [x] One @air::rec1\n* [ ] Two @air::rec2\n* [x] Three @air::rec3\n* [x] One @air::rec1")
+        doc = todo_file.TodoDocument.load(self.path)
+        lines = doc.remove_tasks([t for t in doc.tasks if t.id == "rec1"])
+        self.assertEqual(lines, [b"* [x] One @air::rec1\n", b"* [x] One @air::rec1"])
+
+        # Lines after the removed ones are still found
+        doc.update_tasks([Task(id="rec3", path=None, datasource="air", name="Three", completed=False)])
+        path = todo_file.append_archive(self.path, lines, datetime.date(2024, 5, 1))
+        self.assertTrue(doc.commit())
+
+        self.assertEqual(path, os.path.join(self.dir.name, "todo.archive-2024-05.md"))
+        with open(path) as f:
+            self.assertEqual(f.read(), "# Archived 2024-05\n\n* [x] One @air::rec1\n* [x] One @air::rec1\n")
+        self.assertEqual(self.read(), "# Tasks\n* [ ] Two @air::rec2\n* [ ] Three @air::rec3\n")
+
+    def test_changes_made_since_read_are_kept(self):
+        self.write("* [ ] One @air::rec1\n* [ ] Two @air::rec2\n")
+        doc = todo_file.TodoDocument.load(self.path)
+        doc.update_tasks([Task(id="rec1", path=None, datasource="air", name="One", completed=True)])
+        doc.add_tasks([Task(id="rec3", path=None, datasource="air", name="Three", completed=False)])
+
+        # Another run checks off a task and adds a note before this one commits
+        other = todo_file.TodoDocument.load(self.path)
+        other.update_tasks([Task(id="rec2", path=None, datasource="air", name="Two", completed=True)])
+        other.commit()
+        with open(self.path, "a") as f:
+            f.write("A note\n")
+
+        self.assertTrue(doc.commit())
+        self.assertEqual(self.read(), "* [x] One @air::rec1\n* [x] Two @air::rec2\nA note\n* [ ] Three @air::rec3\n")
+
+        # A line is only removed if it wasn't changed by the other run
+        doc = todo_file.TodoDocument.load(self.path)
+        doc.remove_tasks([t for t in doc.tasks if t.completed])
+        other = todo_file.TodoDocument.load(self.path)
+        other.update_tasks([Task(id="rec2", path=None, datasource="air", name="Two", completed=False)])
+        other.commit()
+        removed = []
+        self.assertTrue(doc.commit(on_removed=removed.extend))
+        self.assertEqual(self.read(), "* [ ] Two @air::rec2\nA note\n* [ ] Three @air::rec3\n")
+        # Only the lines actually removed are reported, for the archive
+        self.assertEqual(removed, [b"* [x] One @air::rec1\n"])
+
+    def test_commit_writes_through_symlink(self):
+        self.write("* [ ] One @air::rec1\n")
+        link = os.path.join(self.dir.name, "link.md")
+        os.symlink(self.path, link)
+
+        doc = todo_file.TodoDocument.load(link)
+        doc.update_tasks([Task(id="rec1", path=None, datasource="air", name="One", completed=True)])
+        self.assertTrue(doc.commit())
+
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(self.read(), "* [x] One @air::rec1\n")
+        # The link and the file it points to are locked as one
+        acquired = threading.Event()
+
+        def lock_link():
+            with fsutil.locked(link):
+                acquired.set()
+
+        with fsutil.locked(self.path):
+            thread = threading.Thread(target=lock_link)
+            thread.start()
+            self.assertFalse(acquired.wait(0.2))
+        thread.join(5)
+        self.assertTrue(acquired.is_set())
+
+    def test_commit_waits_for_lock(self):
+        self.write("* [ ] One @air::rec1\n")
+        doc = todo_file.TodoDocument.load(self.path)
+        doc.update_tasks([Task(id="rec1", path=None, datasource="air", name="One", completed=True)])
+
+        committed = threading.Event()
+        with fsutil.locked(self.path):
+            thread = threading.Thread(target=lambda: (doc.commit(), committed.set()))
+            thread.start()
+            self.assertFalse(committed.wait(0.2))
+        thread.join(5)
+        self.assertTrue(committed.is_set())
+        self.assertEqual(self.read(), "* [x] One @air::rec1\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
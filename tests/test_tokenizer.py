@@ -0,0 +1,44 @@
+import unittest
+
+from todomd import tokenizer
+
+
+class TestTokenizer(unittest.TestCase):
+    def test_source_tokens(self):
+        data = b"# Notes\n* [ ] First task\nprose [link](x)\n  * [x] Second task @tid:abc12  \r\n* [] not a task\n"
+        tokens = list(tokenizer.iter_source_tokens(data))
+        self.assertEqual([t[1:] for t in tokens], [
+            ("First task", False, None),
+            ("Second task", True, "abc12"),
+        ])
+        # Offsets point at the checkbox character
+        for offset, *_ in tokens:
+            self.assertIn(data[offset:offset + 1], (b" ", b"x"))
+
+    def test_source_token_on_first_line(self):
+        tokens = list(tokenizer.iter_source_tokens(b"* [X] Only task"))
+        self.assertEqual(tokens, [(3, "Only task", True, None)])
+
+    def test_todo_tokens(self):
+        data = (
+            "* [ ] Write report @air:rec123\n"
+            "* [x] Fix bug @notes:projects/a.md:4f2c1\n"
+            "* [ ] Email @bob about it @tasks_md::e5d3a\n"
+            "* [ ] No tag here\n"
+        ).encode()
+        tokens = [t[1:] for t in tokenizer.iter_todo_tokens(data)]
+        self.assertEqual(tokens, [
+            ("Fix bug", True, "notes", "projects/a.md", "4f2c1"),
+            ("Email @bob about it", False, "tasks_md", None, "e5d3a"),
+        ])
+
+    def test_line_parsers_match_buffer_parsers(self):
+        line = "  * [x] Ship it @tid:Zz9"
+        self.assertEqual(tokenizer.parse_source_line(line), ("Ship it", True, "Zz9"))
+        self.assertIsNone(tokenizer.parse_source_line("Just prose"))
+        self.assertEqual(tokenizer.parse_todo_line("* [ ] Ship it @ds:a/b.md:Zz9\n"),
+                         ("Ship it", False, "ds", "a/b.md", "Zz9"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+from todomd import ui
+from todomd.model import Task
+
+
+def _task(task_id, ds_name, path=None):
+    return Task(id=task_id, path=path, datasource=ds_name, name=f"Task {task_id}", completed=False)
+
+
+class TestTaskList(unittest.TestCase):
+    def test_positions_follow_groups_as_tasks_arrive(self):
+        tasks = ui._TaskList(["air", "dir"])
+        tasks.add([_task("d1", "dir", "a.md"), _task("d2", "dir", "b.md")])
+        self.assertEqual([tasks[i].id for i in range(len(tasks))], ["d1", "d2"])
+
+        anchor = tasks.anchor(1)
+        tasks.add([_task("r1", "air"), _task("d3", "dir", "a.md")])
+        self.assertEqual([tasks[i].id for i in range(len(tasks))], ["r1", "d1", "d3", "d2"])
+        self.assertEqual(tasks.position(anchor), 3)
+
+    def test_selection_is_counted_and_kept_in_order(self):
+        tasks = ui._TaskList([])
+        tasks.add([_task("a", "dir", "x.md"), _task("b", "dir", "y.md"), _task("c", "dir", "x.md")])
+        tasks.toggle(tasks[2])
+        tasks.toggle(tasks[0])
+        tasks.toggle(tasks[2])
+        tasks.toggle(tasks[1])
+        self.assertEqual(len(tasks.selected), 2)
+        # Grouped by path, so c comes before b
+        self.assertEqual([t.id for t in tasks.selected_tasks()], ["a", "c"])
+
+    def test_filter_keeps_groups_and_selections(self):
+        tasks = ui._TaskList([])
+        tasks.add([_task("a", "dir", "x.md"), _task("b", "dir", "y.md"), _task("c", "air")])
+        tasks.toggle(tasks[0])
+
+        tasks.set_filter("y.md")
+        self.assertEqual([tasks[i].id for i in range(len(tasks))], ["b"])
+        tasks.add([_task("d", "dir", "y.md"), _task("e", "dir", "z.md")])
+        self.assertEqual([tasks[i].id for i in range(len(tasks))], ["b", "d"])
+        tasks.toggle(tasks[1])
+
+        tasks.set_filter("")
+        self.assertEqual(len(tasks), 5)
+        self.assertEqual([t.id for t in tasks.selected_tasks()], ["a", "d"])
+
+    def test_layout_repeats_headers_at_the_top(self):
+        tasks = ui._TaskList([])
+        tasks.add([_task("a", "dir", "x.md"), _task("b", "dir", "x.md"), _task("c", "dir", "y.md")])
+        self.assertEqual([kind for _, _, kind in ui._layout(tasks, 1, 10)], ["datasource", "path", 1, "path", 2])
+        self.assertEqual(len(ui._layout(tasks, 0, 3)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from todomd import watch
+from todomd.datasources import markdown_file
+from todomd.model import Datasource
+
+
+class TestWatcher(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.env = patch.dict(os.environ, {"TODOMD_CACHE_DIR": os.path.join(self.dir.name, "cache")})
+        self.env.start()
+        self.source = os.path.join(self.dir.name, "source.md")
+        self.todo = os.path.join(self.dir.name, "todo.md")
+        self.write(self.source, "* [ ] Alpha @tid:a1\n* [ ] Beta @tid:b1\n")
+        self.write(self.todo, "# Tasks\n\n* [ ] Alpha @md::a1\n* [ ] Beta @md::b1\n")
+
+        self.reads = 0
+        conn = markdown_file.MarkdownFile(self.source, "md", use_cache=False)
+
+        def get_tasks():
+            self.reads += 1
+            return markdown_file.get_tasks(conn)
+
+        self.datasources = {"md": Datasource(
+            get_tasks=get_tasks,
+            update_tasks=lambda tasks: markdown_file.update_tasks(conn, tasks),
+            fingerprint=lambda: markdown_file.fingerprint(conn),
+        )}
+        self.watcher = watch.Watcher(self.todo, self.datasources)
+
+    def tearDown(self):
+        self.env.stop()
+        self.dir.cleanup()
+
+    def write(self, path, text, mtime=None):
+        with open(path, "w") as f:
+            f.write(text)
+        if mtime is not None:
+            os.utime(path, ns=(mtime, mtime))
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_completion_in_todo_file_is_sent_to_datasource(self):
+        self.write(self.todo, "# Tasks\n\n* [x] Alpha @md::a1\n* [ ] Beta @md::b1\n", mtime=1)
+        self.watcher.poll()
+
+        self.assertEqual(self.read(self.source), "* [x] Alpha @tid:a1\n* [ ] Beta @tid:b1\n")
+        # The datasource is read again once, as its file changed, and nothing is echoed back
+        for _ in range(2):
+            self.watcher.poll()
+            self.assertEqual(self.reads, 2)
+        self.assertEqual(self.read(self.todo), "# Tasks\n\n* [x] Alpha @md::a1\n* [ ] Beta @md::b1\n")
+
+    def test_completion_made_while_stopped_is_kept(self):
+        # Ticked in the todo file after the watcher stopped, the datasource is still open
+        self.write(self.todo, "# Tasks\n\n* [x] Alpha @md::a1\n* [ ] Beta @md::b1\n", mtime=1)
+        self.write(self.source, "* [ ] Alpha @tid:a1\n* [ ] Beta renamed @tid:b1\n", mtime=1)
+
+        watch.Watcher(self.todo, self.datasources)
+
+        self.assertEqual(self.read(self.todo), "# Tasks\n\n* [x] Alpha @md::a1\n* [ ] Beta renamed @md::b1\n")
+        self.assertEqual(self.read(self.source), "* [x] Alpha @tid:a1\n* [ ] Beta renamed @tid:b1\n")
+
+    def test_failed_poll_is_retried(self):
+        polls = []
+
+        def poll():
+            polls.append(None)
+            if len(polls) == 1:
+                raise UnicodeDecodeError("utf-8", b"\xff", 0, 1, "invalid start byte")
+            raise KeyboardInterrupt
+
+        with patch.object(self.watcher, "poll", poll), patch("time.sleep"), self.assertLogs(watch.logger, "ERROR"):
+            self.watcher.run()
+        self.assertEqual(len(polls), 2)
+
+    def test_datasource_changes_update_todo_file(self):
+        self.watcher.poll()
+        self.assertEqual(self.reads, 1)
+
+        self.write(self.source, "* [ ] Alpha @tid:a1\n* [ ] Beta renamed @tid:b1\n", mtime=1)
+        self.watcher.poll()
+
+        self.assertEqual(self.reads, 2)
+        self.assertEqual(self.read(self.todo), "# Tasks\n\n* [ ] Alpha @md::a1\n* [ ] Beta renamed @md::b1\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+'''
+Non-interactive mode: tasks are selected with a query expression instead of
+the UI, and what happens is written to stdout as JSON Lines, one event per
+line, as it happens.
+
+    {"event": "candidate", "task": {...}}   a datasource task matching the query
+    {"event": "added", "task": {...}, "line": "* [ ] ..."}
+    {"event": "updated", "task": {...}}     a todo task updated from its datasource
+    {"event": "update", "task": {...}, "status": "updated|skipped|failed", "error": ...}
+                                            a datasource updated from the todo file
+    {"event": "conflict", "task": {...}, "datasource_task": {...}}
+                                            a task changed in both since the last sync, left alone
+    {"event": "archived", "task": {...}, "file": "..."}
+                                            a completed task moved to the archive file
+    {"event": "summary", ...}               counts, always the last line
+'''
+import json
+import threading
+from typing import Any, Dict, IO, List, Optional
+
+from .model import Task, task_ref
+from . import datasource, pool, query, sync, task, todo_file
+
+
+def task_json(t: Task) -> Dict[str, Any]:
+    return {"datasource": t.datasource, "path": t.path, "id": t.id, "name": t.name, "completed": t.completed}
+
+
+class JsonLines:
+    '''
+    Writes events as JSON Lines, flushing each one so that a consumer sees it
+    straight away. Safe to use from several threads.
+    '''
+
+    def __init__(self, out: IO[str]):
+        self.out = out
+        self.counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def emit(self, event: str, **fields: Any) -> None:
+        line = json.dumps({"event": event, **fields}, ensure_ascii=False)
+        with self._lock:
+            self.counts[event] = self.counts.get(event, 0) + 1
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def summary(self) -> None:
+        self.emit("summary", **{event: count for event, count in self.counts.items()})
+
+
+def select_tasks(stream: datasource.TaskStream, todo_index: task.TaskIndex, matcher: query.Matcher,
+                 events: JsonLines) -> List[Task]:
+    '''
+    Collect the datasource tasks that aren't in the todo file and match the
+    query, emitting each one as a candidate as soon as its datasource returns it
+    '''
+    candidates = []
+    while True:
+        finished = stream.finished
+        for t in stream.poll(None if not finished else 0):
+            if todo_index.find(t) is None and matcher(t):
+                candidates.append(t)
+                events.emit("candidate", task=task_json(t))
+        if finished and not stream.pending():
+            return candidates
+
+
+def emit_conflict(events: JsonLines, todo_task: Task, ds_task: Task) -> None:
+    events.emit("conflict", task=task_json(todo_task), datasource_task=task_json(ds_task))
+
+
+def sync_todo_file(todo_doc: Optional[todo_file.TodoDocument], datasource_index: task.TaskIndex,
+                   candidates: List[Task], events: JsonLines, dry_run: bool = False,
+                   state: Optional[sync.SyncState] = None) -> None:
+    '''
+    Update the todo file from the datasources and add the candidates to it,
+    emitting each task updated or added. With the sync state of the file, only
+    the tasks changed in their datasource since the last sync are updated and
+    the tasks changed on both sides are emitted as conflicts. Without a todo
+    file the candidates are only emitted, with the lines that would have been
+    added.
+    '''
+    if todo_doc is None:
+        for t in candidates:
+            events.emit("added", task=task_json(t), line=todo_file.format_task_line(t))
+        return
+    if dry_run:
+        return
+
+    if state is None:
+        updated = todo_doc.update_tasks(datasource_index)
+    else:
+        updated, conflicts = sync.pull(todo_doc, task.TaskIndex(todo_doc.tasks), datasource_index, state)
+        for todo_task, ds_task in conflicts:
+            emit_conflict(events, todo_task, ds_task)
+    for t in updated:
+        events.emit("updated", task=task_json(t))
+    added = todo_doc.add_tasks(candidates)
+    for t in added:
+        events.emit("added", task=task_json(t), line=todo_file.format_task_line(t))
+    todo_doc.commit()
+
+    if state is not None:
+        state.prune(todo_doc.tasks)
+        state.record(added)
+        state.save()
+
+
+def update_events(events: JsonLines):
+    '''
+    Returns an on_result callback for datasource.update_tasks that emits the
+    outcome for every task sent to a datasource
+    '''
+    def on_result(tasks: List[Task], run: pool.JobResult) -> None:
+        updated = set(run.value.updated) if run.value is not None else set()
+        for t in tasks:
+            if run.timed_out or run.error is not None:
+                error = "timed out" if run.timed_out else str(run.error)
+                events.emit("update", task=task_json(t), status="failed", error=error)
+            elif run.value is not None and task_ref(t) in run.value.failed:
+                events.emit("update", task=task_json(t), status="failed", error=run.value.failed[task_ref(t)])
+            elif run.value is None or task_ref(t) in updated:
+                events.emit("update", task=task_json(t), status="updated")
+            else:
+                events.emit("update", task=task_json(t), status="skipped")
+    return on_result
@@ -0,0 +1,43 @@
+import hashlib
+import json
+import os
+from typing import Any, Optional
+
+from . import fsutil
+
+
+def cache_dir(*parts: str) -> str:
+    '''
+    Returns the directory where todomd keeps its caches, joined with the given parts.
+    Uses TODOMD_CACHE_DIR if set, otherwise $XDG_CACHE_HOME/todomd or ~/.cache/todomd.
+    '''
+    base = os.getenv("TODOMD_CACHE_DIR")
+    if not base:
+        base = os.path.join(os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "todomd")
+    return os.path.join(base, *parts)
+
+
+def cache_key(*values: Any) -> str:
+    '''
+    Returns a short stable file name for the given values
+    '''
+    return hashlib.sha1(json.dumps(values).encode()).hexdigest()[:16]
+
+
+def load_json(path: str) -> Optional[Any]:
+    '''
+    Load a JSON cache file. Returns None if it doesn't exist or can't be read,
+    since a cache can always be rebuilt.
+    '''
+    try:
+        with open(path, "rb") as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def save_json(path: str, data: Any) -> None:
+    '''
+    Atomically save data to a JSON cache file
+    '''
+    fsutil.atomic_write(path, json.dumps(data, separators=(",", ":")).encode())
@@ -1,15 +1,25 @@
 
 import importlib
-from typing import Any, Dict, List
+import logging
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
-from .model import Datasource, Task
-from . import task
+from .model import Datasource, Task, task_ref
+from . import pool, profile, sync, task
 
-def from_config(datasources_config: Dict[str, Any]) -> Dict[str, Datasource]:
+logger = logging.getLogger(__name__)
+
+# Number of datasources fetched or updated at the same time
+DEFAULT_WORKERS = 4
+
+def from_config(datasources_config: Dict[str, Any], default_timeout: Optional[float] = None) -> Dict[str, Datasource]:
     '''
     Read the datasources from the config and return a dictionary of datasource objects.
     The keys in the dictionary are the datasource names, which are created based on
     the type and optionally the project name or other unique identifier.
+    Each datasource may set its own `timeout`, otherwise default_timeout is used.
     '''
     result = {}
     
@@ -24,86 +34,319 @@ def from_config(datasources_config: Dict[str, Any]) -> Dict[str, Datasource]:
             
             # Call the from_config function of the module
             datasource = module.from_config(key, ds_config)
+            datasource.timeout = ds_config.get("timeout", default_timeout)
             result[key] = datasource
             
         except (ImportError, AttributeError) as e:
-            print(f"Error loading datasource {ds_type}: {e}")
+            logger.error("Error loading datasource %s: %s", ds_type, e)
             continue
     
     return result
 
-def _calculate_diff(todo_tasks: Dict[str, List[Task]], ds_tasks: Dict[str, List[Task]]) -> List[Task]:
+def _calculate_diff(todo_index: task.TaskIndex, ds_index: task.TaskIndex, ds_name: str) -> List[Task]:
     '''
-    Calculates which tasks have the same path and id in both datasource and todo, and also
-    have different completion statuses.
+    Calculates which tasks of the given datasource have the same path and id in both
+    datasource and todo, and also have different completion statuses.
     '''
     changed_tasks = []
-    
-    common_paths = set(todo_tasks.keys()) & set(ds_tasks.keys())
-    print(f"Paths to be updated: {len(common_paths)}")
-    print(todo_tasks.keys())
-    print(ds_tasks.keys())
-
-    # Iterate through paths that exist in both dictionaries
-    for path in common_paths:
-        todo_tasks_by_id = task.group_by_id(todo_tasks[path])
-        ds_tasks_by_id = task.group_by_id(ds_tasks[path])
-        
-        # Find tasks with same id but different completion status
-        for task_id in set(todo_tasks_by_id.keys()) & set(ds_tasks_by_id.keys()):
-            todo_task = todo_tasks_by_id[task_id]
-            ds_task = ds_tasks_by_id[task_id]
-            
+    todo_tasks_by_path = todo_index.by_path(ds_name)
+    logger.debug("Paths to be checked: %d", len(todo_tasks_by_path))
+
+    for tasks in todo_tasks_by_path.values():
+        for todo_task in tasks:
+            ds_task = ds_index.find(todo_task)
+            # A task listed more than once is only counted once, as its last occurrence
+            if ds_task is None or todo_index.find(todo_task) is not todo_task:
+                continue
+
             if todo_task.completed != ds_task.completed:
                 # Add the todo task to changed_tasks since that has the updated status
                 changed_tasks.append(todo_task)
     
     return changed_tasks
 
-def update_tasks(datasources: Dict[str, Datasource], todo_tasks: List[Task], datasource_tasks: List[Task]) -> None:
+def update_tasks(datasources: Dict[str, Datasource], todo_tasks: Union[task.TaskIndex, List[Task]],
+                 datasource_tasks: Union[task.TaskIndex, List[Task]], workers: int = DEFAULT_WORKERS,
+                 on_result: Optional[Callable[[List[Task], pool.JobResult], None]] = None,
+                 state: Optional[sync.SyncState] = None,
+                 on_conflict: Optional[Callable[[Task, Task], None]] = None) -> List[pool.JobResult]:
     '''
     Update the datasources with the tasks from the todo file.
     Each task will be updated in its corresponding datasource based on the
-    task's datasource attribute.
+    task's datasource attribute. Datasources are updated concurrently, with at most
+    `workers` running at the same time. The tasks can be given as lists or as
+    already built indexes.
+    If given, on_result is called with the tasks sent to each datasource and the
+    result of the update as soon as that datasource is done.
+    With the sync state of the todo file, only the tasks whose completion changed
+    in the file since the last sync are sent, and the tasks changed on both sides
+    are reported to on_conflict and left alone. The state is updated, but not saved.
+    Returns the result of each datasource that had changes.
     '''
-    print("Updating tasks...")
+    logger.info("Updating tasks...")
 
-    # Group tasks by datasource
-    todo_tasks_by_datasource = task.group_by_datasource(todo_tasks)
-    datasource_tasks_by_datasource = task.group_by_datasource(datasource_tasks)
+    with profile.phase("diff") as counts:
+        todo_index = task.TaskIndex.of(todo_tasks)
+        datasource_index = task.TaskIndex.of(datasource_tasks)
 
-    # Print the number of tasks in each datasource for debugging
-    for ds_name, tasks in todo_tasks_by_datasource.items():
-        print(f"Todo tasks for datasource {ds_name}: {len(tasks)}")
-    for ds_name, tasks in datasource_tasks_by_datasource.items():
-        print(f"Datasource tasks for {ds_name}: {len(tasks)}")
+        # Log the number of tasks in each datasource for debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            for ds_name, paths in todo_index.grouped().items():
+                logger.debug("Todo tasks for datasource %s: %d", ds_name, sum(map(len, paths.values())))
+            for ds_name, paths in datasource_index.grouped().items():
+                logger.debug("Datasource tasks for %s: %d", ds_name, sum(map(len, paths.values())))
 
-    # Go through each datasource and update tasks that have changed
-    for ds_name, ds in datasources.items():
-        if ds_name not in todo_tasks_by_datasource or ds_name not in datasource_tasks_by_datasource:
-            print(f"No tasks to update for datasource {ds_name}")
-            continue
-        
-        todo_tasks_by_path = task.group_by_path(todo_tasks_by_datasource[ds_name])
-        datasource_tasks_by_path = task.group_by_path(datasource_tasks_by_datasource[ds_name])
-        diff = _calculate_diff(todo_tasks_by_path, datasource_tasks_by_path)
-        print(f"Found {len(diff)} tasks with changed completion status for datasource {ds_name}")
-        ds.update_tasks(diff)
+        # Work out the changes for each datasource before pushing any of them
+        diffs: Dict[str, List[Task]] = {}
+        counts["tasks"] = 0
+        for ds_name, ds in datasources.items():
+            if not todo_index.by_path(ds_name) or not datasource_index.by_path(ds_name):
+                logger.info("No tasks to update for datasource %s", ds_name)
+                continue
+            
+            if state is None:
+                diff = _calculate_diff(todo_index, datasource_index, ds_name)
+            else:
+                changes = sync.diff(todo_index, datasource_index, state, ds_name, prefer="todo")
+                diff = sync.completion_changes(changes.to_datasource, datasource_index)
+                state.record(changes.in_sync)
+                sync.log_conflicts(changes.conflicts)
+                if on_conflict:
+                    for todo_task, ds_task in changes.conflicts:
+                        on_conflict(todo_task, ds_task)
+            logger.info("Found %d tasks with changed completion status for datasource %s", len(diff), ds_name)
+            counts["tasks"] += len(diff)
+            if diff:
+                diffs[ds_name] = diff
+
+    runs = push_changes(datasources, diffs, workers, on_result)
+    if state is not None:
+        for run in runs:
+            state.record(pushed_tasks(diffs[run.name], run))
+    return runs
+
+
+def pushed_tasks(tasks: List[Task], run: pool.JobResult) -> List[Task]:
+    '''
+    Of the tasks sent to a datasource, the ones its update reported as updated,
+    leaving out any also reported as failed. An update that doesn't report what
+    it did is taken to have updated them all.
+    '''
+    if run.error is not None or run.timed_out:
+        return []
+    if run.value is None:
+        return tasks
+    updated = set(run.value.updated).difference(run.value.failed)
+    return [t for t in tasks if task_ref(t) in updated]
 
 
-def read_tasks(datasources: Dict[str, Datasource]) -> List[Task]:
+def push_changes(datasources: Dict[str, Datasource], diffs: Dict[str, List[Task]], workers: int = DEFAULT_WORKERS,
+                 on_result: Optional[Callable[[List[Task], pool.JobResult], None]] = None) -> List[pool.JobResult]:
+    '''
+    Send already worked out changes to their datasources, given as the changed
+    todo tasks of each datasource. Datasources are updated concurrently, with at
+    most `workers` running at the same time, and the outcome of each is logged.
+    Returns the result of each datasource.
+    '''
+    jobs = {ds_name: (lambda ds=datasources[ds_name], diff=diff: ds.update_tasks(diff))
+            for ds_name, diff in diffs.items() if diff}
+    timeouts = {ds_name: datasources[ds_name].timeout for ds_name in jobs}
+    with profile.phase("write_back") as counts:
+        runs = pool.run_bounded(jobs, workers, timeouts,
+                                on_result and (lambda run: on_result(diffs[run.name], run)))
+        counts["tasks"] = sum(len(run.value.updated) for run in runs if run.value is not None)
+
+    for run in runs:
+        if run.timed_out:
+            logger.error("Timed out updating datasource %s after %.2fs", run.name, run.elapsed)
+        elif run.error is not None:
+            logger.error("Error updating datasource %s: %s", run.name, run.error)
+        elif run.value is None:
+            logger.info("Updated datasource %s in %.2fs", run.name, run.elapsed)
+        else:
+            result = run.value
+            logger.info("Updated datasource %s in %.2fs: %d updated, %d skipped, %d failed",
+                        run.name, run.elapsed, len(result.updated), len(result.skipped), len(result.failed))
+            for (path, task_id), error in result.failed.items():
+                logger.error("Failed to update task %s%s in datasource %s: %s",
+                             task_id, f" in {path}" if path else "", run.name, error)
+        profile.record(f"write_back:{run.name}", run.elapsed,
+                       tasks=len(run.value.updated) if run.value is not None else None)
+
+    return runs
+
+
+def _log_read(run: pool.JobResult, tasks: Optional[int]) -> None:
+    '''
+    Log the outcome of reading a datasource and record it in the profile
+    '''
+    if run.timed_out:
+        logger.error("Timed out reading tasks from datasource %s after %.2fs", run.name, run.elapsed)
+    elif run.error is not None:
+        logger.error("Error reading tasks from datasource %s: %s", run.name, run.error)
+    else:
+        logger.info("Read %d tasks from datasource %s in %.2fs", tasks, run.name, run.elapsed)
+    profile.record(f"fetch:{run.name}", run.elapsed, tasks=tasks)
+
+
+def read_each(datasources: Dict[str, Datasource], workers: int = DEFAULT_WORKERS) -> Dict[str, Optional[List[Task]]]:
+    '''
+    Read the tasks of each of the given datasources concurrently, with at most
+    `workers` running at the same time. Returns the tasks of each datasource, in
+    the order the datasources were configured, with None for a datasource that
+    failed or exceeded its timeout.
+    '''
+    jobs = {ds_name: ds.get_tasks for ds_name, ds in datasources.items()}
+    timeouts = {ds_name: ds.timeout for ds_name, ds in datasources.items()}
+    result = {}
+    for run in pool.run_bounded(jobs, workers, timeouts):
+        result[run.name] = run.value if run.error is None and not run.timed_out else None
+        _log_read(run, len(run.value) if run.value is not None else None)
+    return result
+
+
+def read_tasks(datasources: Dict[str, Datasource], workers: int = DEFAULT_WORKERS) -> List[Task]:
     '''
     Read the tasks from the given datasources and return them as a list.
+    Datasources are read concurrently, with at most `workers` running at the same
+    time, but the tasks are returned in the order the datasources were configured.
+    A datasource that fails or exceeds its timeout contributes no tasks.
     '''
     all_tasks = []
-    
-    # Retrieve tasks from each datasource
-    for ds_name, datasource in datasources.items():
-        try:
-            tasks = datasource.get_tasks()
-            print(f"Read {len(tasks)} tasks from datasource {ds_name}")
+    for tasks in read_each(datasources, workers).values():
+        if tasks is not None:
             all_tasks.extend(tasks)
-        except Exception as e:
-            print(f"Error reading tasks from datasource {ds_name}: {e}")
-    
     return all_tasks
+
+
+def backfill_ids(datasources: Dict[str, Datasource],
+                 workers: int = DEFAULT_WORKERS) -> Dict[str, Dict[Tuple[Optional[str], str], str]]:
+    '''
+    Have each datasource that supports it write ids for its tasks that have
+    none, at most `workers` at the same time. Returns the new ids of each
+    datasource, as {(path, old id): new id}. Datasources that fail are logged
+    and left out, and are given no timeout.
+    '''
+    jobs = {ds_name: ds.backfill_ids for ds_name, ds in datasources.items() if ds.backfill_ids}
+    result = {}
+    # No timeouts: an abandoned backfill could still write ids that the todo file never hears of
+    for run in pool.run_bounded(jobs, workers, {}):
+        if run.error is not None:
+            logger.error("Error writing task ids for datasource %s: %s", run.name, run.error)
+        else:
+            logger.info("Wrote %d task ids for datasource %s in %.2fs", len(run.value), run.name, run.elapsed)
+            result[run.name] = run.value
+    return result
+
+
+def iter_task_batches(ds: Datasource) -> Iterator[List[Task]]:
+    '''
+    Yield the tasks of a datasource in batches, as they arrive. A datasource
+    that can't stream its tasks gives all of them as a single batch.
+    '''
+    if ds.iter_tasks is None:
+        yield list(ds.get_tasks())
+        return
+    for t in ds.iter_tasks():
+        yield [t]
+
+
+@dataclass
+class StreamStatus:
+    name: str
+    tasks: int = 0  # Tasks received so far
+    done: bool = False
+    error: Optional[BaseException] = None
+    timed_out: bool = False
+
+
+class TaskStream:
+    '''
+    Tasks read from datasources in the background, at most `workers` at a time,
+    so that they can be used as they arrive. poll() hands over the tasks that
+    arrived since the last call and wait() collects the rest. Tasks received
+    before a datasource failed or timed out are kept, later ones are dropped.
+    Outcomes are only logged by wait(), so a UI can run while tasks stream in.
+    '''
+
+    def __init__(self, datasources: Dict[str, Datasource], workers: int = DEFAULT_WORKERS):
+        self.status = {ds_name: StreamStatus(ds_name) for ds_name in datasources}
+        self.tasks: List[Task] = []
+        self._order = list(datasources)
+        self._results: Dict[str, pool.JobResult] = {}
+        self._events: queue.Queue = queue.Queue()
+        self._logged = False
+
+        jobs = {ds_name: (lambda ds_name=ds_name, ds=ds: self._read(ds_name, ds)) for ds_name, ds in datasources.items()}
+        timeouts = {ds_name: ds.timeout for ds_name, ds in datasources.items()}
+        threading.Thread(target=pool.run_bounded, args=(jobs, workers, timeouts, self._finished),
+                         name="todomd-stream", daemon=True).start()
+
+    def _read(self, ds_name: str, ds: Datasource) -> int:
+        count = 0
+        for batch in iter_task_batches(ds):
+            self._events.put((ds_name, batch))
+            count += len(batch)
+        return count
+
+    def _finished(self, run: pool.JobResult) -> None:
+        self._events.put((run.name, run))
+
+    @property
+    def finished(self) -> bool:
+        return all(status.done for status in self.status.values())
+
+    def pending(self) -> bool:
+        '''
+        Whether anything arrived that poll() hasn't handed over yet
+        '''
+        return not self._events.empty()
+
+    def poll(self, timeout: Optional[float] = 0) -> List[Task]:
+        '''
+        Returns the tasks that arrived since the last call, waiting up to timeout
+        seconds (forever for None) for something to happen if nothing has yet
+        '''
+        new_tasks: List[Task] = []
+        block = timeout is None or timeout > 0
+        while True:
+            try:
+                ds_name, event = self._events.get(block, timeout)
+            except queue.Empty:
+                break
+            block = False
+
+            status = self.status[ds_name]
+            if isinstance(event, pool.JobResult):
+                status.done = True
+                status.error = event.error
+                status.timed_out = event.timed_out
+                self._results[ds_name] = event
+            elif not status.done:
+                status.tasks += len(event)
+                new_tasks.extend(event)
+
+        self.tasks.extend(new_tasks)
+        return new_tasks
+
+    def wait(self) -> List[Task]:
+        '''
+        Wait for every datasource to finish or time out, log how each went and
+        return all of the tasks received
+        '''
+        while not self.finished:
+            self.poll(None)
+
+        if not self._logged:
+            self._logged = True
+            for ds_name in self._order:
+                status = self.status[ds_name]
+                _log_read(self._results[ds_name], None if status.error or status.timed_out else status.tasks)
+        return self.tasks
+
+
+def stream_tasks(datasources: Dict[str, Datasource], workers: int = DEFAULT_WORKERS) -> TaskStream:
+    '''
+    Start reading the tasks from the given datasources in the background
+    '''
+    return TaskStream(datasources, workers)
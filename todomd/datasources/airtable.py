@@ -1,10 +1,59 @@
 # The airtable datasource
+import logging
+import random
+import threading
+import time
 from dataclasses import dataclass
-from typing import List
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
 
-from pyairtable import Table
+import requests
+from pyairtable import Api, Table
+
+from ..model import Task, Datasource, UpdateResult, task_ref
+from ..ratelimit import TokenBucket
+from .. import cache
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Airtable accepts at most 10 records per create/update request
+MAX_BATCH_SIZE = 10
+
+# Airtable allows 5 requests per second for each base
+REQUESTS_PER_SECOND = 5
+
+# Retry settings for rate limited (429) and server error (5xx) responses
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+
+# Airtable rejects every request to a base for 30 seconds after a 429, so a
+# rate limited request is not retried any sooner
+RATE_LIMIT_DELAY = 30.0
+
+# Errors a batch update gets because of one of its records, rather than the
+# request as a whole; such a batch is retried one record at a time
+RECORD_ERROR_STATUSES = (422,)
+
+# Seconds between full fetches, which are needed to notice deleted records
+FULL_SYNC_INTERVAL = 24 * 60 * 60
+
+# Seconds taken off the last sync time when fetching modified records, to allow for clock skew
+SYNC_MARGIN = 5 * 60
+
+# Bump when the format of the record cache changes
+RECORD_CACHE_VERSION = 1
+
+# One rate limiter per base, shared by every datasource on that base
+_rate_limiters: Dict[str, TokenBucket] = {}
+_rate_limiters_lock = threading.Lock()
+
+# One client per token and base, shared by every datasource using them
+_clients: Dict[Tuple[str, str], "AirtableClient"] = {}
+_clients_lock = threading.Lock()
 
-from ..model import Task, Datasource
 
 @dataclass
 class AirtableConnection:
@@ -17,60 +66,324 @@ class AirtableConnection:
     completed_value: str
     incompleted_value: str
     datasource: str
+    incremental: bool = True  # Only fetch records modified since the last sync
+    full_sync_interval: float = FULL_SYNC_INTERVAL
+    last_modified_field: str = ""  # Optional "Last modified time" field to filter on
 
 
-def get_tasks(conn: AirtableConnection) -> List[Task]:
+@dataclass
+class ClientStats:
+    requests: int = 0
+    errors: int = 0  # Responses with an error status, including rate limited ones
+    seconds: float = 0.0  # Total time spent waiting for responses
+
+
+class AirtableClient:
     """
-    Fetch tasks from Airtable that match the incompleted_value
+    A pyairtable Api, and with it a requests session, for one token and base.
+    The session keeps connections alive between requests and accepts gzip
+    compressed responses, so sharing the client saves a TLS handshake on every
+    datasource and every fetch or update. Counts the requests made and the time
+    they took.
+    """
+
+    def __init__(self, token: str, base: str):
+        self.base = base
+        # Rate limited and failed requests are only retried by _send, which paces them
+        # with the base's rate limiter and honours Retry-After
+        self.api = Api(token, retry_strategy=None)
+        self.stats = ClientStats()
+        self._tables: Dict[str, Table] = {}
+        self._lock = threading.Lock()
+        self.api.session.hooks["response"].append(self._record)
+
+    def _record(self, response: requests.Response, *args, **kwargs) -> None:
+        with self._lock:
+            self.stats.requests += 1
+            self.stats.seconds += response.elapsed.total_seconds()
+            if response.status_code >= 400:
+                self.stats.errors += 1
+
+    def table(self, name: str) -> Table:
+        with self._lock:
+            if name not in self._tables:
+                self._tables[name] = self.api.table(self.base, name)
+            return self._tables[name]
+
+    def log_stats(self) -> None:
+        stats = self.stats
+        logger.info("Airtable base %s: %d requests, %d errors, %.0fms average response time",
+                    self.base, stats.requests, stats.errors,
+                    1000 * stats.seconds / stats.requests if stats.requests else 0)
+
+
+def client(conn: AirtableConnection) -> AirtableClient:
+    """
+    The shared client for the token and base of the connection
+    """
+    key = (conn.token, conn.base)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = AirtableClient(conn.token, conn.base)
+        return _clients[key]
+
+
+def _quote(value: str) -> str:
+    """
+    Quote a string for use in an Airtable formula
+    """
+    escaped = value.replace("\\", "\\\\").replace("'", "\\'")
+    return f"'{escaped}'"
+
+
+def _status_formula(conn: AirtableConnection) -> str:
+    """
+    Formula matching records whose status is either the completed or incompleted value
+    """
+    status = f"{{{conn.status_field}}}"
+    return f"OR({status} = {_quote(conn.incompleted_value)}, {status} = {_quote(conn.completed_value)})"
+
+
+def _modified_formula(conn: AirtableConnection, since: datetime) -> str:
+    """
+    Formula matching records modified after the given time
+    """
+    modified = f"{{{conn.last_modified_field}}}" if conn.last_modified_field else "LAST_MODIFIED_TIME()"
+    return f"IS_AFTER({modified}, DATETIME_PARSE({_quote(_format_time(since))}))"
+
+
+def _format_time(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def _record_cache_path(conn: AirtableConnection) -> str:
+    key = cache.cache_key(conn.base, conn.table, conn.view, conn.name_field, conn.status_field,
+                          conn.completed_value, conn.incompleted_value, conn.last_modified_field)
+    return cache.cache_dir("airtable", f"{key}.json")
+
+
+def _load_record_cache(conn: AirtableConnection) -> Optional[dict]:
+    """
+    Load the records cached by the last sync, or None if there is no usable cache
+    """
+    state = cache.load_json(_record_cache_path(conn))
+    if not isinstance(state, dict) or state.get("version") != RECORD_CACHE_VERSION:
+        return None
+    return state
+
+
+def _cache_entry(conn: AirtableConnection, record: dict, synced_at: str) -> dict:
+    """
+    The part of a record that is kept in the cache. Without a last modified field,
+    the time of the sync that saw the record is used as its last modified time.
+    """
+    # Airtable leaves out fields that are empty
+    fields = record["fields"]
+    return {
+        "name": fields.get(conn.name_field, ""),
+        "status": fields.get(conn.status_field),
+        "modified": fields.get(conn.last_modified_field) or synced_at,
+    }
+
+
+def _entry_to_task(conn: AirtableConnection, record_id: str, entry: dict) -> Task:
+    """
+    Create a task with the Airtable record ID as task_id
+    """
+    return Task(
+        id=record_id,
+        path=None,
+        name=entry["name"],
+        completed=entry["status"] == conn.completed_value,
+        datasource=conn.datasource
+    )
+
+
+def _fetch_records(conn: AirtableConnection, table: Table, formula: str) -> Iterator[dict]:
+    """
+    Fetch the records matching the formula one page at a time, each page
+    request paced and retried like any other, see _send.
+    Only the name and status fields are requested.
     """
-    # Connect to Airtable
-    table = Table(conn.token, conn.base, conn.table)
-    
     # Prepare parameters for Airtable query
-    params = {}
+    fields = [conn.name_field, conn.status_field]
+    if conn.last_modified_field:
+        fields.append(conn.last_modified_field)
+    params = {
+        "fields": fields,
+        "formula": formula,
+    }
     
     # Add view parameter if specified
     if conn.view:
         params["view"] = conn.view
     
-    # Add formula to filter by status
-    #formula = f"OR({{{conn.status_field}}} = '{conn.incompleted_value}', {{{conn.status_field}}} = '{conn.completed_value}')"
-    #params["formula"] = formula
-    
-    # Get records using parameters
-    records = table.all(**params)
-    print(f"Fetched {len(records)} records from Airtable")
-    
-    # Convert records to Task objects
-    tasks = []
-    for record in records:
-        record_id = record["id"]
-        fields = record["fields"]
-        
-        # Create task with Airtable record ID as task_id
-        task = Task(
-            id=record_id,
-            path=None,
-            name=fields[conn.name_field],
-            completed=fields[conn.status_field] == conn.completed_value,
-            datasource=conn.datasource
-        )
-        tasks.append(task)
-    
-    return tasks
+    while True:
+        page = _send(conn, lambda: table.api.request("get", table.urls.records,
+                                                     fallback=("post", table.urls.records_post), options=params))
+        yield from page.get("records", [])
+        offset = page.get("offset")
+        if not offset:
+            return
+        params = {**params, "offset": offset}
 
 
-def update_tasks(conn: AirtableConnection, tasks: List[Task]):
+def iter_tasks(conn: AirtableConnection) -> Iterator[Task]:
     """
-    Update task status in Airtable
+    Fetch tasks from Airtable whose status is the completed or incompleted value.
+    When incremental sync is on, only records modified since the last sync are
+    fetched and merged into a local record cache. A full fetch is done when there
+    is no cache or full_sync_interval has passed, which also drops deleted records.
     """
-    # Connect to Airtable
-    table = Table(conn.token, conn.base, conn.table)
-    
-    # Determine the status value based on task completion
+    airtable = client(conn)
+    table = airtable.table(conn.table)
+    sync_start = datetime.now(timezone.utc)
+    synced_at = _format_time(sync_start)
+
+    state = _load_record_cache(conn) if conn.incremental else None
+    if state is None or sync_start.timestamp() - state["last_full_sync"] >= conn.full_sync_interval:
+        # Full fetch, yielding tasks as each page arrives
+        records = {}
+        for record in _fetch_records(conn, table, _status_formula(conn)):
+            entry = _cache_entry(conn, record, synced_at)
+            records[record["id"]] = entry
+            yield _entry_to_task(conn, record["id"], entry)
+        logger.info("Fetched %d records from Airtable", len(records))
+        state = {"version": RECORD_CACHE_VERSION, "last_full_sync": sync_start.timestamp(), "records": records}
+    else:
+        # Incremental fetch. Records are fetched whatever their status so that
+        # records moved to some other status can be dropped from the cache.
+        records = state["records"]
+        since = datetime.fromisoformat(state["last_sync"].replace("Z", "+00:00")) - timedelta(seconds=SYNC_MARGIN)
+        count = 0
+        for record in _fetch_records(conn, table, _modified_formula(conn, since)):
+            count += 1
+            entry = _cache_entry(conn, record, synced_at)
+            if entry["status"] in (conn.completed_value, conn.incompleted_value):
+                records[record["id"]] = entry
+            else:
+                records.pop(record["id"], None)
+        logger.info("Fetched %d records modified since last sync from Airtable", count)
+
+        for record_id, entry in records.items():
+            yield _entry_to_task(conn, record_id, entry)
+
+    # Only remember the sync once every record has been seen
+    if conn.incremental:
+        state["last_sync"] = synced_at
+        cache.save_json(_record_cache_path(conn), state)
+    airtable.log_stats()
+
+
+def get_tasks(conn: AirtableConnection) -> List[Task]:
+    """
+    Fetch tasks from Airtable that match the completed or incompleted value
+    """
+    return list(iter_tasks(conn))
+
+
+def _rate_limiter(base: str) -> TokenBucket:
+    with _rate_limiters_lock:
+        if base not in _rate_limiters:
+            _rate_limiters[base] = TokenBucket(REQUESTS_PER_SECOND, capacity=REQUESTS_PER_SECOND)
+        return _rate_limiters[base]
+
+
+def _retry_delay(error: requests.RequestException, attempt: int) -> Optional[float]:
+    """
+    Returns how long to wait before retrying a failed request, or None if the
+    request should not be retried.
+    """
+    response = error.response
+    if response is not None:
+        if response.status_code != 429 and response.status_code < 500:
+            return None
+
+        # Honour the server's own estimate when it gives one
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+
+        if response.status_code == 429:
+            return RATE_LIMIT_DELAY * random.uniform(1.0, 1.2)
+
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _send(conn: AirtableConnection, request: Callable[[], T]) -> T:
+    """
+    Make a request, pacing it with the base's rate limiter and retrying rate
+    limited and server errors with backoff. Returns what the request returns.
+    """
+    limiter = _rate_limiter(conn.base)
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            return request()
+        except requests.RequestException as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt >= MAX_RETRIES:
+                raise
+            attempt += 1
+            time.sleep(delay)
+
+
+def _is_record_error(error: requests.RequestException) -> bool:
+    return error.response is not None and error.response.status_code in RECORD_ERROR_STATUSES
+
+
+def update_tasks(conn: AirtableConnection, tasks: List[Task]) -> UpdateResult:
+    """
+    Update task status in Airtable.
+    Records are sent in batches of MAX_BATCH_SIZE. A batch rejected because of
+    one of its records is retried one record at a time, so that a single bad
+    record doesn't fail the others. A batch that fails for any other reason,
+    such as still being rate limited once out of retries, fails along with
+    every batch after it, which is not sent.
+    """
+    airtable = client(conn)
+    table = airtable.table(conn.table)
+    result = UpdateResult()
+
+    # Determine the status value based on task completion. Later entries for the
+    # same record win, since Airtable rejects a batch that repeats a record.
+    records_by_id = {}
+    refs = {}
     for task in tasks:
         status_value = conn.completed_value if task.completed else conn.incompleted_value
-        table.update(task.id, {conn.status_field: status_value})
+        records_by_id[task.id] = {"id": task.id, "fields": {conn.status_field: status_value}}
+        refs[task.id] = task_ref(task)
+    records = list(records_by_id.values())
+
+    def send(start: int, batch: List[dict]) -> bool:
+        """
+        Send a batch, splitting it up if one of its records is rejected.
+        Returns False, with every record from start on failed, if sending should stop.
+        """
+        try:
+            _send(conn, lambda: table.batch_update(batch))
+            result.updated.extend(refs[record["id"]] for record in batch)
+            return True
+        except requests.RequestException as e:
+            if not _is_record_error(e):
+                for record in records[start:]:
+                    result.failed[refs[record["id"]]] = str(e)
+                return False
+            if len(batch) == 1:
+                result.failed[refs[batch[0]["id"]]] = str(e)
+                return True
+
+        # Find out which records in the failed batch are to blame
+        return all(send(start + offset, [record]) for offset, record in enumerate(batch))
+
+    for start in range(0, len(records), MAX_BATCH_SIZE):
+        if not send(start, records[start:start + MAX_BATCH_SIZE]):
+            break
+
+    airtable.log_stats()
+    return result
 
 
 def from_config(datasource_name: str, config: dict) -> Datasource:
@@ -86,10 +399,14 @@ def from_config(datasource_name: str, config: dict) -> Datasource:
         status_field=config.get("status_field", "Status"),  # Default to "Status" if not specified
         completed_value=config.get("completed_value", "Done"),  # Default to "Done" if not specified
         incompleted_value=config.get("incompleted_value", "Not Done"),  # Default to "Not Done" if not specified
-        datasource=datasource_name
+        datasource=datasource_name,
+        incremental=config.get("incremental", True),
+        full_sync_interval=config.get("full_sync_interval", FULL_SYNC_INTERVAL),
+        last_modified_field=config.get("last_modified_field", "")
     )
     
     return Datasource(
         get_tasks=lambda: get_tasks(conn),
-        update_tasks=lambda task: update_tasks(conn, task)
+        update_tasks=lambda task: update_tasks(conn, task),
+        iter_tasks=lambda: iter_tasks(conn)
     )
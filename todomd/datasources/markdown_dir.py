@@ -1,12 +1,19 @@
 # The markdown directory datasource
+import logging
+import multiprocessing
 import os
-from dataclasses import dataclass
-from pathlib import Path
-from typing import List, Dict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from ..model import Task, Datasource
+from ..model import Task, TaskRef, Datasource, UpdateResult, task_ref
 from . import markdown_file
-from .. import task
+from .. import parse_cache, task
+
+logger = logging.getLogger(__name__)
+
+# Number of files handed to a worker process at a time
+PARSE_CHUNK_SIZE = 64
 
 
 @dataclass
@@ -14,59 +21,226 @@ class MarkdownDir:
     dir: str
     recursive: bool
     datasource: str
+    use_cache: bool = True
+    workers: int = 1  # Processes used to parse files, 1 parses in this process
+    write_workers: int = 8  # Files updated at the same time
+
+
+@dataclass
+class FileUpdateResult:
+    path: str  # Relative to the directory
+    updated: List[TaskRef] = field(default_factory=list)  # Tasks written
+    skipped: List[TaskRef] = field(default_factory=list)  # Tasks left alone
+    error: Optional[str] = None  # Set when the file could not be updated at all
+
+
+def _scan(dir_path: str, recursive: bool, rel_dir: str = "") -> Iterator[Tuple[str, str, os.stat_result]]:
+    """
+    Yield (path, relative path, stat) for each markdown file under dir_path.
+    Files come in the same order as Path.glob: the files of a directory first,
+    then each of its subdirectories in turn. Symlinked directories are not followed.
+    """
+    subdirs = []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            if entry.name.endswith(".md") and entry.is_file():
+                yield entry.path, os.path.join(rel_dir, entry.name), entry.stat()
+            elif recursive and entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry)
+
+    for entry in subdirs:
+        yield from _scan(entry.path, recursive, os.path.join(rel_dir, entry.name))
+
+
+def _parse_chunk(file_paths: List[str]) -> List[Optional[List[markdown_file.ParsedTask]]]:
+    """
+    Parse a chunk of files in a worker process. Files that have disappeared
+    since they were listed come back as None.
+    """
+    results = []
+    for file_path in file_paths:
+        try:
+            results.append(markdown_file.parse_file(file_path))
+        except FileNotFoundError:
+            results.append(None)
+    return results
+
+
+def _process_context() -> multiprocessing.context.BaseContext:
+    """
+    The way parse workers are started. They are never forked from this process,
+    which may already be running threads, such as those reading other datasources.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
 
 
 def get_tasks(conn: MarkdownDir) -> List[Task]:
     """
     Fetch incomplete tasks from markdown files in a directory
     Each file is treated as a separate project, with the project name
-    being the file name without the extension
+    being the file name without the extension.
+    Files that aren't in the parse cache are parsed in chunks by a pool of
+    conn.workers processes while the directory is still being scanned.
     """
-    dir_path = os.path.expanduser(conn.dir)
+    dir_path = os.path.abspath(os.path.expanduser(conn.dir))
+    cache = parse_cache.get_cache() if conn.use_cache else None
+    executor = None
+    if conn.workers > 1:
+        executor = ProcessPoolExecutor(max_workers=conn.workers, mp_context=_process_context())
+
+    # One slot per file in scan order: [path, relative path, stat, parsed tasks, freshly parsed]
+    slots = []
+    # Slots whose files are being parsed by the pool: slot index -> (future, position in chunk)
+    pending: Dict[int, Tuple[Future, int]] = {}
+    chunk: List[int] = []
+
+    def submit_chunk() -> None:
+        future = executor.submit(_parse_chunk, [slots[index][0] for index in chunk])
+        for position, index in enumerate(chunk):
+            pending[index] = (future, position)
+        chunk.clear()
+
     tasks = []
-    
+    seen = []
+    parsed_count = 0
+    debug = logger.isEnabledFor(logging.DEBUG)
     try:
-        # Get all markdown files in the directory
-        if conn.recursive:
-            markdown_files = list(Path(dir_path).glob("**/*.md"))
-        else:
-            markdown_files = list(Path(dir_path).glob("*.md"))
-        
-        for file_path in markdown_files:
-            # Get relative path for task path construction
-            rel_path = file_path.relative_to(dir_path)
-
-            # Read file tasks
-            mfile = markdown_file.MarkdownFile(str(file_path), conn.datasource) 
-            file_tasks = markdown_file.get_tasks(mfile)
-            print(f"File: {file_path}, Tasks: {len(file_tasks)}")
-
-            # Add task paths
-            for task in file_tasks:
-                task.path = f"{rel_path}"
-            tasks.extend(file_tasks)
+        try:
+            for file_path, rel_path, st in _scan(dir_path, conn.recursive):
+                parsed_tasks = cache.get(file_path, st) if cache else None
+                fresh = parsed_tasks is None
 
-    except FileNotFoundError:
-        # If directory doesn't exist, return empty list
-        pass
+                # Parse in this process when there's no pool to hand the file to
+                if fresh and executor is None:
+                    parsed_tasks = _parse_chunk([file_path])[0]
+                slots.append([file_path, rel_path, st, parsed_tasks, fresh])
+
+                if fresh and executor is not None:
+                    chunk.append(len(slots) - 1)
+                    if len(chunk) >= PARSE_CHUNK_SIZE:
+                        submit_chunk()
+        except FileNotFoundError:
+            # If directory doesn't exist, return empty list
+            pass
+        if chunk:
+            submit_chunk()
+
+        for index, (file_path, rel_path, st, parsed_tasks, fresh) in enumerate(slots):
+            if index in pending:
+                future, position = pending[index]
+                parsed_tasks = future.result()[position]
+
+            # Skip files deleted while scanning
+            if parsed_tasks is None:
+                continue
+            seen.append(file_path)
+            if debug:
+                logger.debug("File: %s, Tasks: %d", file_path, len(parsed_tasks))
+            if fresh:
+                parsed_count += 1
+                if cache:
+                    cache.put(file_path, st, parsed_tasks)
+
+            # Only include incomplete tasks
+            for task_id, task_name, completed, _ in parsed_tasks:
+                if not completed:
+                    tasks.append(Task(id=task_id, path=rel_path, datasource=conn.datasource, name=task_name, completed=False))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    logger.info("Read %d tasks from %d files in %s, %d parsed", len(tasks), len(seen), dir_path, parsed_count)
+
+    if cache:
+        cache.prune(dir_path, seen, conn.recursive)
+        cache.save()
     
     return tasks
 
-def update_tasks(conn: MarkdownDir, tasks: List[Task]):
+def _update_file(conn: MarkdownDir, dir_path: str, file: str, tasks: List[Task]) -> FileUpdateResult:
     """
-    Update task status in the appropriate markdown file.
-    Uses the markdown_file datasource to update tasks.
+    Update the tasks of a single file, capturing any error in the result
+    """
+    try:
+        file_path = os.path.join(dir_path, file) # Make the path absolute
+        mfile = markdown_file.MarkdownFile(file_path, conn.datasource, conn.use_cache)
+        result = markdown_file.update_tasks(mfile, tasks, save_cache=False)
+        return FileUpdateResult(path=file, updated=result.updated, skipped=result.skipped)
+    except Exception as e:
+        return FileUpdateResult(path=file, error=str(e), skipped=[task_ref(t) for t in tasks])
+
+
+def write_back(conn: MarkdownDir, tasks: List[Task]) -> List[FileUpdateResult]:
+    """
+    Update task status in the appropriate markdown files, updating up to
+    conn.write_workers files at the same time.
+    Returns one result per file, in the order the files first appear in tasks.
     """
     dir_path = os.path.expanduser(conn.dir)
     by_path = task.group_by_path(tasks)
-  
-    for file, tasks in by_path.items():
-        try: 
-            file_path = os.path.join(dir_path, file) # Make the path absolute
-            mfile = markdown_file.MarkdownFile(file_path, conn.datasource)
-            markdown_file.update_tasks(mfile, tasks)
-        except Exception as e:
-            print(f"Error updating tasks in {file}: {e}")
+    if len(by_path) <= 1 or conn.write_workers <= 1:
+        results = [_update_file(conn, dir_path, file, file_tasks) for file, file_tasks in by_path.items()]
+    else:
+        with ThreadPoolExecutor(max_workers=conn.write_workers) as executor:
+            results = list(executor.map(lambda item: _update_file(conn, dir_path, *item), by_path.items()))
+
+    # The files patched in place are cached as they are now, saved once for all of them
+    if conn.use_cache:
+        parse_cache.get_cache().save()
+    return results
+
+
+def update_tasks(conn: MarkdownDir, tasks: List[Task]) -> UpdateResult:
+    """
+    Update task status in the appropriate markdown file.
+    Uses the markdown_file datasource to update tasks, see write_back for the
+    result of each file.
+    """
+    result = UpdateResult()
+    for file_result in write_back(conn, tasks):
+        result.updated.extend(file_result.updated)
+        if file_result.error is None:
+            result.skipped.extend(file_result.skipped)
+        else:
+            for ref in file_result.skipped:
+                result.failed[ref] = f"{file_result.path}: {file_result.error}"
+    return result
+
+
+def backfill_ids(conn: MarkdownDir) -> markdown_file.IdMapping:
+    """
+    Write new IDs for the tasks without one in every markdown file, up to
+    conn.write_workers files at the same time. See markdown_file.backfill_file.
+    """
+    dir_path = os.path.abspath(os.path.expanduser(conn.dir))
+    files = [(file_path, rel_path) for file_path, rel_path, _ in _scan(dir_path, conn.recursive)]
+
+    def backfill(file: Tuple[str, str]) -> markdown_file.IdMapping:
+        file_path, rel_path = file
+        try:
+            mapping = markdown_file.backfill_file(file_path)
+        except FileNotFoundError:
+            return {}
+        return {(rel_path, old_id): new_id for old_id, new_id in mapping.items()}
+
+    result: markdown_file.IdMapping = {}
+    with ThreadPoolExecutor(max_workers=max(1, conn.write_workers)) as executor:
+        for mapping in executor.map(backfill, files):
+            result.update(mapping)
+    return result
+
+
+def fingerprint(conn: MarkdownDir) -> Optional[Tuple[Tuple[str, parse_cache.FileKey], ...]]:
+    """
+    The relative path, size, mtime and inode of every markdown file in the
+    directory, or None if the directory doesn't exist
+    """
+    dir_path = os.path.abspath(os.path.expanduser(conn.dir))
+    try:
+        return tuple((rel_path, parse_cache.file_key(st)) for _, rel_path, st in _scan(dir_path, conn.recursive))
+    except FileNotFoundError:
+        return None
 
 
 def from_config(datasource_name: str, config: dict) -> Datasource:
@@ -76,9 +250,14 @@ def from_config(datasource_name: str, config: dict) -> Datasource:
     conn = MarkdownDir(
         dir=config["dir"],
         recursive=config.get("recursive", False),
-        datasource=datasource_name
+        datasource=datasource_name,
+        use_cache=config.get("parse_cache", True),
+        workers=config.get("workers", 1),
+        write_workers=config.get("write_workers", 8)
     )
     return Datasource(
         get_tasks=lambda: get_tasks(conn),
-        update_tasks=lambda tasks: update_tasks(conn, tasks)
+        update_tasks=lambda tasks: update_tasks(conn, tasks),
+        fingerprint=lambda: fingerprint(conn),
+        backfill_ids=lambda: backfill_ids(conn)
     )
@@ -1,43 +1,34 @@
 # The markdown file datasource
 import hashlib
+import logging
 import os
-import re
 from dataclasses import dataclass
-from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 
 from todomd import datasource
 
-from ..model import Task, Datasource
-from .. import task
+from ..model import Task, Datasource, UpdateResult, task_ref
+from .. import fsutil, parse_cache, task, tokenizer
+
+logger = logging.getLogger(__name__)
+
+# A parsed task line: (task_id, task_name, completed, offset of the checkbox character)
+ParsedTask = Tuple[str, str, bool, int]
+
+# What the checkbox looks like around a checkbox offset
+_CHECKBOXES = (b"[ ]", b"[x]", b"[X]")
+
+# Hex characters in the ids written by backfill_ids (48 bits)
+BACKFILL_ID_LENGTH = 12
+
+# Task ids by (path, generated id), mapped to the ids written in their place
+IdMapping = Dict[Tuple[Optional[str], str], str]
 
 @dataclass
 class MarkdownFile:
     file: str
     datasource: str
-
-
-def _parse_task_line(line: str) -> Optional[Tuple[str, str, bool]]:
-    """
-    Parse a markdown task line into its components
-    Returns (task_id, task_name, completed) or None if not a valid task line
-    """
-    # Match checkbox markdown format with optional task ID
-    pattern = r"^\*\s+\[([ xX])\]\s+(.+?)(?:\s+@tid:([a-zA-Z0-9]+))?$"
-    match = re.match(pattern, line.strip())
-    
-    if not match:
-        return None
-    
-    # Extract components
-    checkbox, task_name, task_id = match.groups()
-    completed = checkbox.lower() == "x"
-    
-    # If no task ID, generate one
-    if not task_id:
-        task_id = generate_task_id(task_name)
-    
-    return task_id, task_name, completed
+    use_cache: bool = True
 
 
 def generate_task_id(task_name: str) -> str:
@@ -48,6 +39,56 @@ def generate_task_id(task_name: str) -> str:
     return task_hash[-5:]
 
 
+def new_task_id(task_name: str, taken: Set[str]) -> str:
+    """
+    Generate a BACKFILL_ID_LENGTH character task ID that isn't in taken.
+    Derived from the task name, with a counter mixed in until it is unique.
+    """
+    attempt = 0
+    while True:
+        data = task_name if attempt == 0 else f"{task_name}\0{attempt}"
+        task_id = hashlib.sha256(data.encode()).hexdigest()[:BACKFILL_ID_LENGTH]
+        if task_id not in taken:
+            return task_id
+        attempt += 1
+
+
+def parse_file(file_path: str) -> List[ParsedTask]:
+    """
+    Parse every task line in a markdown file, completed or not
+    """
+    parsed_tasks = []
+    with tokenizer.open_buffer(file_path) as buffer:
+        for offset, task_name, completed, task_id in tokenizer.iter_source_tokens(buffer):
+            parsed_tasks.append((task_id or generate_task_id(task_name), task_name, completed, offset))
+    return parsed_tasks
+
+
+def read_parsed(file_path: str, use_cache: bool = True, st: Optional[os.stat_result] = None) -> List[ParsedTask]:
+    """
+    Returns the parsed task lines of a file, from the parse cache when the file
+    hasn't changed since it was last parsed.
+    Raises FileNotFoundError if the file doesn't exist.
+    """
+    if not use_cache:
+        return parse_file(file_path)
+
+    cache = parse_cache.get_cache()
+    file_path = os.path.abspath(file_path)
+    try:
+        if st is None:
+            st = os.stat(file_path)
+    except FileNotFoundError:
+        cache.discard(file_path)
+        raise
+
+    parsed_tasks = cache.get(file_path, st)
+    if parsed_tasks is None:
+        parsed_tasks = parse_file(file_path)
+        cache.put(file_path, st, parsed_tasks)
+    return parsed_tasks
+
+
 def get_tasks(conn: MarkdownFile) -> List[Task]:
     """
     Fetch incomplete tasks from a markdown file
@@ -56,66 +97,207 @@ def get_tasks(conn: MarkdownFile) -> List[Task]:
     tasks = []
     
     try:
-        with open(file_path, "r") as f:
-            for line in f:
-                # Skip if not a task line
-                parsed = _parse_task_line(line)
-                if not parsed:
-                    continue
-                
-                task_id, task_name, completed = parsed
-                
-                # Only include incomplete tasks
-                if not completed:
-                    task = Task(
-                        id=task_id,
-                        path=None,
-                        name=task_name,
-                        completed=False,
-                        datasource=conn.datasource
-                    )
-                    tasks.append(task)
+        for task_id, task_name, completed, _ in read_parsed(file_path, conn.use_cache):
+            # Only include incomplete tasks
+            if not completed:
+                task = Task(
+                    id=task_id,
+                    path=None,
+                    name=task_name,
+                    completed=False,
+                    datasource=conn.datasource
+                )
+                tasks.append(task)
     except FileNotFoundError:
         # If file doesn't exist, return empty list
         pass
+
+    if conn.use_cache:
+        parse_cache.get_cache().save()
     
     return tasks
 
-def update_tasks(conn: MarkdownFile, tasks: List[Task]):
+def _patch_checkboxes(file_path: str, st: os.stat_result, patches: List[Tuple[int, bool]]) -> bool:
     """
-    Update task status in markdown file
-    Returns True if successful, False otherwise
+    Overwrite checkbox characters in place with positioned writes.
+    Only done if the file is still the one the offsets were taken from and every
+    offset still points into a checkbox. Returns False, without writing
+    anything, otherwise.
     """
-    file_path = os.path.expanduser(conn.file)
-    tasks_by_id = task.group_by_id(tasks)
-    
-    # Read file content
-    with open(file_path, "r") as f:
-        lines = f.readlines()
-    
-    # Find and update the task
-    updated = False
+    if not patches:
+        return True
+    fd = os.open(file_path, os.O_RDWR)
+    try:
+        if parse_cache.file_key(os.fstat(fd)) != parse_cache.file_key(st):
+            return False
+        for offset, _ in patches:
+            if os.pread(fd, 3, offset - 1) not in _CHECKBOXES:
+                return False
+
+        for offset, completed in patches:
+            os.pwrite(fd, b"x" if completed else b" ", offset)
+    finally:
+        os.close(fd)
+    return True
+
+
+def _format_line(line: bytes, t: Task, task_id: Optional[str]) -> bytes:
+    """
+    Format a task line, keeping the indentation and line ending of the line it replaces
+    """
+    indent = line[:len(line) - len(line.lstrip(b" \t"))]
+    ending = line[len(line.rstrip(b"\r\n")):]
+    checkbox = "x" if t.completed else " "
+    text = f"* [{checkbox}] {t.name}" + (f" @tid:{task_id}" if task_id else "")
+    return indent + text.encode() + ending
+
+
+def _rewrite_file(file_path: str, tasks_by_id: Dict[str, Task]) -> List[str]:
+    """
+    Rewrite the lines of the given tasks and write the whole file back.
+    Returns the ids of the tasks whose lines changed.
+    """
+    with open(file_path, "rb") as f:
+        lines = f.read().splitlines(keepends=True)
+
+    updated = []
     for i, line in enumerate(lines):
-        parsed = _parse_task_line(line)
+        parsed = tokenizer.parse_source_line(line.decode())
         if not parsed:
             continue
-           
-        task_id, _, _ = parsed
-        if task_id not in tasks_by_id:
+
+        task_name, completed, explicit_id = parsed
+        task_id = explicit_id or generate_task_id(task_name)
+        t = tasks_by_id.get(task_id)
+        if t is None or (t.name, t.completed) == (task_name, completed):
             continue
 
-        t = tasks_by_id[task_id]
-        # Create updated line with same task_id
-        checkbox = "x" if t.completed else " "
-        # lines[i] = f"* [{checkbox}] {task.name} @tid:{task.path}\n"
-        lines[i] = f"* [{checkbox}] {t.name}\n"
-        updated = True
-    
-    # Write back to file if updated
+        # An id derived from the old name is written out, so the task keeps it
+        if explicit_id is None and t.name != task_name:
+            explicit_id = task_id
+        lines[i] = _format_line(line, t, explicit_id)
+        updated.append(task_id)
+
     if updated:
-        with open(file_path, "w") as f:
-            f.writelines(lines)
-    
+        fsutil.atomic_write(file_path, b"".join(lines))
+    return updated
+
+
+def update_tasks(conn: MarkdownFile, tasks: List[Task], save_cache: bool = True) -> UpdateResult:
+    """
+    Update task status in markdown file.
+    When only checkboxes change they are overwritten in place, at the offsets
+    recorded when the file was parsed, so the cost depends on the number of
+    changes rather than the size of the file. The whole file is only rewritten
+    when a task name changes, or when it changed since it was parsed.
+    Other todomd processes are kept from updating the file at the same time.
+    The parse cache is saved afterwards unless save_cache is False, for callers
+    updating several files that save it once at the end.
+    """
+    file_path = os.path.abspath(os.path.expanduser(conn.file))
+    with fsutil.locked(file_path):
+        result = _update_locked(conn, file_path, task.group_by_id(tasks))
+    if conn.use_cache and save_cache:
+        parse_cache.get_cache().save()
+    return result
+
+
+def _update_locked(conn: MarkdownFile, file_path: str, tasks_by_id: Dict[str, Task]) -> UpdateResult:
+    st = os.stat(file_path)
+    parsed_tasks = read_parsed(file_path, conn.use_cache, st)
+
+    # Find the checkboxes to flip, and whether any task was renamed
+    patches = []
+    rewrite = False
+    for task_id, task_name, completed, offset in parsed_tasks:
+        t = tasks_by_id.get(task_id)
+        if t is None:
+            continue
+        if t.name != task_name:
+            rewrite = True
+        elif t.completed != completed:
+            patches.append((offset, t.completed))
+
+    if not rewrite and _patch_checkboxes(file_path, st, patches):
+        updated_ids = {task_id for task_id, _, completed, _ in parsed_tasks
+                       if task_id in tasks_by_id and tasks_by_id[task_id].completed != completed}
+
+        # The parsed tasks are still valid apart from the patched checkboxes
+        if conn.use_cache and patches:
+            parsed_tasks = [(task_id, task_name, tasks_by_id[task_id].completed if task_id in updated_ids else completed, offset)
+                            for task_id, task_name, completed, offset in parsed_tasks]
+            parse_cache.get_cache().put(file_path, os.stat(file_path), parsed_tasks)
+    else:
+        updated_ids = set(_rewrite_file(file_path, tasks_by_id))
+
+    return UpdateResult(
+        updated=[task_ref(t) for task_id, t in tasks_by_id.items() if task_id in updated_ids],
+        skipped=[task_ref(t) for task_id, t in tasks_by_id.items() if task_id not in updated_ids]
+    )
+
+
+def backfill_file(file_path: str) -> Dict[str, str]:
+    """
+    Give every task line of a file without an @tid: tag one with a new ID,
+    unique within the file, and write the file back once. Returns the IDs
+    generated from the task names, mapped to the new IDs. When several lines
+    had the same generated ID, the mapping is to the ID of the last one, the
+    task that lookups by ID found.
+    """
+    with fsutil.locked(file_path):
+        with open(file_path, "rb") as f:
+            lines = f.read().splitlines(keepends=True)
+
+        # Index every ID already written down, to check new ones against
+        parsed = [tokenizer.parse_source_line(line.decode()) for line in lines]
+        taken: Set[str] = set()
+        duplicates = 0
+        for p in parsed:
+            if p and p[2]:
+                duplicates += p[2] in taken
+                taken.add(p[2])
+        if duplicates:
+            logger.warning("%s has %d task IDs used more than once", file_path, duplicates)
+
+        mapping = {}
+        for i, p in enumerate(parsed):
+            if not p or p[2]:
+                continue
+            task_name = p[0]
+            task_id = new_task_id(task_name, taken)
+            taken.add(task_id)
+            mapping[generate_task_id(task_name)] = task_id
+
+            line = lines[i]
+            ending = line[len(line.rstrip(b"\r\n")):]
+            lines[i] = line.rstrip(b" \t\r\n") + f" @tid:{task_id}".encode() + ending
+
+        if mapping:
+            fsutil.atomic_write(file_path, b"".join(lines))
+    return mapping
+
+
+def backfill_ids(conn: MarkdownFile) -> IdMapping:
+    """
+    Write new IDs for the tasks of the file that don't have one, see backfill_file
+    """
+    file_path = os.path.abspath(os.path.expanduser(conn.file))
+    try:
+        mapping = backfill_file(file_path)
+    except FileNotFoundError:
+        return {}
+    return {(None, old_id): new_id for old_id, new_id in mapping.items()}
+
+
+def fingerprint(conn: MarkdownFile) -> Optional[parse_cache.FileKey]:
+    """
+    The size, mtime and inode of the file, or None if it doesn't exist
+    """
+    try:
+        return parse_cache.file_key(os.stat(os.path.expanduser(conn.file)))
+    except FileNotFoundError:
+        return None
+
 
 def from_config(datasource_name: str, config: dict) -> Datasource:
     """
@@ -123,9 +305,12 @@ def from_config(datasource_name: str, config: dict) -> Datasource:
     """
     conn = MarkdownFile(
         file=config["file"],
-        datasource=datasource_name
+        datasource=datasource_name,
+        use_cache=config.get("parse_cache", True)
     )
     return Datasource(
         get_tasks=lambda: get_tasks(conn),
-        update_tasks=lambda tasks: update_tasks(conn, tasks)
+        update_tasks=lambda tasks: update_tasks(conn, tasks),
+        fingerprint=lambda: fingerprint(conn),
+        backfill_ids=lambda: backfill_ids(conn)
     )
@@ -0,0 +1,64 @@
+import contextlib
+import os
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where files are written without locking
+    fcntl = None
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    '''
+    Write data to the given path by writing a temporary file in the same directory
+    and renaming it over the destination, so readers never see a partial file.
+    A symlink is written through: the file it points to is the one replaced.
+    '''
+    # Imported here, as it is slow to import and most runs write nothing
+    import tempfile
+
+    path = os.path.realpath(path)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Keep the permissions of the file being replaced
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+@contextlib.contextmanager
+def locked(path: str) -> Iterator[None]:
+    '''
+    Hold an exclusive advisory lock on the given file while the block runs,
+    waiting for other todomd processes holding it. The lock is taken on a
+    separate file in the cache directory, which outlives the renames done by
+    atomic_write and keeps lock files out of the directories being synced.
+    Paths are resolved first, so a file and the symlinks to it share one lock.
+    '''
+    if fcntl is None:
+        yield
+        return
+
+    # Imported here, as cache itself writes through this module
+    from . import cache
+
+    lock_path = cache.cache_dir("locks", f"{cache.cache_key(os.path.realpath(path))}.lock")
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing the file releases the lock
+        os.close(fd)
@@ -1,11 +1,13 @@
 import argparse
+import datetime
+import logging
 import os
 import sys
 import yaml
-from typing import Any, Dict, List
-from . import datasource, todo_file, ui
+from typing import Any, Dict, List, Optional
+from . import batch, datasource, profile, query, sync, task, todo_file, watch
 
-from .model import Task
+logger = logging.getLogger(__name__)
 
 def read_config(path: str) -> Dict[str, Any]:
     '''
@@ -14,60 +16,271 @@ def read_config(path: str) -> Dict[str, Any]:
     '''
     try:
         with open(path, 'r') as f:
-            config = yaml.safe_load(f)
+            # The C loader is much faster when libyaml is available
+            config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
             
         # Validate that the config has the expected structure
         if not isinstance(config, dict):
-            print(f"Warning: Config file {path} is not a valid YAML dictionary")
+            logger.warning("Config file %s is not a valid YAML dictionary", path)
             return {'datasources': []}
             
         if 'datasources' not in config:
-            print(f"Warning: Config file {path} doesn't have 'datasources' section")
+            logger.warning("Config file %s doesn't have 'datasources' section", path)
             config['datasources'] = []
             
         return config
     except FileNotFoundError:
-        print(f"Warning: Config file {path} not found, using empty configuration")
+        logger.warning("Config file %s not found, using empty configuration", path)
         return {'datasources': []}
     except yaml.YAMLError as e:
-        print(f"Error parsing config file {path}: {e}")
+        logger.error("Error parsing config file %s: %s", path, e)
         return {'datasources': []}
     except Exception as e:
-        print(f"Unexpected error reading config file {path}: {e}")
+        logger.error("Unexpected error reading config file %s: %s", path, e)
         return {'datasources': []}
 
-def main():
-    # Parse command line arguments
+def watch_main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(prog='todomd watch', description='Keep a markdown file and its datasources in sync until interrupted')
+    parser.add_argument('file', help='The markdown file to keep in sync')
+    parser.add_argument('--interval', type=float, default=watch.DEFAULT_INTERVAL, help=f'Seconds between checks for changes (default: {watch.DEFAULT_INTERVAL:g})')
+    parser.add_argument('--refresh', type=float, default=watch.DEFAULT_REFRESH, help=f'Seconds between reads of datasources that can\'t tell when they changed, such as Airtable (default: {watch.DEFAULT_REFRESH:g})')
+    parser.add_argument('--config', help='Path to config file (default: ~/.config/todomd.yml). Will also use TODOMD_CONFIG env var if set.')
+    parser.add_argument('--workers', type=int, help=f'Number of datasources read or updated at the same time (default: {datasource.DEFAULT_WORKERS})')
+    parser.add_argument('--timeout', type=float, help='Seconds allowed for each datasource before it is skipped (default: no limit)')
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='Log progress (-v) or everything (-vv) to stderr')
+    args = parser.parse_args(argv)
+
+    level = logging.WARNING if args.verbose == 0 else logging.INFO if args.verbose == 1 else logging.DEBUG
+    logging.basicConfig(level=level, format='%(levelname)s %(name)s: %(message)s')
+
+    config_path = os.path.expanduser(args.config or os.getenv('TODOMD_CONFIG', '~/.config/todomd.yml'))
+    config = read_config(config_path)
+    workers = args.workers or config.get('workers', datasource.DEFAULT_WORKERS)
+    timeout = args.timeout if args.timeout is not None else config.get('timeout')
+    datasources = datasource.from_config(config['datasources'], default_timeout=timeout)
+
+    watcher = watch.Watcher(args.file, datasources, workers=workers, interval=args.interval, refresh=args.refresh)
+    watcher.run()
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description='TODOMD: Task management with markdown files')
-    parser.add_argument('file', help='The markdown file to read/write tasks')
+    parser.add_argument('file', nargs='?', help='The markdown file to read/write tasks. Without it, the selected tasks are written to stdout.')
     parser.add_argument('--update-datasources', action='store_true', help='Update datasources with task status from the markdown file')
+    parser.add_argument('--archive', action='store_true', help='Move the completed tasks already synced with their datasource to a monthly archive file next to the markdown file. With --update-datasources, after updating them.')
+    parser.add_argument('--backfill-ids', action='store_true', help='Write an @tid: id on every task of the markdown datasources that has none, and update the markdown file to use the new ids')
+    parser.add_argument('--batch', action='store_true', help='Select tasks with --select instead of the UI and write what happens to stdout as JSON Lines')
+    parser.add_argument('--select', action='append', metavar='QUERY', help='Tasks to select in batch mode, such as "datasource=work path=*.md name~review status=open" (default: all open tasks). Repeat to select tasks matching any of the queries.')
+    parser.add_argument('--dry-run', action='store_true', help='In batch mode, only list the tasks that would be added, without writing the file')
     parser.add_argument('--config', help='Path to config file (default: ~/.config/todomd.yml). Will also use TODOMD_CONFIG env var if set.')
+    parser.add_argument('--workers', type=int, help=f'Number of datasources read or updated at the same time (default: {datasource.DEFAULT_WORKERS})')
+    parser.add_argument('--timeout', type=float, help='Seconds allowed for each datasource before it is skipped (default: no limit)')
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='Log progress (-v) or everything (-vv) to stderr')
+    parser.add_argument('--profile', action='store_true', help='Write a JSON report of the time spent in each phase to stderr')
+    parser.add_argument('--profile-output', metavar='FILE', help='Write the --profile report to FILE instead of stderr, implies --profile')
+    return parser
+
+def main():
+    # The watch command has options of its own
+    if sys.argv[1:2] == ['watch']:
+        watch_main(sys.argv[2:])
+        return
+
+    # Parse command line arguments
+    parser = build_parser()
     args = parser.parse_args()
 
+    if args.update_datasources and not args.file:
+        parser.error('--update-datasources needs the markdown file to read the task status from')
+    if args.archive and (not args.file or args.batch and not args.update_datasources):
+        parser.error('--archive needs the markdown file to archive tasks from, and can only be combined with --update-datasources')
+    if args.backfill_ids and (not args.file or args.update_datasources or args.batch):
+        parser.error('--backfill-ids needs the markdown file whose tasks are updated to the new ids, and no other mode')
+    if (args.select or args.dry_run) and not args.batch:
+        parser.error('--select and --dry-run are only used with --batch')
+    try:
+        matchers = [query.parse(expression) for expression in args.select or [""]]
+    except ValueError as e:
+        parser.error(str(e))
+    args.matches = lambda t: any(matches(t) for matches in matchers)
+
+    # Only warnings and errors are logged unless asked for more
+    level = logging.WARNING if args.verbose == 0 else logging.INFO if args.verbose == 1 else logging.DEBUG
+    logging.basicConfig(level=level, format='%(levelname)s %(name)s: %(message)s')
+
+    if args.profile or args.profile_output:
+        profile.enable()
+    try:
+        run(args)
+    finally:
+        if args.profile or args.profile_output:
+            profile.write_report(args.profile_output or "-")
+
+def archive_tasks(todo_doc: todo_file.TodoDocument, state: sync.SyncState,
+                  events: Optional[batch.JsonLines] = None) -> None:
+    '''
+    Move the completed tasks of the todo file that are in sync with their
+    datasource, as of the last sync, to this month's archive file
+    '''
+    with profile.phase("archive") as counts:
+        # A task listed more than once is only archived if every copy is done
+        keys: Dict[task.TaskKey, bool] = {}
+        for t in todo_doc.tasks:
+            key = task.task_key(t)
+            keys[key] = keys.get(key, True) and t.completed and state.get(key) == sync.task_hash(t)
+        archived = [t for t in todo_doc.tasks if keys[task.task_key(t)]]
+        if not todo_doc.remove_tasks(archived):
+            counts["tasks"] = 0
+            return
+
+        # Only the lines still removed once changes made by other runs are applied are
+        # archived, written while the todo file is locked and before it, so a failed
+        # run can't lose them
+        archived_lines: List[bytes] = []
+        today = datetime.date.today()
+        archive_path = todo_file.archive_path(todo_doc.file_path, today)
+
+        def archive(lines: List[bytes]) -> None:
+            todo_file.append_archive(todo_doc.file_path, lines, today)
+            archived_lines.extend(lines)
+
+        todo_doc.commit(on_removed=archive)
+        archived = [t for t in archived if task.task_key(t) not in todo_doc.line_index]
+        counts["tasks"] = len(archived_lines)
+        counts["bytes"] = todo_doc.size
+        state.prune(todo_doc.tasks)
+        state.save()
+
+    logger.info("Archived %d tasks to %s", len(archived_lines), archive_path)
+    if events:
+        for t in archived:
+            events.emit("archived", task=batch.task_json(t), file=archive_path)
+
+def backfill_ids(datasources: Dict[str, datasource.Datasource], todo_file_path: str, workers: int) -> None:
+    '''
+    Have every datasource that can write ids for its tasks do so, then update
+    the todo file and its sync state to the new ids
+    '''
+    with profile.phase("backfill") as counts:
+        mappings = datasource.backfill_ids(datasources, workers=workers)
+        counts["tasks"] = sum(len(mapping) for mapping in mappings.values())
+
+    with profile.phase("write_back") as counts:
+        todo_doc = todo_file.TodoDocument.load(todo_file_path)
+        state = sync.SyncState.load(todo_file_path)
+        remapped = 0
+        for ds_name, mapping in mappings.items():
+            remapped += len(todo_doc.remap_ids(ds_name, mapping))
+            state.remap_ids(ds_name, mapping)
+            logger.info("Replaced %d generated task ids of datasource %s", len(mapping), ds_name)
+        todo_doc.commit()
+        state.save()
+        counts["tasks"] = remapped
+    logger.info("Updated %d tasks in %s to their new ids", remapped, todo_doc.file_path)
+
+def run(args: argparse.Namespace) -> None:
     # Read the config file
-    config_path = args.config or os.getenv('TODOMD_CONFIG', '~/.config/todomd.yml')
-    config = read_config(os.path.expanduser(config_path))
+    config_path = os.path.expanduser(args.config or os.getenv('TODOMD_CONFIG', '~/.config/todomd.yml'))
+    with profile.phase("config") as counts:
+        config = read_config(config_path)
+        counts["bytes"] = os.path.getsize(config_path) if os.path.exists(config_path) else 0
 
     # Get todo file path from args
     todo_file_path = args.file
 
+    # Command line options take precedence over the config file
+    workers = args.workers or config.get('workers', datasource.DEFAULT_WORKERS)
+    timeout = args.timeout if args.timeout is not None else config.get('timeout')
+
+    # Archiving on its own only needs the todo file and its sync state
+    if args.archive and not args.update_datasources:
+        archive_tasks(todo_file.TodoDocument.load(todo_file_path), sync.SyncState.load(todo_file_path))
+        return
+
     # Read tasks
-    datasources = datasource.from_config(config['datasources'])
-    todo_tasks = todo_file.read_tasks(todo_file_path)
-    datasource_tasks = datasource.read_tasks(datasources)
-
-    # Print the number of tasks read from the todo file and datasources for debugging
-    print(f"Todo tasks read from file: {len(todo_tasks)}")
-
-    # Handle update mode
-    if args.update_datasources:
-        datasource.update_tasks(datasources, todo_tasks, datasource_tasks)
-        sys.exit(0)
-   
-    # Update the todo file
-    tasks_to_add = ui.select_tasks(todo_tasks, datasource_tasks)
-    todo_file.update_tasks(todo_file_path, todo_tasks, datasource_tasks)
-    todo_file.add_tasks(todo_file_path, tasks_to_add)
+    datasources = datasource.from_config(config['datasources'], default_timeout=timeout)
+
+    if args.backfill_ids:
+        backfill_ids(datasources, todo_file_path, workers)
+        return
+
+    # When selecting tasks, the datasources are read in the background while the UI is shown
+    stream = None if args.update_datasources else datasource.stream_tasks(datasources, workers=workers)
+
+    todo_doc = None
+    if todo_file_path:
+        with profile.phase("todo_parse") as counts:
+            todo_doc = todo_file.TodoDocument.load(todo_file_path)
+            counts.update(tasks=len(todo_doc.tasks), bytes=todo_doc.size)
+        logger.info("Todo tasks read from file: %d", len(todo_doc.tasks))
+    todo_index = task.TaskIndex(todo_doc.tasks if todo_doc else [])
+
+    events = batch.JsonLines(sys.stdout) if args.batch else None
+    try:
+        # Handle update mode
+        if stream is None:
+            with profile.phase("fetch") as counts:
+                datasource_tasks = datasource.read_tasks(datasources, workers=workers)
+                counts["tasks"] = len(datasource_tasks)
+            # Only the tasks changed in the todo file since the last sync are sent
+            state = sync.SyncState.load(todo_file_path)
+            on_result, on_conflict = None, None
+            if events:
+                on_result = batch.update_events(events)
+                on_conflict = lambda todo_task, ds_task: batch.emit_conflict(events, todo_task, ds_task)
+            datasource.update_tasks(datasources, todo_index, task.TaskIndex(datasource_tasks), workers=workers,
+                                    on_result=on_result, state=state, on_conflict=on_conflict)
+            state.prune(todo_index)
+            state.save()
+            if args.archive:
+                archive_tasks(todo_doc, state, events)
+            return
+
+        if events:
+            with profile.phase("select") as counts:
+                tasks_to_add = batch.select_tasks(stream, todo_index, args.matches, events)
+                counts["tasks"] = len(tasks_to_add)
+        else:
+            # The UI, and curses with it, is only loaded when tasks are selected
+            from . import ui
+            with profile.phase("ui") as counts:
+                tasks_to_add = ui.select_tasks(todo_index, stream)
+                counts["tasks"] = len(tasks_to_add)
+
+        # The todo file is updated from every datasource, so wait for any still loading
+        with profile.phase("fetch") as counts:
+            datasource_index = task.TaskIndex(stream.wait())
+            counts["tasks"] = len(datasource_index)
+
+        # What the todo file and the datasources looked like the last time they were synced
+        state = sync.SyncState.load(todo_file_path) if todo_doc is not None else None
+
+        if events:
+            with profile.phase("write_back"):
+                batch.sync_todo_file(todo_doc, datasource_index, tasks_to_add, events, dry_run=args.dry_run, state=state)
+            return
+
+        # Without a todo file, the selected tasks go to stdout
+        if todo_doc is None:
+            for t in tasks_to_add:
+                print(todo_file.format_task_line(t))
+            return
+
+        # Update the todo file, writing it once with both the updates and the new tasks
+        # Only the tasks changed in their datasource since the last sync are updated
+        with profile.phase("diff") as counts:
+            updated, _ = sync.pull(todo_doc, todo_index, datasource_index, state)
+            counts["tasks"] = len(updated)
+        with profile.phase("write_back") as counts:
+            added = todo_doc.add_tasks(tasks_to_add)
+            counts["tasks"] = len(added)
+            todo_doc.commit()
+            counts["bytes"] = todo_doc.size
+        state.prune(todo_doc.tasks)
+        state.record(added)
+        state.save()
+    finally:
+        if events:
+            events.summary()
 
 if __name__ == '__main__':
     main()
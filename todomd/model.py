@@ -1,8 +1,9 @@
-from dataclasses import dataclass
-from typing import Callable, List, Optional
+import sys
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 
-@dataclass
+@dataclass(slots=True)
 class Task:
     id: str
     path: Optional[str] 
@@ -10,8 +11,33 @@ class Task:
     name: str
     completed: bool
 
+    def __post_init__(self):
+        # Datasource names and paths repeat across many tasks, so every task shares one copy
+        self.datasource = sys.intern(self.datasource)
+        if self.path is not None:
+            self.path = sys.intern(self.path)
+
+
+# A task within its datasource, as (path, id): ids are only unique within a path
+TaskRef = Tuple[Optional[str], str]
+
+
+def task_ref(t: Task) -> TaskRef:
+    return (t.path, t.id)
+
+
+@dataclass
+class UpdateResult:
+    updated: List[TaskRef] = field(default_factory=list)  # Tasks that were written
+    skipped: List[TaskRef] = field(default_factory=list)  # Tasks that needed no change or weren't found
+    failed: Dict[TaskRef, str] = field(default_factory=dict)  # Tasks that could not be written, with the error
+
 
 @dataclass
 class Datasource:
     get_tasks: Callable[[], List[Task]]
-    update_tasks: Callable[[List[Task]], None]
+    update_tasks: Callable[[List[Task]], Optional[UpdateResult]]
+    timeout: Optional[float] = None  # Seconds allowed for a single get_tasks/update_tasks call
+    iter_tasks: Optional[Callable[[], Iterable[Task]]] = None  # Yields tasks as they arrive, for datasources that can stream them
+    fingerprint: Optional[Callable[[], Any]] = None  # Cheap summary of the source that changes whenever its tasks may have
+    backfill_ids: Optional[Callable[[], Dict[Tuple[Optional[str], str], str]]] = None  # Writes stable ids for tasks without one, returns {(path, old id): new id}
@@ -0,0 +1,124 @@
+import logging
+import os
+import pickle
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from . import cache, fsutil
+
+logger = logging.getLogger(__name__)
+
+# Bump when the format of the cached values changes
+CACHE_VERSION = 3
+
+# Entries kept on disk; the least recently used ones are evicted beyond this
+MAX_ENTRIES = 100_000
+
+# How stale the last use of an entry may get before a hit marks the cache for saving,
+# so that runs served entirely from the cache don't all rewrite it
+TOUCH_INTERVAL = 60 * 60
+
+FileKey = Tuple[int, int, int]  # (size, mtime_ns, inode)
+
+
+def file_key(st: os.stat_result) -> FileKey:
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+class ParseCache:
+    '''
+    On-disk cache of parsed markdown files, keyed by absolute path.
+    An entry is only returned while the file's size, mtime and inode are the
+    same as when it was parsed. Safe to share between threads.
+    '''
+
+    def __init__(self, path: str, max_entries: int = MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries: Dict[str, Tuple[FileKey, float, Any]] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+            if data.get("version") == CACHE_VERSION:
+                self._entries = data["entries"]
+        except Exception:
+            # A missing or unreadable cache is simply rebuilt
+            self._entries = {}
+
+    def get(self, path: str, st: os.stat_result) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[0] != file_key(st):
+                return None
+            now = time.time()
+            if now - entry[1] >= TOUCH_INTERVAL:
+                self._entries[path] = (entry[0], now, entry[2])
+                self._dirty = True
+            return entry[2]
+
+    def put(self, path: str, st: os.stat_result, value: Any) -> None:
+        with self._lock:
+            self._entries[path] = (file_key(st), time.time(), value)
+            self._dirty = True
+
+    def discard(self, path: str) -> None:
+        with self._lock:
+            if self._entries.pop(path, None) is not None:
+                self._dirty = True
+
+    def prune(self, directory: str, seen: Iterable[str], recursive: bool = True) -> None:
+        '''
+        Drop the entries for files under directory that are not in seen,
+        i.e. files that have been deleted since they were cached.
+        Without recursive, only files directly in directory are considered.
+        '''
+        prefix = os.path.join(directory, "")
+        seen = set(seen)
+
+        def scanned(path: str) -> bool:
+            return path.startswith(prefix) and (recursive or os.sep not in path[len(prefix):])
+
+        with self._lock:
+            stale = [path for path in self._entries if scanned(path) and path not in seen]
+            for path in stale:
+                del self._entries[path]
+            self._dirty = self._dirty or bool(stale)
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+
+            # Evict the least recently used entries
+            if len(self._entries) > self.max_entries:
+                by_age = sorted(self._entries.items(), key=lambda item: item[1][1], reverse=True)
+                self._entries = dict(by_age[:self.max_entries])
+
+            data = pickle.dumps({"version": CACHE_VERSION, "entries": self._entries}, protocol=pickle.HIGHEST_PROTOCOL)
+            self._dirty = False
+
+        try:
+            fsutil.atomic_write(self.path, data)
+        except OSError as e:
+            logger.warning("Could not save parse cache %s: %s", self.path, e)
+
+
+_cache: Optional[ParseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ParseCache:
+    '''
+    Returns the process wide parse cache, loading it on first use
+    '''
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ParseCache(cache.cache_dir("markdown.pickle"))
+        return _cache
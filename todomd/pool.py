@@ -0,0 +1,88 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Set
+
+
+@dataclass
+class JobResult:
+    name: str
+    value: Any = None
+    error: Optional[BaseException] = None
+    timed_out: bool = False
+    elapsed: float = 0.0
+
+
+def run_bounded(jobs: Dict[str, Callable[[], Any]], workers: int, timeouts: Dict[str, Optional[float]],
+                on_result: Optional[Callable[[JobResult], None]] = None) -> List[JobResult]:
+    '''
+    Run the given jobs with at most `workers` of them running at the same time.
+    Each job's timeout is counted from the moment it starts running. A job that
+    exceeds its timeout is abandoned and its slot is handed to the next job, so a
+    stalled job can never hold up the others.
+    If given, on_result is called with each job's result as soon as the job
+    finishes or is abandoned.
+    Returns one JobResult per job, in the same order as `jobs`.
+    '''
+    results = {name: JobResult(name) for name in jobs}
+    slots = threading.Semaphore(max(1, workers))
+    cond = threading.Condition()
+    started: Dict[str, float] = {}
+    finished: Set[str] = set()
+    abandoned: Set[str] = set()
+
+    def run(name: str, fn: Callable[[], Any]) -> None:
+        slots.acquire()
+        with cond:
+            started[name] = time.monotonic()
+            cond.notify_all()
+
+        value, error = None, None
+        try:
+            value = fn()
+        except BaseException as e:
+            error = e
+
+        with cond:
+            # An abandoned job already gave its slot away when it timed out
+            if name not in abandoned:
+                result = results[name]
+                result.value = value
+                result.error = error
+                result.elapsed = time.monotonic() - started[name]
+                finished.add(name)
+                slots.release()
+                if on_result:
+                    on_result(result)
+            cond.notify_all()
+
+    # Daemon threads, so an abandoned job can't keep the process alive on exit
+    for name, fn in jobs.items():
+        threading.Thread(target=run, args=(name, fn), name=f"todomd-{name}", daemon=True).start()
+
+    with cond:
+        while len(finished) + len(abandoned) < len(jobs):
+            now = time.monotonic()
+            next_deadline = None
+
+            for name, start in started.items():
+                timeout = timeouts.get(name)
+                if name in finished or name in abandoned or timeout is None:
+                    continue
+
+                deadline = start + timeout
+                if deadline <= now:
+                    abandoned.add(name)
+                    results[name].timed_out = True
+                    results[name].elapsed = now - start
+                    slots.release()
+                    if on_result:
+                        on_result(results[name])
+                elif next_deadline is None or deadline < next_deadline:
+                    next_deadline = deadline
+
+            if len(finished) + len(abandoned) >= len(jobs):
+                break
+            cond.wait(None if next_deadline is None else next_deadline - now)
+
+    return [results[name] for name in jobs]
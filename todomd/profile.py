@@ -0,0 +1,70 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+# Phases recorded in this run, or None when profiling is off
+_phases: Optional[List[Dict[str, Any]]] = None
+_lock = threading.Lock()
+
+
+def enable() -> None:
+    '''
+    Start recording phases. Until this is called, phase() and record() do nothing.
+    '''
+    global _phases
+    _phases = []
+
+
+def enabled() -> bool:
+    return _phases is not None
+
+
+def record(name: str, seconds: float, tasks: Optional[int] = None, bytes: Optional[int] = None) -> None:
+    '''
+    Record a phase that was timed elsewhere
+    '''
+    if _phases is None:
+        return
+    entry: Dict[str, Any] = {"phase": name, "seconds": round(seconds, 6)}
+    if tasks is not None:
+        entry["tasks"] = tasks
+    if bytes is not None:
+        entry["bytes"] = bytes
+    with _lock:
+        _phases.append(entry)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[Dict[str, Any]]:
+    '''
+    Time the body of the with block as a phase. The yielded dict can be given
+    "tasks" and "bytes" counts, which are added to the report.
+    '''
+    counts: Dict[str, Any] = {}
+    start = time.perf_counter()
+    try:
+        yield counts
+    finally:
+        record(name, time.perf_counter() - start, counts.get("tasks"), counts.get("bytes"))
+
+
+def report() -> Dict[str, Any]:
+    with _lock:
+        phases = list(_phases or [])
+    return {"phases": phases}
+
+
+def write_report(destination: str) -> None:
+    '''
+    Write the report as JSON to the given file, or to stderr for "-"
+    '''
+    import sys
+
+    data = json.dumps(report(), indent=2)
+    if destination == "-":
+        print(data, file=sys.stderr)
+    else:
+        with open(destination, "w") as f:
+            f.write(data + "\n")
@@ -0,0 +1,84 @@
+'''
+Query expressions for selecting tasks without the UI.
+
+An expression is a list of conditions that must all hold, separated by spaces:
+
+    datasource=work_*  path=projects/*.md  name~"(?i)review"  status=open
+
+Each condition is a field, an operator and a value. The fields are datasource,
+path, name and status. The operators are = and != for shell style glob
+patterns, and ~ and !~ for regular expressions searched anywhere in the field.
+Values with spaces can be quoted. status is open, done or any.
+'''
+import fnmatch
+import re
+import shlex
+from typing import Callable, List, Optional
+
+from .model import Task
+
+FIELDS = ("datasource", "path", "name", "status")
+STATUSES = ("open", "done", "any")
+
+_CONDITION = re.compile(r"(datasource|path|name|status)(!=|!~|=|~)(.*)", re.DOTALL)
+
+Matcher = Callable[[Task], bool]
+
+
+def _field(field: str) -> Callable[[Task], str]:
+    if field == "datasource":
+        return lambda t: t.datasource
+    if field == "path":
+        return lambda t: t.path or ""
+    return lambda t: t.name
+
+
+def _condition(field: str, op: str, value: str) -> Matcher:
+    if field == "status":
+        if op != "=" or value not in STATUSES:
+            raise ValueError(f"status only supports =, with one of {', '.join(STATUSES)}")
+        if value == "any":
+            return lambda t: True
+        completed = value == "done"
+        return lambda t: t.completed == completed
+
+    get = _field(field)
+    if op in ("~", "!~"):
+        try:
+            pattern = re.compile(value)
+        except re.error as e:
+            raise ValueError(f"Invalid regular expression for {field}: {e}")
+        test = lambda t: pattern.search(get(t)) is not None
+    else:
+        test = lambda t: fnmatch.fnmatchcase(get(t), value)
+
+    if op.startswith("!"):
+        return lambda t: not test(t)
+    return test
+
+
+def parse(expression: str, default_status: Optional[str] = "open") -> Matcher:
+    '''
+    Parse a query expression into a function telling whether a task matches it.
+    Unless the expression has a status condition, only tasks with
+    default_status match. Raises ValueError if the expression is invalid.
+    '''
+    try:
+        words = shlex.split(expression)
+    except ValueError as e:
+        raise ValueError(f"Invalid query: {e}")
+
+    conditions: List[Matcher] = []
+    has_status = False
+    for word in words:
+        match = _CONDITION.fullmatch(word)
+        if match is None:
+            raise ValueError(f"Invalid condition '{word}', expected one of {', '.join(FIELDS)} "
+                             f"followed by =, !=, ~ or !~ and a value")
+        field, op, value = match.groups()
+        has_status = has_status or field == "status"
+        conditions.append(_condition(field, op, value))
+
+    if not has_status and default_status is not None:
+        conditions.append(_condition("status", "=", default_status))
+    return lambda t: all(condition(t) for condition in conditions)
@@ -0,0 +1,32 @@
+import threading
+import time
+
+
+class TokenBucket:
+    '''
+    Token bucket rate limiter. Tokens are added at `rate` per second, up to
+    `capacity`, and each call to acquire() takes one, sleeping until a token
+    is available. Safe to share between threads.
+    '''
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
@@ -0,0 +1,63 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+class TrigramIndex:
+    '''
+    Case insensitive substring search over a growing list of short texts.
+    Every three character sequence of a text is indexed, so a search only looks
+    at the texts containing the rarest trigram of the query. A query matches a
+    text when each of its words occurs in it. Searches that refine the previous
+    one, as happens while a query is typed, only look at the previous matches.
+    '''
+
+    def __init__(self):
+        self._texts: List[str] = []
+        self._postings: Dict[str, List[int]] = {}
+        self._last: Optional[Tuple[List[str], List[int]]] = None  # Words and matches of the last search
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def add(self, text: str) -> int:
+        '''
+        Index a text. Returns its number, which searches return when it matches.
+        '''
+        number = len(self._texts)
+        text = text.lower()
+        self._texts.append(text)
+        for trigram in {text[i:i + 3] for i in range(len(text) - 2)}:
+            postings = self._postings.get(trigram)
+            if postings is None:
+                self._postings[trigram] = [number]
+            else:
+                postings.append(number)
+        self._last = None
+        return number
+
+    def search(self, query: str) -> List[int]:
+        '''
+        Returns the numbers of the texts matching the query, in the order they were added
+        '''
+        words = query.lower().split()
+        if not words:
+            return list(range(len(self._texts)))
+
+        # Texts containing the rarest trigram of the query, if it has one
+        candidates: Sequence[int] = range(len(self._texts))
+        for word in words:
+            for i in range(len(word) - 2):
+                postings = self._postings.get(word[i:i + 3], [])
+                if len(postings) < len(candidates):
+                    candidates = postings
+
+        # Every match of a refined query is also a match of the previous one
+        if self._last is not None:
+            last_words, last_matches = self._last
+            refines = all(any(last_word in word for word in words) for last_word in last_words)
+            if refines and len(last_matches) < len(candidates):
+                candidates = last_matches
+
+        texts = self._texts
+        matches = [number for number in candidates if all(word in texts[number] for word in words)]
+        self._last = (words, matches)
+        return matches
@@ -0,0 +1,199 @@
+'''
+Three-way sync between the todo file and the datasources.
+
+The state of every task as of the last successful sync is kept as a short
+hash of its name and completion, by (datasource, path, id). Comparing both
+sides to it tells which one changed:
+
+- only the datasource changed: the todo file is updated from it
+- only the todo file changed: the datasource is updated from it, though only
+  with completion, as that is all the datasources write back
+- both changed, differently: a conflict, which is reported and left alone
+
+A task with no recorded state, such as one synced before the state was kept,
+is taken from the side the run prefers, as a sync without state would.
+'''
+import hashlib
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .model import Task
+from .task import TaskIndex, TaskKey, task_key
+from .todo_file import TodoDocument
+from . import cache
+
+logger = logging.getLogger(__name__)
+
+# Bump when the format of the state file or the hashes changes
+STATE_VERSION = 1
+
+
+def task_hash(t: Task) -> str:
+    '''
+    Short hash of the parts of a task that are synced
+    '''
+    return hashlib.blake2b(f"{int(t.completed)}\0{t.name}".encode(), digest_size=8).hexdigest()
+
+
+def _key_string(key: TaskKey) -> str:
+    ds_name, path, task_id = key
+    return f"{ds_name}\0{path or ''}\0{task_id}"
+
+
+def _state_path(todo_file_path: str) -> str:
+    return cache.cache_dir("sync", f"{cache.cache_key(os.path.abspath(todo_file_path))}.json")
+
+
+class SyncState:
+    '''
+    The hash of every task as of the last sync of a todo file
+    '''
+
+    def __init__(self, path: str, hashes: Dict[str, str]):
+        self.path = path
+        self._hashes = hashes
+        self._dirty = False
+
+    @classmethod
+    def load(cls, todo_file_path: str) -> "SyncState":
+        '''
+        Load the state of the given todo file. A missing or unreadable state is
+        empty, so every task is taken from the side the run prefers.
+        '''
+        path = _state_path(todo_file_path)
+        data = cache.load_json(path)
+        if not isinstance(data, dict) or data.get("version") != STATE_VERSION:
+            return cls(path, {})
+        return cls(path, data["tasks"])
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def get(self, key: TaskKey) -> Optional[str]:
+        return self._hashes.get(_key_string(key))
+
+    def record(self, tasks: Iterable[Task]) -> None:
+        '''
+        Record the given tasks as synced
+        '''
+        for t in tasks:
+            key, value = _key_string(task_key(t)), task_hash(t)
+            if self._hashes.get(key) != value:
+                self._hashes[key] = value
+                self._dirty = True
+
+    def remap_ids(self, ds_name: str, mapping: Dict[Tuple[Optional[str], str], str]) -> None:
+        '''
+        Move the state of the tasks of a datasource to their new ids, given as
+        {(path, old id): new id}
+        '''
+        for (path, old_id), new_id in mapping.items():
+            value = self._hashes.pop(_key_string((ds_name, path, old_id)), None)
+            if value is not None:
+                self._hashes[_key_string((ds_name, path, new_id))] = value
+                self._dirty = True
+
+    def prune(self, todo_tasks: Iterable[Task]) -> None:
+        '''
+        Forget the tasks that are no longer in the todo file
+        '''
+        keep = {_key_string(task_key(t)) for t in todo_tasks}
+        if len(keep) < len(self._hashes) or not keep.issuperset(self._hashes):
+            self._hashes = {key: value for key, value in self._hashes.items() if key in keep}
+            self._dirty = True
+
+    def save(self) -> None:
+        '''
+        Write the state back if anything changed
+        '''
+        if self._dirty:
+            cache.save_json(self.path, {"version": STATE_VERSION, "tasks": self._hashes})
+            self._dirty = False
+
+
+@dataclass
+class SyncDiff:
+    to_todo: List[Task] = field(default_factory=list)  # Datasource tasks that changed since the last sync
+    to_datasource: List[Task] = field(default_factory=list)  # Todo tasks that changed since the last sync
+    conflicts: List[Tuple[Task, Task]] = field(default_factory=list)  # (todo task, datasource task) that both changed
+    in_sync: List[Task] = field(default_factory=list)  # Tasks that are the same on both sides
+
+
+def diff(todo_index: TaskIndex, datasource_index: TaskIndex, state: SyncState, ds_name: Optional[str] = None,
+         prefer: str = "datasource") -> SyncDiff:
+    '''
+    Work out which side changed for every task in both the todo file and the
+    datasources, or only in the datasource ds_name if given. Tasks without a
+    recorded state are taken from the `prefer` side, "datasource" or "todo".
+    '''
+    if prefer not in ("datasource", "todo"):
+        raise ValueError(f"prefer must be 'datasource' or 'todo', not {prefer!r}")
+
+    if ds_name is None:
+        todo_tasks: Iterable[Task] = todo_index
+    else:
+        todo_tasks = (t for tasks in todo_index.by_path(ds_name).values() for t in tasks)
+
+    result = SyncDiff()
+    for todo_task in todo_tasks:
+        key = task_key(todo_task)
+        ds_task = datasource_index.get(key)
+        # A task listed more than once is only counted once, as its last occurrence
+        if ds_task is None or todo_index.get(key) is not todo_task:
+            continue
+
+        todo_hash, ds_hash = task_hash(todo_task), task_hash(ds_task)
+        if todo_hash == ds_hash:
+            result.in_sync.append(todo_task)
+            continue
+
+        base = state.get(key)
+        if base == todo_hash or (base is None and prefer == "datasource"):
+            result.to_todo.append(ds_task)
+        elif base == ds_hash or base is None:
+            result.to_datasource.append(todo_task)
+        else:
+            result.conflicts.append((todo_task, ds_task))
+    return result
+
+
+def completion_changes(todo_tasks: Iterable[Task], datasource_index: TaskIndex) -> List[Task]:
+    '''
+    The tasks to send to the datasources for the given changed todo tasks.
+    Datasources are only updated with completion, so tasks that only differ in
+    name are left out, and the rest keep their datasource names. Recording the
+    tasks sent as synced then matches what the datasources hold.
+    '''
+    result = []
+    for todo_task in todo_tasks:
+        ds_task = datasource_index.find(todo_task)
+        if ds_task is not None and ds_task.completed != todo_task.completed:
+            result.append(Task(id=ds_task.id, path=ds_task.path, datasource=ds_task.datasource,
+                               name=ds_task.name, completed=todo_task.completed))
+    return result
+
+
+def pull(todo_doc: TodoDocument, todo_index: TaskIndex, datasource_index: TaskIndex,
+         state: SyncState) -> Tuple[List[Task], List[Tuple[Task, Task]]]:
+    '''
+    Update the todo document from the datasource tasks that changed since the
+    last sync, leaving the tasks changed in the file alone. The state is
+    updated, but not saved. Returns the tasks updated and the conflicts.
+    '''
+    changes = diff(todo_index, datasource_index, state)
+    log_conflicts(changes.conflicts)
+    updated = todo_doc.update_tasks(changes.to_todo)
+    state.record(changes.in_sync)
+    state.record(updated)
+    return updated, changes.conflicts
+
+
+def log_conflicts(conflicts: List[Tuple[Task, Task]]) -> None:
+    for todo_task, ds_task in conflicts:
+        logger.warning("Task %s in datasource %s changed in both the todo file and the datasource, left as it is: "
+                       "'%s' (%s) in the todo file, '%s' (%s) in the datasource",
+                       todo_task.id, todo_task.datasource,
+                       todo_task.name, "done" if todo_task.completed else "open",
+                       ds_task.name, "done" if ds_task.completed else "open")
@@ -1,5 +1,11 @@
 from .model import Task
-from typing import List, Dict, Optional
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple, Union
+
+# Tasks are identified across datasources by (datasource, path, id)
+TaskKey = Tuple[str, Optional[str], str]
+
+def task_key(task: Task) -> TaskKey:
+    return (task.datasource, task.path, task.id)
 
 def group_by_datasource(tasks: List[Task]) -> Dict[str, List[Task]]:
     tasks_by_datasource = {}
@@ -29,3 +35,67 @@ def group_by_path(tasks: List[Task]) -> Dict[Optional[str], List[Task]]:
             tasks_by_path[task.path] = []
         tasks_by_path[task.path].append(task)
     return tasks_by_path
+
+
+class TaskIndex:
+    """
+    Index of a collection of tasks, built once and shared by everything that
+    looks tasks up: lookup by (datasource, path, id) and the tasks grouped by
+    datasource and path. When a key appears more than once, lookups give the
+    last task with that key, while the groups keep every task in order.
+    """
+
+    def __init__(self, tasks: Iterable[Task]):
+        self.tasks: List[Task] = list(tasks)
+        self._by_key: Dict[TaskKey, Task] = {}
+        self._groups: Dict[str, Dict[Optional[str], List[Task]]] = {}
+        for task in self.tasks:
+            self._by_key[(task.datasource, task.path, task.id)] = task
+            paths = self._groups.get(task.datasource)
+            if paths is None:
+                paths = self._groups[task.datasource] = {}
+            tasks_in_path = paths.get(task.path)
+            if tasks_in_path is None:
+                paths[task.path] = [task]
+            else:
+                tasks_in_path.append(task)
+
+    @classmethod
+    def of(cls, tasks: Union["TaskIndex", Iterable[Task]]) -> "TaskIndex":
+        """
+        Returns tasks if it is already an index, otherwise indexes them
+        """
+        return tasks if isinstance(tasks, TaskIndex) else cls(tasks)
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+    def __iter__(self) -> Iterator[Task]:
+        return iter(self.tasks)
+
+    def __contains__(self, key: TaskKey) -> bool:
+        return key in self._by_key
+
+    def get(self, key: TaskKey) -> Optional[Task]:
+        return self._by_key.get(key)
+
+    def find(self, task: Task) -> Optional[Task]:
+        """
+        Returns the task in the index with the same key as the given task
+        """
+        return self._by_key.get((task.datasource, task.path, task.id))
+
+    def datasources(self) -> List[str]:
+        return list(self._groups)
+
+    def by_path(self, datasource: str) -> Dict[Optional[str], List[Task]]:
+        """
+        The tasks of a datasource grouped by path
+        """
+        return self._groups.get(datasource, {})
+
+    def grouped(self) -> Dict[str, Dict[Optional[str], List[Task]]]:
+        """
+        The tasks grouped by datasource, then by path
+        """
+        return self._groups
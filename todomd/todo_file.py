@@ -1,31 +1,33 @@
 
+import bisect
+import datetime
+import itertools
+import logging
 import os
-import re
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 from .model import Task
+from .task import TaskIndex, TaskKey, task_key
+from . import fsutil, parse_cache, tokenizer
+
+logger = logging.getLogger(__name__)
+
 
 def _parse_task_line(line: str) -> Optional[Tuple[str, Optional[str], str, bool, str]]:
     """
     Parse a markdown task line into its components
-    Returns (task_id, task_name, completed, datasource) or None if not a valid task line
+    Returns (task_id, task_path, task_name, completed, datasource) or None if not a valid task line
     """
-    # Match checkbox markdown format with datasource tag
-    # Format: * [ ] Task name @datasource:taskpath
-    pattern = r"^\*\s+\[([ xX])\]\s+(.+?)\s+@([a-zA-Z0-9_-]+):(.*):(.+)$"
-    match = re.match(pattern, line.strip())
-    
-    if not match:
+    # Format: * [ ] Task name @datasource:taskpath:taskid
+    parsed = tokenizer.parse_todo_line(line)
+    if not parsed:
         return None
     
-    checkbox, task_name, datasource, task_path, task_id = match.groups()
-    completed = checkbox.lower() == "x"
-    task_path = task_path if task_path != "" else None
-    
+    task_name, completed, datasource, task_path, task_id = parsed
     return task_id, task_path, task_name, completed, datasource
 
 
-def _format_task_line(task: Task) -> str:
+def format_task_line(task: Task) -> str:
     """
     Format a task as a markdown line
     """
@@ -34,76 +36,282 @@ def _format_task_line(task: Task) -> str:
     return f"* [{checkbox}] {task.name} @{task.datasource}:{path}:{task.id}"
 
 
-def update_tasks(todo_file_path: str, todo_tasks: List[Task], datasource_tasks: List[Task]) -> None:
+class TodoDocument:
     '''
-    Update the tasks in the todo file with the latest data from the datasources.
-    Uses todo_tasks as the tasks already present in the file.
-    Updates completion status of todo_tasks to match datasource_tasks.
+    In-memory copy of a todo file. The file is read and parsed once, updates and
+    new tasks are applied in memory, and commit() writes the result back in a
+    single atomic write. The file isn't locked while it is being worked on, so
+    commit() checks that it is unchanged, and if another process changed it
+    meanwhile, applies the updates and new tasks again to what is on disk.
     '''
-    # Create expanded file path
-    file_path = os.path.expanduser(todo_file_path)
-    
-    # If the file doesn't exist or there are no todo tasks, nothing to update
-    if not os.path.exists(file_path) or not todo_tasks:
-        return
-    
-    # Create a mapping for quick lookup of datasource tasks by datasource and ID
-    datasource_task_map = {(task.datasource, task.path, task.id): task for task in datasource_tasks}
-    
-    # Track which todo tasks were updated
-    updated_tasks = []
-    
-    # Update todo tasks with status from datasource tasks
-    for todo_task in todo_tasks:
-        task_key = (todo_task.datasource, todo_task.path, todo_task.id)
-        
-        # If this task exists in datasource tasks, update its status
-        if task_key in datasource_task_map:
-            datasource_task = datasource_task_map[task_key]
-            
+
+    def __init__(self, file_path: str, lines: List[bytes], tasks: List[Task], task_lines: List[int],
+                 key: Optional[parse_cache.FileKey] = None):
+        self.file_path = file_path
+        self.lines = lines
+        self.tasks = tasks
+        self.dirty = False
+        self.size = sum(len(line) for line in lines)  # Bytes read from the file
+        self.key = key  # Size, mtime and inode of the file when it was read, None if it didn't exist
+
+        # Changes made since the file was read, to apply again if it changes on disk
+        self._updated: Dict[TaskKey, Task] = {}
+        self._added: List[Task] = []
+        self._remapped: List[Tuple[str, Dict[Tuple[Optional[str], str], str]]] = []
+        self._removed: Dict[TaskKey, List[bytes]] = {}
+        self._removed_lines: List[bytes] = []
+
+        # Line numbers of every task, by (datasource, path, id)
+        self.line_index: Dict[TaskKey, List[int]] = {}
+        for task, line_no in zip(tasks, task_lines):
+            self.line_index.setdefault(task_key(task), []).append(line_no)
+
+    @classmethod
+    def load(cls, todo_file_path: str) -> "TodoDocument":
+        '''
+        Read and parse the todo file. A missing file gives an empty document.
+        '''
+        # Create expanded file path
+        file_path = os.path.expanduser(todo_file_path)
+        tasks = []
+        task_lines = []
+
+        # If file doesn't exist, start empty
+        if not os.path.exists(file_path):
+            return cls(file_path, [], tasks, task_lines)
+
+        logger.info("Reading tasks from: %s", file_path)
+        with open(file_path, "rb") as f:
+            key = parse_cache.file_key(os.fstat(f.fileno()))
+            data = f.read()
+        lines = data.splitlines(keepends=True)
+        line_starts = list(itertools.accumulate((len(line) for line in lines), initial=0))
+
+        # Parse tasks
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for offset, task_name, completed, datasource, task_path, task_id in tokenizer.iter_todo_tokens(data):
+            task = Task(
+                id=task_id,
+                path=task_path,
+                name=task_name,
+                completed=completed,
+                datasource=datasource
+            )
+            tasks.append(task)
+            task_lines.append(bisect.bisect_right(line_starts, offset) - 1)
+            if debug:
+                logger.debug("Parsed task: %s, Name: %s, Completed: %s, Datasource: %s", task_id, task_name, completed, datasource)
+
+        return cls(file_path, lines, tasks, task_lines, key)
+
+    def _set_line(self, line_no: int, task: Task) -> None:
+        ending = b"\r\n" if self.lines[line_no].endswith(b"\r\n") else b"\n"
+        self.lines[line_no] = format_task_line(task).encode() + ending
+        self.dirty = True
+
+    def update_tasks(self, datasource_tasks: Union[TaskIndex, List[Task]]) -> List[Task]:
+        '''
+        Update the completion status and name of the tasks in the document to
+        match datasource_tasks. Returns the tasks that changed.
+        '''
+        datasource_index = TaskIndex.of(datasource_tasks)
+        updated_tasks = []
+
+        for todo_task in self.tasks:
+            datasource_task = datasource_index.find(todo_task)
+            if datasource_task is None:
+                continue
+            if (todo_task.completed, todo_task.name) == (datasource_task.completed, datasource_task.name):
+                continue
+
             # Update the todo task with datasource values
-            print(f"Updating task: {todo_task.id} from datasource. Old completed: {todo_task.completed}, New completed: {datasource_task.completed}")
+            logger.debug("Updating task: %s from datasource. Old completed: %s, New completed: %s",
+                         todo_task.id, todo_task.completed, datasource_task.completed)
             todo_task.completed = datasource_task.completed
             todo_task.name = datasource_task.name  # Also update name if changed
-            
-            # Add to list of updated tasks
             updated_tasks.append(todo_task)
-    
-    # If no tasks were updated, no need to rewrite file
-    if not updated_tasks:
-        return
-    
-    # Read the file content
-    with open(file_path, 'r') as f:
-        lines = f.readlines()
-    
-    # Create a map for quick lookup of updated tasks
-    updated_task_map = {(task.datasource, task.path, task.id): task for task in updated_tasks}
-    
-    # Process each line, replacing tasks that were updated
-    updated_lines = []
-    for line in lines:
-        parsed = _parse_task_line(line.strip())
-        
-        # If not a task line, keep as is
-        if not parsed:
-            updated_lines.append(line)
-            continue
-        
-        task_id, task_path, _, _, datasource = parsed
-        task_key = (datasource, task_path, task_id)
-        
-        # If this line corresponds to an updated task, replace it
-        if task_key in updated_task_map:
-            updated_task = updated_task_map[task_key]
-            updated_lines.append(_format_task_line(updated_task) + '\n')
-        else:
-            # Keep original line if no match in updated tasks
-            updated_lines.append(line)
-    
-    # Write updated content back to file
-    with open(file_path, 'w') as f:
-        f.writelines(updated_lines)
+
+        # Rewrite the lines of the updated tasks
+        for todo_task in updated_tasks:
+            key = task_key(todo_task)
+            self._updated[key] = todo_task
+            for line_no in self.line_index[key]:
+                self._set_line(line_no, todo_task)
+
+        return updated_tasks
+
+    def add_tasks(self, tasks: List[Task]) -> List[Task]:
+        '''
+        Append the given tasks that aren't already in the document.
+        Returns the tasks that were added.
+        '''
+        # Add header if file is new
+        if not self.lines:
+            self.lines.append(b"# Tasks\n")
+            self.lines.append(b"\n")
+            self.dirty = True
+
+        added_tasks = []
+        for task in tasks:
+            key = task_key(task)
+            if key in self.line_index:
+                continue
+
+            # Make sure the last line is terminated before appending to it
+            if not self.lines[-1].endswith(b"\n"):
+                self.lines[-1] += b"\n"
+
+            self.line_index[key] = [len(self.lines)]
+            self.lines.append(format_task_line(task).encode() + b"\n")
+            self.tasks.append(task)
+            self._added.append(task)
+            added_tasks.append(task)
+            self.dirty = True
+
+        return added_tasks
+
+    def remap_ids(self, datasource: str, mapping: Dict[Tuple[Optional[str], str], str]) -> List[Task]:
+        '''
+        Change the ids of the tasks of a datasource, given as {(path, old id): new id},
+        such as after the datasource wrote new ids. Returns the tasks that changed.
+        '''
+        remapped = []
+        for task in self.tasks:
+            if task.datasource != datasource:
+                continue
+            new_id = mapping.get((task.path, task.id))
+            if new_id is None or new_id == task.id:
+                continue
+            line_nos = self.line_index.pop(task_key(task), [])
+            task.id = new_id
+            self.line_index.setdefault(task_key(task), []).extend(line_nos)
+            remapped.append(task)
+
+        # Rewrite the lines of the remapped tasks
+        for task in remapped:
+            for line_no in self.line_index[task_key(task)]:
+                self._set_line(line_no, task)
+        if remapped:
+            self._remapped.append((datasource, mapping))
+        return remapped
+
+    def remove_tasks(self, tasks: List[Task]) -> List[bytes]:
+        '''
+        Remove every line of the given tasks from the document.
+        Returns the removed lines, in the order they were in.
+        '''
+        keys = {task_key(task) for task in tasks}
+        removed_line_nos = sorted(line_no for key in keys for line_no in self.line_index.get(key, []))
+        if not removed_line_nos:
+            return []
+
+        removed = [self.lines[line_no] for line_no in removed_line_nos]
+        for key in keys:
+            if key in self.line_index:
+                self._removed[key] = [self.lines[line_no] for line_no in self.line_index[key]]
+
+        # Drop the lines and move the remaining tasks up by the lines removed above them
+        skip = set(removed_line_nos)
+        self.lines = [line for line_no, line in enumerate(self.lines) if line_no not in skip]
+        self.tasks = [task for task in self.tasks if task_key(task) not in keys]
+        self.line_index = {
+            key: [line_no - bisect.bisect_left(removed_line_nos, line_no) for line_no in line_nos]
+            for key, line_nos in self.line_index.items() if key not in keys
+        }
+        self._removed_lines.extend(removed)
+        self.dirty = True
+        return removed
+
+    def _current_key(self) -> Optional[parse_cache.FileKey]:
+        try:
+            return parse_cache.file_key(os.stat(self.file_path))
+        except FileNotFoundError:
+            return None
+
+    def _rebase(self) -> None:
+        '''
+        Read the file again and apply the changes made since it was last read
+        '''
+        fresh = TodoDocument.load(self.file_path)
+        logger.info("%s changed since it was read, applying %d updates and %d new tasks to the new version",
+                    self.file_path, len(self._updated), len(self._added))
+        for datasource, mapping in self._remapped:
+            fresh.remap_ids(datasource, mapping)
+        fresh.update_tasks(list(self._updated.values()))
+        if self._added:
+            fresh.add_tasks(self._added)
+        # Lines are only removed if no one changed them in the meantime
+        self._removed_lines = fresh.remove_tasks([task for task in fresh.tasks
+                                                  if [fresh.lines[line_no] for line_no in fresh.line_index[task_key(task)]]
+                                                  == self._removed.get(task_key(task))])
+        self.lines, self.tasks, self.line_index, self.key = fresh.lines, fresh.tasks, fresh.line_index, fresh.key
+
+    def commit(self, on_removed: Optional[Callable[[List[bytes]], None]] = None) -> bool:
+        '''
+        Write the document back to the file if anything changed, replacing the file
+        atomically. Other todomd processes are kept from writing the file at the
+        same time, and changes they made since it was read are kept.
+        If given, on_removed is called with the lines removed from the file, as
+        they are once those changes are applied, before the file is written; if it
+        raises, the file is left as it is.
+        Returns True if the file was written.
+        '''
+        if not self.dirty:
+            return False
+        with fsutil.locked(self.file_path):
+            if self._current_key() != self.key:
+                self._rebase()
+            if on_removed is not None and self._removed_lines:
+                on_removed(self._removed_lines)
+            data = b"".join(self.lines)
+            fsutil.atomic_write(self.file_path, data)
+            self.key = self._current_key()
+        self.size = len(data)
+        self.dirty = False
+        self._updated.clear()
+        self._added.clear()
+        self._remapped.clear()
+        self._removed.clear()
+        self._removed_lines = []
+        return True
+
+
+def archive_path(todo_file_path: str, when: datetime.date) -> str:
+    '''
+    The archive file for the tasks archived in the month of the given date,
+    next to the todo file: tasks.md is archived to tasks.archive-2024-05.md
+    '''
+    root, ext = os.path.splitext(os.path.expanduser(todo_file_path))
+    return f"{root}.archive-{when:%Y-%m}{ext or '.md'}"
+
+
+def append_archive(todo_file_path: str, lines: List[bytes], when: Optional[datetime.date] = None) -> str:
+    '''
+    Append task lines to the archive of the month, creating it with a header if
+    needed, and make sure they are on disk. Returns the path of the archive.
+    '''
+    when = when or datetime.date.today()
+    path = archive_path(todo_file_path, when)
+    with fsutil.locked(path):
+        new = not os.path.exists(path)
+        with open(path, "ab") as f:
+            if new:
+                f.write(f"# Archived {when:%Y-%m}\n\n".encode())
+            f.write(b"".join(line if line.endswith(b"\n") else line + b"\n" for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+    return path
+
+
+def update_tasks(todo_file_path: str, datasource_tasks: List[Task]) -> None:
+    '''
+    Update the tasks in the todo file with the latest data from the datasources.
+    Updates completion status and names of the tasks in the file to match datasource_tasks.
+    Prefer TodoDocument when the file is also read or added to in the same run.
+    '''
+    doc = TodoDocument.load(todo_file_path)
+    doc.update_tasks(datasource_tasks)
+    doc.commit()
 
 
 def add_tasks(todo_file_path: str, tasks: List[Task]) -> None:
@@ -112,32 +320,9 @@ def add_tasks(todo_file_path: str, tasks: List[Task]) -> None:
     If the file exists, appends tasks that aren't already in the file.
     If the file doesn't exist, creates it with the given tasks.
     '''
-    # Create expanded file path
-    file_path = os.path.expanduser(todo_file_path)
-    
-    # Create a set of existing task IDs to avoid duplicates
-    existing_tasks = set()
-    
-    # If file exists, read existing tasks
-    if os.path.exists(file_path):
-        with open(file_path, "r") as f:
-            for line in f:
-                parsed = _parse_task_line(line.strip())
-                if parsed:
-                    task_id, task_path, _, _, datasource = parsed
-                    existing_tasks.add((datasource, task_path, task_id))
-    
-    # Open file in append mode (creates if not exists)
-    with open(file_path, "a") as f:
-        # Add header if file is new
-        if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
-            f.write("# Tasks\n\n")
-        
-        # Add tasks that don't already exist in the file
-        for task in tasks:
-            task_key = (task.datasource, task.path, task.id)
-            if task_key not in existing_tasks:
-                f.write(_format_task_line(task) + "\n")
+    doc = TodoDocument.load(todo_file_path)
+    doc.add_tasks(tasks)
+    doc.commit()
 
 
 def read_tasks(todo_file_path: str) -> List[Task]:
@@ -145,29 +330,4 @@ def read_tasks(todo_file_path: str) -> List[Task]:
     Read the todo tasks from the given file path.
     Returns a list of Task objects parsed from the markdown file.
     '''
-    # Create expanded file path
-    file_path = os.path.expanduser(todo_file_path)
-    tasks = []
-    
-    # If file doesn't exist, return empty list
-    if not os.path.exists(file_path):
-        return tasks
-   
-    print(f"Reading tasks from: {file_path}")
-    # Read file and parse tasks
-    with open(file_path, "r") as f:
-        for line in f:
-            parsed = _parse_task_line(line.strip())
-            if parsed:
-                task_id, task_path, task_name, completed, datasource = parsed
-                task = Task(
-                    id=task_id,
-                    path=task_path,
-                    name=task_name,
-                    completed=completed,
-                    datasource=datasource
-                )
-                tasks.append(task)
-                print(f"Parsed task: {task_id}, Name: {task_name}, Completed: {completed}, Datasource: {datasource}")
-    
-    return tasks
+    return TodoDocument.load(todo_file_path).tasks
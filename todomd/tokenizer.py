@@ -0,0 +1,148 @@
+'''
+Task line tokenizer shared by the todo file and the markdown datasources.
+
+Two kinds of task lines are recognised:
+
+    * [ ] Task name @tid:taskid              (markdown datasources, the id is optional)
+    * [ ] Task name @datasource:path:taskid  (the todo file)
+
+Whole files are matched as bytes, so offsets into the buffer are file offsets,
+and only the matched groups are decoded.
+'''
+import mmap
+import re
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple, Union
+
+# Files at least this big are memory mapped instead of read
+MMAP_THRESHOLD = 1 << 20
+
+Buffer = Union[bytes, mmap.mmap]
+
+# Leading and trailing blanks are allowed, like the stripped lines of the line parsers.
+# Task lines are found by searching for a newline followed by a checkbox, which
+# the regex engine does with a fast literal scan, so prose lines cost next to
+# nothing. The first line has no newline before it and gets its own pattern.
+# The rest of the line is split into name and tags in Python, which is much
+# cheaper than a lazy name group that retries the tag pattern at every character.
+_TASK_BODY = rb"[ \t]*\*[ \t]+\[([ xX])\][ \t]+([^ \t\r\n][^\n]*)"
+_TASK_BYTES = re.compile(rb"\n" + _TASK_BODY)
+_FIRST_TASK_BYTES = re.compile(_TASK_BODY)
+_BLANKS = b" \t\r"
+_TODO_TAG = re.compile(r"[ \t]+@([a-zA-Z0-9_-]+):")
+
+# Patterns for single lines that have already been stripped
+_SOURCE_LINE = re.compile(r"\*\s+\[([ xX])\]\s+(.+?)(?:\s+@tid:([a-zA-Z0-9]+))?$")
+_TODO_LINE = re.compile(r"\*\s+\[([ xX])\]\s+(.+?)\s+@([a-zA-Z0-9_-]+):(.*):(.+)$")
+
+# A source task: (checkbox offset, task name, completed, task id or None)
+SourceToken = Tuple[int, str, bool, Optional[str]]
+
+# A todo task: (checkbox offset, task name, completed, datasource, task path or None, task id)
+TodoToken = Tuple[int, str, bool, str, Optional[str], str]
+
+
+def _task_lines(buffer: Buffer) -> Iterator[re.Match]:
+    '''
+    Yield a match for every line that starts with a checkbox
+    '''
+    first = _FIRST_TASK_BYTES.match(buffer)
+    if first:
+        yield first
+    yield from _TASK_BYTES.finditer(buffer)
+
+
+def _split_source(rest: bytes) -> Tuple[bytes, Optional[bytes]]:
+    '''
+    Split the text after the checkbox into the task name and the @tid: tag, if any
+    '''
+    tag = rest.rfind(b"@tid:")
+    if tag > 0 and rest[tag - 1] in b" \t" and rest[tag + 5:].isalnum():
+        return rest[:tag].rstrip(_BLANKS), rest[tag + 5:]
+    return rest, None
+
+
+def _split_todo(rest: str) -> Optional[Tuple[str, str, str, str]]:
+    '''
+    Split the text after the checkbox into name, datasource, path and id.
+    The name ends at the first @datasource: tag and the id is everything after
+    the last colon. Later tags can't do better than the first, since anything
+    after them is also after it.
+    '''
+    tag = _TODO_TAG.search(rest)
+    if tag is None:
+        return None
+    colon = rest.rfind(":", tag.end(), len(rest) - 1)
+    if colon == -1:
+        return None
+    return rest[:tag.start()], tag.group(1), rest[tag.end():colon], rest[colon + 1:]
+
+
+def iter_source_tokens(buffer: Buffer) -> Iterator[SourceToken]:
+    '''
+    Yield every markdown datasource task line in the buffer
+    '''
+    for match in _task_lines(buffer):
+        checkbox, rest = match.groups()
+        name, task_id = _split_source(rest.rstrip(_BLANKS))
+        yield (match.start(1), name.decode(), checkbox != b" ",
+               task_id.decode() if task_id else None)
+
+
+def iter_todo_tokens(buffer: Buffer) -> Iterator[TodoToken]:
+    '''
+    Yield every todo file task line in the buffer
+    '''
+    for match in _task_lines(buffer):
+        checkbox, rest = match.groups()
+        parts = _split_todo(rest.rstrip(_BLANKS).decode())
+        if parts is None:
+            continue
+        name, datasource, path, task_id = parts
+        yield match.start(1), name, checkbox != b" ", datasource, path or None, task_id
+
+
+def parse_source_line(line: str) -> Optional[Tuple[str, bool, Optional[str]]]:
+    '''
+    Parse a single markdown datasource task line.
+    Returns (task_name, completed, task_id or None) or None if it isn't a task line.
+    '''
+    line = line.strip()
+    if line[:1] != "*":
+        return None
+    match = _SOURCE_LINE.match(line)
+    if not match:
+        return None
+    checkbox, name, task_id = match.groups()
+    return name, checkbox != " ", task_id
+
+
+def parse_todo_line(line: str) -> Optional[Tuple[str, bool, str, Optional[str], str]]:
+    '''
+    Parse a single todo file task line.
+    Returns (task_name, completed, datasource, task_path or None, task_id) or None
+    if it isn't a task line.
+    '''
+    line = line.strip()
+    if line[:1] != "*":
+        return None
+    match = _TODO_LINE.match(line)
+    if not match:
+        return None
+    checkbox, name, datasource, path, task_id = match.groups()
+    return name, checkbox != " ", datasource, path or None, task_id
+
+
+@contextmanager
+def open_buffer(file_path: str) -> Iterator[Buffer]:
+    '''
+    Open a file as a read only buffer, memory mapping it when it is large
+    '''
+    with open(file_path, "rb") as f:
+        size = f.seek(0, 2)
+        f.seek(0)
+        if size < MMAP_THRESHOLD:
+            yield f.read()
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield buffer
@@ -1,47 +1,238 @@
+import bisect
 import curses
 import curses.panel
 import os.path
-from typing import Dict, List, Set, Tuple, Optional
+from typing import Callable, Dict, List, Set, Tuple, Optional, Union
 
 from .model import Task
-from . import task
+from .datasource import TaskStream
+from . import search, task
 
-def select_tasks(todo_tasks: List[Task], datasource_tasks: List[Task]) -> List[Task]:
+def select_tasks(todo_tasks: Union[task.TaskIndex, List[Task]],
+                 datasource_tasks: Union[task.TaskIndex, List[Task], TaskStream]) -> List[Task]:
     '''
     Ask the user to select tasks from the datasources to add to the todo file.
     Will not show tasks that are already in the todo file.
+    When given a TaskStream, the UI opens straight away and tasks are added to
+    it as they arrive, with the loading state of each datasource in the header.
     Returns a list of selected tasks.
     '''
-    # Create a set of (datasource, task_id) for quick checking of duplicates
-    existing_tasks = {(task.datasource, task.path, task.id) for task in todo_tasks}
-    
-    # Filter out tasks that are already in the todo file
-    new_tasks = [task for task in datasource_tasks 
-                 if (task.datasource, task.path, task.id) not in existing_tasks]
+    todo_index = task.TaskIndex.of(todo_tasks)
+
+    # Filter out tasks that are already in the todo file, and tasks that are completed
+    def is_new(t: Task) -> bool:
+        return not t.completed and todo_index.find(t) is None
 
-    # Filter out tasks that are completed
-    new_tasks = [task for task in new_tasks if not task.completed]
+    stream = datasource_tasks if isinstance(datasource_tasks, TaskStream) else None
+    new_tasks = [] if stream else [t for t in datasource_tasks if is_new(t)]
     
     # If no new tasks, return empty list
-    if not new_tasks:
+    if not new_tasks and not stream:
         return []
 
-    # Group tasks by datasource and path for hierarchical display
-    tasks_by_datasource = task.group_by_datasource(new_tasks)
-    tasks_by_datasource_and_path = {ds: task.group_by_path(items) for ds, items in tasks_by_datasource.items()}
-   
     # Initialize selected tasks
     selected_tasks: List[Task] = []
 
     # Start curses interface
-    curses.wrapper(lambda stdscr: _curses_ui(stdscr, tasks_by_datasource_and_path, selected_tasks))
+    curses.wrapper(lambda stdscr: _curses_ui(stdscr, new_tasks, stream, is_new, selected_tasks))
     
     return selected_tasks
 
 
-def _curses_ui(stdscr, tasks_by_datasource_and_path: Dict[str, Dict[Optional[str], List[Task]]], selected_tasks: List[Task]):
+def _loading_status(stream: TaskStream) -> str:
+    '''
+    One line summary of how far each datasource has got
+    '''
+    parts = []
+    for status in stream.status.values():
+        if status.timed_out:
+            state = "timed out"
+        elif status.error is not None:
+            state = "failed"
+        elif status.done:
+            state = f"{status.tasks}"
+        else:
+            state = f"{status.tasks} loading..."
+        parts.append(f"{status.name}: {state}")
+    return "  ".join(parts)
+
+
+class _TaskList:
+    '''
+    The tasks shown in the UI, grouped by datasource and then path, and addressed
+    by their position in that order without building a flat list. Selections
+    are kept by task key and counted as they change. A filter narrows the list
+    to the tasks whose name, datasource or path match it.
+    '''
+
+    def __init__(self, datasources: List[str]):
+        # Datasources that are still loading keep their configured order
+        self._groups: Dict[str, Dict[Optional[str], List[Task]]] = {name: {} for name in datasources}
+        self._tasks: List[Task] = []  # Every task, numbered as in the search index
+        self._index = search.TrigramIndex()
+        self._segments: List[List[Task]] = []  # The task lists of the groups, in display order
+        self._starts: List[int] = []  # Position of the first task of each segment
+        self._length = 0
+        self.query = ""
+        self.selected: Set[task.TaskKey] = set()
+
+    def add(self, tasks: List[Task]) -> None:
+        for t in tasks:
+            self._groups.setdefault(t.datasource, {}).setdefault(t.path, []).append(t)
+            self._tasks.append(t)
+            self._index.add(f"{t.name} {t.datasource} {t.path or ''}")
+        self._update()
+
+    def set_filter(self, query: str) -> None:
+        self.query = query
+        self._update()
+
+    def _update(self) -> None:
+        '''
+        Work out the segments to show, and where each of them starts
+        '''
+        if not self.query.strip():
+            self._segments = [items for paths in self._groups.values() for items in paths.values() if items]
+        else:
+            # Matches come in the order the tasks were added, which is their order within a group
+            matches: Dict[Tuple[str, Optional[str]], List[Task]] = {}
+            for number in self._index.search(self.query):
+                t = self._tasks[number]
+                matches.setdefault((t.datasource, t.path), []).append(t)
+            self._segments = [matches[(ds, path)] for ds, paths in self._groups.items() for path in paths
+                              if (ds, path) in matches]
+
+        self._starts = []
+        self._length = 0
+        for items in self._segments:
+            self._starts.append(self._length)
+            self._length += len(items)
+
+    @property
+    def total(self) -> int:
+        return len(self._tasks)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, position: int) -> Task:
+        segment = bisect.bisect_right(self._starts, position) - 1
+        return self._segments[segment][position - self._starts[segment]]
+
+    def anchor(self, position: int) -> Optional[Tuple[Tuple[str, Optional[str]], int]]:
+        '''
+        Something to find the task at the position by after the list changes:
+        its group and its place in the group
+        '''
+        if position >= self._length:
+            return None
+        segment = bisect.bisect_right(self._starts, position) - 1
+        t = self._segments[segment][position - self._starts[segment]]
+        return (t.datasource, t.path), position - self._starts[segment]
+
+    def position(self, anchor: Optional[Tuple[Tuple[str, Optional[str]], int]]) -> int:
+        '''
+        Position of the anchored task, or of the first task if it isn't shown
+        '''
+        if anchor is None:
+            return 0
+        group, offset = anchor
+        for segment, items in enumerate(self._segments):
+            if (items[0].datasource, items[0].path) == group:
+                return self._starts[segment] + min(offset, len(items) - 1)
+        return 0
+
+    def is_selected(self, t: Task) -> bool:
+        return task.task_key(t) in self.selected
+
+    def toggle(self, t: Task) -> None:
+        key = task.task_key(t)
+        if key in self.selected:
+            self.selected.remove(key)
+        else:
+            self.selected.add(key)
+
+    def selected_tasks(self) -> List[Task]:
+        '''
+        The selected tasks in display order, whether the filter shows them or not
+        '''
+        return [t for paths in self._groups.values() for items in paths.values() for t in items
+                if task.task_key(t) in self.selected]
+
+
+# A row of the task list: (indent, text, kind), where kind is "datasource",
+# "path" or the position of the task
+_Row = Tuple[int, str, Union[str, int]]
+
+
+def _layout(tasks: _TaskList, scroll_pos: int, rows: int) -> List[_Row]:
+    '''
+    The rows shown from scroll_pos on: each visible task, preceded by the
+    datasource and path headers wherever those change, as in a flat list
+    '''
+    layout: List[_Row] = []
+    current_datasource = None
+    current_path = None
+    position = scroll_pos
+    while len(layout) < rows and position < len(tasks):
+        t = tasks[position]
+        
+        # Display datasource header if different from previous
+        if current_datasource != t.datasource:
+            current_datasource = t.datasource
+            layout.append((2, f"  {current_datasource}", "datasource"))
+
+        # Display directory header if different from previous and not empty
+        if t.path is not None and current_path != t.path:
+            current_path = t.path
+            layout.append((4, f"  {t.path}", "path"))
+
+        # Determine indentation level based on structure
+        layout.append((6 if t.path is not None else 4, t.name, position))
+        position += 1
+    return layout[:rows]
+
+
+def _last_position(layout: List[_Row]) -> int:
+    '''
+    Position of the last task in the layout, -1 if it only has headers
+    '''
+    for _, _, kind in reversed(layout):
+        if isinstance(kind, int):
+            return kind
+    return -1
+
+
+class _Screen:
+    '''
+    What each row of the screen shows, so that only rows that change are written
+    '''
+
+    def __init__(self, stdscr):
+        self.stdscr = stdscr
+        self.rows: Dict[int, Tuple[int, str, int]] = {}
+
+    def reset(self) -> None:
+        self.rows.clear()
+        self.stdscr.erase()
+
+    def draw(self, y: int, x: int, text: str, attr: int = curses.A_NORMAL) -> None:
+        width = self.stdscr.getmaxyx()[1] - 1  # Avoid writing to the right edge of the screen
+        row = (x, text, attr)
+        if self.rows.get(y) == row:
+            return
+        self.rows[y] = row
+        self.stdscr.addstr(y, 0, " " * min(x, width))
+        if x < width:
+            # Ensure the line is padded to clear any previous content
+            self.stdscr.addstr(y, x, text[:width - x].ljust(width - x), attr)
+
+
+def _curses_ui(stdscr, tasks: List[Task], stream: Optional[TaskStream],
+               is_new: Callable[[Task], bool], selected_tasks: List[Task]):
     """
-    Curses UI for task selection with hierarchical organization by datasource and path
+    Curses UI for task selection with hierarchical organization by datasource and path.
+    Only the visible rows are laid out, and only the rows that changed are redrawn.
     """
     # Clear screen and hide cursor
     stdscr.clear()
@@ -58,125 +249,121 @@ def _curses_ui(stdscr, tasks_by_datasource_and_path: Dict[str, Dict[Optional[str
     curses.init_pair(4, curses.COLOR_YELLOW, curses.COLOR_BLACK)  # Datasource header
     curses.init_pair(5, curses.COLOR_CYAN, curses.COLOR_BLACK)    # Directory header
     
-    # Create a flat list of all tasks with their selection status for display
-    display_items: List[Tuple[Task, bool]] = []
-    
-    # Flatten the hierarchical structure for display
-    for _, paths in tasks_by_datasource_and_path.items():
-        for _, tasks in paths.items():
-            for task in tasks:
-                display_items.append((task, False))
+    task_list = _TaskList(list(stream.status) if stream else [])
+    task_list.add([t for t in tasks if is_new(t)])
+    screen = _Screen(stdscr)
     
     # Initialize selection variables
     current_pos = 0  # Current cursor position
     scroll_pos = 0   # Scroll position
-        
-    stdscr.clear()
+    filtering = False  # Whether keys are typed into the filter
 
     # Main loop
     while True:
-        # Clear the entire screen to prevent ghosting
-        stdscr.clear()
-        
+        # Take in the tasks that arrived since the last redraw
+        if stream is not None:
+            new_tasks = [t for t in stream.poll() if is_new(t)]
+            if new_tasks:
+                # Keep the cursor and the top of the list on the same tasks as tasks are inserted around them
+                current_anchor = task_list.anchor(current_pos)
+                scroll_anchor = task_list.anchor(scroll_pos)
+                task_list.add(new_tasks)
+                current_pos = task_list.position(current_anchor)
+                scroll_pos = task_list.position(scroll_anchor)
+
         # Get screen dimensions
         max_y, max_x = stdscr.getmaxyx()
+        list_rows = max(1, max_y - 4)  # Rows between the header and the footer
         
-        # Calculate visible range based on screen size
-        visible_items = max_y - 6  # Reserve lines for header and footer
-        
-        # Adjust scroll position if needed
+        # Adjust scroll position if needed, so that the cursor is on screen below any headers
         if current_pos < scroll_pos:
             scroll_pos = current_pos
-        elif current_pos >= scroll_pos + visible_items:
-            scroll_pos = current_pos - visible_items + 1
+        layout = _layout(task_list, scroll_pos, list_rows)
+        while layout and current_pos > _last_position(layout):
+            scroll_pos += 1
+            layout = _layout(task_list, scroll_pos, list_rows)
         
         # Draw header
         header = "TODOMD - Select Tasks"
-
-        # Avoid writing to the right edge of the screen
-        header_text = header.center(max_x-1)
-        instructions = "Press SPACE to select a task, ENTER to confirm, q to quit"
-        instructions_text = instructions.center(max_x-1)
-        
-        stdscr.addstr(0, 0, header_text, curses.color_pair(1))
-        stdscr.addstr(1, 0, instructions_text)
-        
-        # Draw tasks
-        y = 3  # Start drawing from line 3
-        current_datasource = None
-        current_path = None
-        
-        # Clear all task lines to prevent ghosting
-        for clear_y in range(3, max_y-1):
-            stdscr.addstr(clear_y, 0, " " * (max_x-1))
+        if filtering:
+            instructions = "Type to filter, ENTER to go back to the list, ESC to clear the filter"
+        else:
+            instructions = "Press SPACE to select a task, / to filter, ENTER to confirm, q to quit"
+        screen.draw(0, 0, header.center(max_x-1), curses.color_pair(1))
+        screen.draw(1, 0, instructions.center(max_x-1))
+        if stream is not None:
+            screen.draw(2, 0, _loading_status(stream).center(max_x-1), curses.color_pair(4))
         
-        for i in range(scroll_pos, min(len(display_items), scroll_pos + visible_items)):
-            task, is_selected = display_items[i]
-            
-            # Display datasource header if different from previous
-            if current_datasource != task.datasource:
-                current_datasource = task.datasource
-                if y < max_y - 1:  # Check if we have space
-                    stdscr.addstr(y, 2, f"  {current_datasource}".ljust(max_x-4), curses.color_pair(4))
-                    y += 1
-            
-            # Display directory header if different from previous and not empty
-            if task.path is not None and current_path != task.path:
-                current_path = task.path
-                if y < max_y - 1:  # Check if we have space
-                    stdscr.addstr(y, 4, f"  {task.path}".ljust(max_x-6), curses.color_pair(5))
-                    y += 1
-            
-            # Skip if we run out of space
-            if y >= max_y - 1:
-                break
-            
-            # Prepare selection marker and task line
-            marker = "[x]" if is_selected else "[ ]"
-            # Display project name (last directory or filename) with task name
-            task_line = f"{marker} {task.name}"
-            
-            # Ensure the line is padded to clear any previous content
-            padded_line = task_line.ljust(max_x-4)
-            
-            # Determine indentation level based on structure
-            indent = 6 if task.path is not None else 4
-            
-            # Highlight current position
-            if i == current_pos:
-                stdscr.addstr(y, indent, padded_line, curses.color_pair(2))
+        # Draw tasks from line 3
+        for row in range(list_rows):
+            if row >= len(layout):
+                screen.draw(3 + row, 0, "")
+                continue
+
+            indent, text, kind = layout[row]
+            if kind == "datasource":
+                screen.draw(3 + row, indent, text, curses.color_pair(4))
+            elif kind == "path":
+                screen.draw(3 + row, indent, text, curses.color_pair(5))
             else:
-                attr = curses.color_pair(3) if is_selected else curses.A_NORMAL
-                stdscr.addstr(y, indent, padded_line, attr)
-            
-            y += 1
+                is_selected = task_list.is_selected(task_list[kind])
+                marker = "[x]" if is_selected else "[ ]"
+                # Highlight current position
+                if kind == current_pos:
+                    attr = curses.color_pair(2)
+                else:
+                    attr = curses.color_pair(3) if is_selected else curses.A_NORMAL
+                screen.draw(3 + row, indent, f"{marker} {text}", attr)
         
         # Draw footer
-        footer = f"Selected: {sum(1 for _, selected in display_items if selected)} of {len(display_items)} tasks"
+        footer = f"Selected: {len(task_list.selected)} of {task_list.total} tasks"
+        if filtering or task_list.query:
+            footer = f"/{task_list.query}{'_' if filtering else ''}  ({len(task_list)} shown)  {footer}"
         # Avoid writing to the bottom-right corner of the screen (max_y-1, max_x-1)
         # which can cause an error in curses
-        footer_text = footer.center(max_x-1)  # Leave one character of space at the end
-        stdscr.addstr(max_y-1, 0, footer_text, curses.color_pair(1))
+        screen.draw(max_y-1, 0, footer.center(max_x-1), curses.color_pair(1))
         
         # Refresh screen
-        stdscr.refresh()
+        stdscr.noutrefresh()
+        curses.doupdate()
         
-        # Handle keys
+        # Handle keys. While tasks are loading, stop waiting for a key to show the
+        # tasks that have arrived.
+        stdscr.timeout(-1 if stream is None or stream.finished else 100)
         key = stdscr.getch()
+        while key == -1 and stream is not None and not stream.finished and not stream.pending():
+            key = stdscr.getch()
+        if key == -1:
+            continue
+
+        if filtering and key not in (curses.KEY_UP, curses.KEY_DOWN, curses.KEY_RESIZE):
+            if key in (10, 27):  # Enter keeps the filter, ESC clears it
+                filtering = False
+                if key == 27:
+                    task_list.set_filter("")
+                    current_pos = scroll_pos = 0
+            elif key in (curses.KEY_BACKSPACE, 127, 8):
+                task_list.set_filter(task_list.query[:-1])
+                current_pos = scroll_pos = 0
+            elif 32 <= key < 127:
+                task_list.set_filter(task_list.query + chr(key))
+                current_pos = scroll_pos = 0
+            continue
        
         if (key == curses.KEY_UP or key == ord('k')) and current_pos > 0:
             current_pos -= 1
-        elif (key == curses.KEY_DOWN or key == ord('j')) and current_pos < len(display_items) - 1:
+        elif (key == curses.KEY_DOWN or key == ord('j')) and current_pos < len(task_list) - 1:
             current_pos += 1
         elif key == ord(' '):  # Space to toggle selection
-            if current_pos < len(display_items):
-                task, is_selected = display_items[current_pos]
-                display_items[current_pos] = (task, not is_selected)
+            if current_pos < len(task_list):
+                task_list.toggle(task_list[current_pos])
+        elif key == ord('/'):  # Start typing a filter
+            filtering = True
+        elif key == curses.KEY_RESIZE:
+            screen.reset()
         elif key == 10:  # Enter to confirm
             # Add selected tasks to result
-            for task, is_selected in display_items:
-                if is_selected:
-                    selected_tasks.append(task)
+            selected_tasks.extend(task_list.selected_tasks())
             return
         elif key == ord('q') or key == 27:  # q or ESC to quit
             return
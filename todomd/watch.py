@@ -0,0 +1,171 @@
+'''
+Long running mode that keeps the todo file and the datasources in sync.
+
+The datasources, their tasks and the parsed todo file are kept in memory
+between polls. Every few seconds the todo file is stat'ed and each datasource
+is asked for its fingerprint, a cheap summary such as the size and mtime of
+its files. Only the datasources that changed are re-read; datasources without
+a fingerprint are re-read every `refresh` seconds.
+
+Whenever either side changed, the todo file is compared to the datasources
+against the sync state, as in a normal run: completion changed in the todo
+file is sent to the datasources, changes made in the datasources are written
+to the todo file, and tasks changed on both sides are reported and left alone.
+The state is saved after every poll.
+'''
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from .model import Datasource, Task
+from . import datasource, parse_cache, sync, task, todo_file
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for changes
+DEFAULT_INTERVAL = 2.0
+
+# Seconds between reads of datasources that can't tell when they changed
+DEFAULT_REFRESH = 300.0
+
+
+def _todo_file_key(file_path: str) -> Optional[parse_cache.FileKey]:
+    try:
+        return parse_cache.file_key(os.stat(file_path))
+    except FileNotFoundError:
+        return None
+
+
+class Watcher:
+    '''
+    Keeps a todo file and its datasources in sync. Call poll() to pick up the
+    changes made since the last call, or run() to poll until interrupted.
+    '''
+
+    def __init__(self, todo_file_path: str, datasources: Dict[str, Datasource],
+                 workers: int = datasource.DEFAULT_WORKERS, interval: float = DEFAULT_INTERVAL,
+                 refresh: float = DEFAULT_REFRESH):
+        self.datasources = datasources
+        self.workers = workers
+        self.interval = interval
+        self.refresh = refresh
+        self.doc = todo_file.TodoDocument.load(todo_file_path)
+        self.state = sync.SyncState.load(todo_file_path)
+
+        # Last known tasks of each datasource, with its fingerprint and the time it was read
+        self.datasource_tasks: Dict[str, task.TaskIndex] = {ds_name: task.TaskIndex([]) for ds_name in datasources}
+        self._fingerprints: Dict[str, object] = {}
+        self._read_at: Dict[str, float] = {}
+
+        self._read_datasources(list(datasources))
+        self._sync()
+
+    def _read_datasources(self, names: List[str]) -> None:
+        now = time.monotonic()
+        for ds_name in names:
+            ds = self.datasources[ds_name]
+            try:
+                self._fingerprints[ds_name] = ds.fingerprint() if ds.fingerprint else None
+            except Exception as e:
+                logger.error("Error checking datasource %s for changes: %s", ds_name, e)
+                self._fingerprints[ds_name] = None
+            self._read_at[ds_name] = now
+
+        results = datasource.read_each({ds_name: self.datasources[ds_name] for ds_name in names}, self.workers)
+        for ds_name, tasks in results.items():
+            # A datasource that couldn't be read keeps the tasks it had
+            if tasks is not None:
+                self.datasource_tasks[ds_name] = task.TaskIndex(tasks)
+
+    def _changed_datasources(self) -> List[str]:
+        now = time.monotonic()
+        changed = []
+        for ds_name, ds in self.datasources.items():
+            if ds.fingerprint is None:
+                if now - self._read_at[ds_name] >= self.refresh:
+                    changed.append(ds_name)
+                continue
+            try:
+                fingerprint = ds.fingerprint()
+            except Exception as e:
+                logger.error("Error checking datasource %s for changes: %s", ds_name, e)
+                continue
+            if fingerprint != self._fingerprints.get(ds_name):
+                changed.append(ds_name)
+        return changed
+
+    def _push(self, diffs: Dict[str, List[Task]]) -> None:
+        '''
+        Send the given changes to their datasources and record the ones written
+        '''
+        for ds_name, diff in diffs.items():
+            logger.info("Sending %d changed tasks to datasource %s", len(diff), ds_name)
+        for run in datasource.push_changes(self.datasources, diffs, self.workers):
+            pushed = datasource.pushed_tasks(diffs[run.name], run)
+            self.state.record(pushed)
+            # Keep the datasource's last known tasks current until it is read again
+            ds_index = self.datasource_tasks[run.name]
+            for t in pushed:
+                ds_index.find(t).completed = t.completed
+
+    def _sync(self) -> None:
+        '''
+        Re-read the todo file if it changed, then send the changes made in it to
+        the datasources and write the changes made in the datasources to it,
+        going by the sync state. The state is saved afterwards.
+        '''
+        if _todo_file_key(self.doc.file_path) != self.doc.key:
+            self.doc = todo_file.TodoDocument.load(self.doc.file_path)
+        todo_index = task.TaskIndex(self.doc.tasks)
+
+        diffs: Dict[str, List[Task]] = {}
+        to_todo: List[Task] = []
+        for ds_name, ds_index in self.datasource_tasks.items():
+            changes = sync.diff(todo_index, ds_index, self.state, ds_name)
+            sync.log_conflicts(changes.conflicts)
+            self.state.record(changes.in_sync)
+            to_todo.extend(changes.to_todo)
+            diff = sync.completion_changes(changes.to_datasource, ds_index)
+            if diff:
+                diffs[ds_name] = diff
+
+        if diffs:
+            self._push(diffs)
+
+        updated = self.doc.update_tasks(to_todo)
+        self.state.record(updated)
+        if self.doc.commit():
+            logger.info("Updated %d tasks in %s", len(updated), self.doc.file_path)
+        self.state.prune(self.doc.tasks)
+        self.state.save()
+
+    def poll(self) -> None:
+        '''
+        Pick up the changes made to the todo file and the datasources since the
+        last poll
+        '''
+        todo_changed = _todo_file_key(self.doc.file_path) != self.doc.key
+        changed = self._changed_datasources()
+        if changed:
+            logger.info("Datasources changed: %s", ", ".join(changed))
+            self._read_datasources(changed)
+        if todo_changed or changed:
+            self._sync()
+
+    def run(self) -> None:
+        '''
+        Poll for changes every `interval` seconds until interrupted. A poll that
+        fails, such as on a todo file caught half written by an editor, is logged
+        and tried again at the next one.
+        '''
+        logger.info("Watching %s and %d datasources", self.doc.file_path, len(self.datasources))
+        try:
+            while True:
+                time.sleep(self.interval)
+                try:
+                    self.poll()
+                except Exception:
+                    logger.exception("Error syncing %s, trying again in %gs", self.doc.file_path, self.interval)
+        except KeyboardInterrupt:
+            logger.info("Stopped watching %s", self.doc.file_path)